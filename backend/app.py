@@ -1,11 +1,24 @@
-from flask import Flask
+import os
+from flask import Flask, Request
 from flask_cors import CORS
 import config
-from database.db import init_db
+from database.db import init_db, rebuild_rating_stats
+
+
+class CaptionRequest(Request):
+    """Request class that allows larger bodies on the batch upload endpoint"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'caption.generate_caption_batch':
+            return config.BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
 
 def create_app():
     """Application factory pattern for Flask app"""
     app = Flask(__name__)
+    app.request_class = CaptionRequest
 
     # Load configuration
     app.config.from_object(config)
@@ -21,17 +34,43 @@ def create_app():
     from routes.rating import rating_bp
     from routes.history import history_bp
     from routes.models import models_bp
+    from routes.stats import stats_bp
+    from routes.jobs import jobs_bp, job_queue
 
     app.register_blueprint(caption_bp, url_prefix='/api')
     app.register_blueprint(rating_bp, url_prefix='/api')
     app.register_blueprint(history_bp, url_prefix='/api')
     app.register_blueprint(models_bp, url_prefix='/api')
+    app.register_blueprint(stats_bp, url_prefix='/api')
+    app.register_blueprint(jobs_bp, url_prefix='/api')
+
+    # Start inference workers; they resume jobs left queued or running
+    # by a previous process
+    job_queue.start()
+
+    from routes.caption import warm_up, get_caption_generator
+    if config.MODEL_EAGER_LOAD:
+        warm_up.start()
+
+    @app.cli.command('rebuild-rating-stats')
+    def rebuild_rating_stats_command():
+        """Rebuild rating aggregates from the ratings table"""
+        rebuild_rating_stats()
+        print("Rating stats rebuilt")
 
     @app.route('/health')
     def health():
         """Health check endpoint"""
         return {'status': 'healthy'}, 200
 
+    @app.route('/ready')
+    def ready():
+        """Readiness endpoint: 503 until the model warm-up has finished"""
+        status = warm_up.status()
+        status['pid'] = os.getpid()
+        status['model'] = get_caption_generator().get_model_status()
+        return status, 200 if status['ready'] else 503
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+"""
+Compare the PyTorch and ONNX Runtime inference backends on CPU.
+
+Both backends share one loaded model. Reports the one-off ONNX export
+time, median caption latency for each backend at batch size 1 and the
+batch size given, and whether the captions agree.
+
+Usage:
+    python benchmarks/bench_backend.py [--images DIR] [--runs 3] [--batch-size 4] [--model NAME]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bench_quantization import load_images
+
+
+def time_backend(backend, preprocessor, images, batch_size: int, runs: int, max_length: int) -> float:
+    """Median milliseconds per caption"""
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    pixel_values = [preprocessor(batch) for batch in batches]
+    backend.generate(pixel_values[0], max_length=max_length)  # warm up
+
+    timings = []
+    for _ in range(runs):
+        for values in pixel_values:
+            start = time.perf_counter()
+            backend.generate(values, max_length=max_length)
+            timings.append((time.perf_counter() - start) * 1000 / len(values))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', help='Directory of .jpg/.png images (default: synthetic set)')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per batch')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--max-length', type=int, default=50)
+    parser.add_argument('--model', help='Model name or path (default: MODEL_NAME)')
+    args = parser.parse_args()
+
+    if args.model:
+        os.environ['MODEL_NAME'] = args.model
+
+    import config
+    from models.model_loader import ModelLoader
+    from models.inference_backend import TorchBackend, OnnxBlipBackend
+    from models.tensor_preprocessor import TensorPreprocessor
+
+    images = load_images(args.images)
+    loader = ModelLoader()
+    loader.load_model()
+    preprocessor = TensorPreprocessor.from_processor(loader.processor)
+    processor = loader.processor
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config.MODEL_CACHE_DIR = Path(cache_dir)
+        start = time.perf_counter()
+        backends = {'torch': TorchBackend(loader), 'onnx': OnnxBlipBackend(loader)}
+        export_seconds = time.perf_counter() - start
+
+        print(f"ONNX export + session setup: {export_seconds:.1f}s")
+        print(f"{'backend':>8} | {'batch 1 ms':>10} | {f'batch {args.batch_size} ms':>10}")
+        latencies = {}
+        for name, backend in backends.items():
+            single = time_backend(backend, preprocessor, images, 1, args.runs, args.max_length)
+            batched = time_backend(backend, preprocessor, images, args.batch_size, args.runs, args.max_length)
+            latencies[name] = single
+            print(f"{name:>8} | {single:>10.1f} | {batched:>10.1f}")
+        print(f"speedup at batch 1: {latencies['torch'] / latencies['onnx']:.2f}x")
+
+        pixel_values = preprocessor(images)
+        captions = {
+            name: processor.batch_decode(backend.generate(pixel_values, max_length=args.max_length),
+                                         skip_special_tokens=True)
+            for name, backend in backends.items()
+        }
+
+    identical = sum(a == b for a, b in zip(captions['torch'], captions['onnx']))
+    print(f"caption agreement: {identical}/{len(images)} identical")
+    for a, b in zip(captions['torch'], captions['onnx']):
+        if a != b:
+            print(f"  torch: {a}\n   onnx: {b}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare the cost of caption cache hits and misses on the upload path.
+
+Measures the work /api/caption does before the model call:
+- raw hit: hash the upload while reading it, look up the cache
+- canonical hit: decode, convert, thumbnail, re-encode, hash, look up
+- miss: same as canonical hit, plus storing the caption
+
+Usage:
+    python benchmarks/bench_cache_fast_path.py [--width 4000 --height 3000 --runs 20]
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from services.cache_service import CacheService
+from services.image_processor import ImageProcessor
+
+
+def make_upload(width: int, height: int, seed: int) -> bytes:
+    """Create a noisy JPEG so the encoder can't shortcut flat colour"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize((width, height), Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def as_file(data: bytes) -> FileStorage:
+    return FileStorage(stream=io.BytesIO(data), filename='upload.jpg', content_type='image/jpeg')
+
+
+def raw_path(cache: CacheService, data: bytes):
+    _, upload_hash = ImageProcessor.read_upload(as_file(data))
+    return cache.get_by_hash(upload_hash)
+
+
+def canonical_path(cache: CacheService, data: bytes, store: bool = False):
+    image_data, upload_hash = ImageProcessor.read_upload(as_file(data))
+    image = ImageProcessor.decode_image(image_data)
+    image_bytes = ImageProcessor.image_to_bytes(image)
+    caption = cache.get(image_bytes)
+    if store:
+        cache.set(image_bytes, 'caption')
+        cache.set_by_hash(upload_hash, 'caption')
+    return caption
+
+
+def timed(fn, runs: int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def report(name: str, samples: list[float]):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<16} median {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    uploads = [make_upload(args.width, args.height, seed) for seed in range(args.runs)]
+    print(f"Upload: {args.width}x{args.height} JPEG, ~{len(uploads[0]) / 1e6:.1f} MB, {args.runs} runs\n")
+
+    cache = CacheService(max_entries=0, max_bytes=0, ttl=0)
+    misses = iter(uploads)
+    report('miss', timed(lambda: canonical_path(cache, next(misses), store=True), args.runs))
+
+    hot = uploads[0]
+    report('canonical hit', timed(lambda: canonical_path(cache, hot), args.runs))
+    report('raw hit', timed(lambda: raw_path(cache, hot), args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Compare full-resolution and reduced-resolution decoding of camera-sized uploads.
+
+For each resolution, measures:
+- native: decode every pixel, then one LANCZOS resize
+- previous: convert, then Image.thumbnail (which only uses JPEG draft mode
+  when no conversion loaded the image first, and only down to 2x the target)
+- reduced: ImageProcessor.decode_image (JPEG DCT scaling to the target size,
+  integer reduce for other formats, then LANCZOS)
+
+Latency is the median of --runs decodes. Peak memory is the rise in peak
+RSS (VmHWM) during a single decode, measured in a fresh interpreter so
+memory freed by earlier runs can't hide it (Linux only).
+
+Usage:
+    python benchmarks/bench_decode.py [--runs 10] [--png]
+"""
+import argparse
+import io
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image
+
+import config
+from services.image_processor import ImageProcessor
+
+RESOLUTIONS = [
+    ('8MP', 3264, 2448),
+    ('12MP', 4032, 3024),
+    ('24MP', 6000, 4000),
+    ('48MP', 8064, 6048),
+]
+
+
+def make_upload(width: int, height: int, format: str, mode: str = 'RGB') -> bytes:
+    """Create a noisy photo-sized image so the encoder can't shortcut flat colour"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height // 4, width // 4, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize((width, height), Image.Resampling.BILINEAR).convert(mode)
+    buffer = io.BytesIO()
+    if format == 'JPEG':
+        image.save(buffer, format='JPEG', quality=85)
+    else:
+        image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def decode_native(image_data: bytes) -> Image.Image:
+    """Full-resolution decode, then a single LANCZOS resize"""
+    image = Image.open(io.BytesIO(image_data)).convert('RGB')
+    image.thumbnail((config.MAX_IMAGE_DIMENSION,) * 2, Image.Resampling.LANCZOS, reducing_gap=None)
+    return image
+
+
+def decode_previous(image_data: bytes) -> Image.Image:
+    """Decode path before reduced-resolution decoding"""
+    image = Image.open(io.BytesIO(image_data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    max_dim = config.MAX_IMAGE_DIMENSION
+    if max(image.size) > max_dim:
+        image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+    return image
+
+
+DECODERS = {
+    'native': decode_native,
+    'previous': decode_previous,
+    'reduced': ImageProcessor.decode_image,
+}
+
+
+def _status_kb(field: str) -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not found in /proc/self/status")
+
+
+def measure_peak_mb(name: str, path: str) -> float:
+    """Peak RSS increase (MB) for one decode, run in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, __file__, '--peak', name, path],
+        check=True, capture_output=True, text=True
+    )
+    return float(result.stdout)
+
+
+def _peak_child(name: str, path: str):
+    image_data = Path(path).read_bytes()
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')  # reset VmHWM to the current RSS
+    baseline = _status_kb('VmRSS')
+    DECODERS[name](image_data)
+    print((_status_kb('VmHWM') - baseline) / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--png', action='store_true', help='Benchmark PNG uploads instead of JPEG')
+    parser.add_argument('--gray', action='store_true', help='Use grayscale uploads (need converting to RGB)')
+    parser.add_argument('--peak', nargs=2, metavar=('DECODER', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.peak:
+        _peak_child(*args.peak)
+        return
+
+    format = 'PNG' if args.png else 'JPEG'
+    mode = 'L' if args.gray else 'RGB'
+
+    print(f"{mode} {format} uploads, target {config.MAX_IMAGE_DIMENSION}px, median of {args.runs} runs")
+    header = f"{'size':>6} {'upload':>8}"
+    for name in DECODERS:
+        header += f" | {name + ' ms':>11} {'peak MB':>8}"
+    print(header + f" | {'speedup':>7} {'diff':>5}")
+
+    for label, width, height in RESOLUTIONS:
+        image_data = make_upload(width, height, format, mode)
+        with tempfile.NamedTemporaryFile(suffix='.' + format.lower()) as upload:
+            upload.write(image_data)
+            upload.flush()
+
+            row = f"{label:>6} {len(image_data) / 1e6:>6.1f}MB"
+            timings = {}
+            for name, decode in DECODERS.items():
+                decode(image_data)  # warm up
+                runs = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    decode(image_data)
+                    runs.append((time.perf_counter() - start) * 1000)
+                timings[name] = statistics.median(runs)
+                row += f" | {timings[name]:>11.1f} {measure_peak_mb(name, upload.name):>8.1f}"
+
+        # Mean absolute pixel difference (0-255) against the native result
+        native = np.asarray(decode_native(image_data), dtype=np.float32)
+        reduced = np.asarray(ImageProcessor.decode_image(image_data), dtype=np.float32)
+        diff = float(np.abs(native - reduced).mean()) if native.shape == reduced.shape else float('nan')
+
+        print(row + f" | {timings['previous'] / timings['reduced']:>6.1f}x {diff:>5.2f}")
+
+
+if __name__ == '__main__':
+    main()
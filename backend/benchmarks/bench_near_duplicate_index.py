@@ -0,0 +1,57 @@
+"""
+Measure NearDuplicateIndex insert and lookup cost as it grows.
+
+Usage:
+    python benchmarks/bench_near_duplicate_index.py [--entries 300000 --distance 4]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.near_duplicate_index import NearDuplicateIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=300000)
+    parser.add_argument('--distance', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    index = NearDuplicateIndex(max_distance=args.distance, max_entries=0)
+    hashes = [rng.getrandbits(64) for _ in range(args.entries)]
+
+    start = time.perf_counter()
+    for i, h in enumerate(hashes):
+        index.add(h, f"caption {i}")
+    insert_us = (time.perf_counter() - start) / args.entries * 1e6
+
+    # Half the queries are near duplicates of indexed hashes, half are random
+    queries = []
+    for i in range(args.queries):
+        if i % 2 == 0:
+            h = rng.choice(hashes)
+            for bit in rng.sample(range(64), rng.randint(0, args.distance)):
+                h ^= 1 << bit
+            queries.append(h)
+        else:
+            queries.append(rng.getrandbits(64))
+
+    start = time.perf_counter()
+    hits = sum(1 for q in queries if index.find(q) is not None)
+    lookup_us = (time.perf_counter() - start) / args.queries * 1e6
+
+    print(f"entries: {args.entries}, max distance: {args.distance}")
+    print(f"insert: {insert_us:.2f} us/entry")
+    print(f"lookup: {lookup_us:.2f} us/query ({hits}/{args.queries} matched)")
+    print(index.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Compare memory use of serve.py with one worker and with N workers.
+
+Starts serve.py on a free port, waits until every worker reports ready,
+captions a few images so each worker has run inference, and sums RSS and
+PSS over the master and its workers from /proc/<pid>/smaps_rollup. PSS
+splits shared (copy-on-write) pages between the processes mapping them,
+so unlike RSS it adds up to the real total.
+
+Usage:
+    python benchmarks/bench_prefork_memory.py [--workers 4] [--model NAME] [--requests 16]
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bench_quantization import synthetic_images
+from serve import process_memory
+
+SERVE = Path(__file__).parent.parent / 'serve.py'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _children(pid: int) -> list[int]:
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _get_ready(port: int):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=5) as response:
+            return json.load(response)
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+
+def _post_image(port: int, image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="bench.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + buffer.getvalue() + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/api/caption', data=body,
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    )
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+
+
+def measure(workers: int, requests: int, env: dict, timeout: float = 600) -> dict:
+    """Start serve.py with this many workers and return summed memory"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, str(SERVE), '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        # Until every worker has answered ready at least once
+        ready_pids = set()
+        deadline = time.monotonic() + timeout
+        while len(ready_pids) < workers:
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError(f"serve.py with {workers} workers did not become ready")
+            status = _get_ready(port)
+            if status and status['ready']:
+                ready_pids.add(status['pid'])
+            else:
+                time.sleep(0.5)
+
+        # Caption requests are cache misses (distinct images), spread over the workers
+        images = (synthetic_images() * (requests // 12 + 1))[:requests]
+        for i, image in enumerate(images):
+            image.putpixel((0, 0), (i % 256, i // 256, 7))
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            list(pool.map(lambda image: _post_image(port, image), images))
+
+        pids = [process.pid] + _children(process.pid)
+        memory = [process_memory(pid) for pid in pids]
+        return {
+            'workers': workers,
+            'rss_mb': sum(m['rss_mb'] for m in memory),
+            'pss_mb': sum(m['pss_mb'] for m in memory),
+            'worker_private_mb': sum(m['private_mb'] for m in memory[1:]) / workers,
+        }
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=16, help='Caption requests before measuring')
+    parser.add_argument('--model', help='Model name or path (default: MODEL_NAME)')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MODEL_EAGER_LOAD='True')
+    if args.model:
+        env['MODEL_NAME'] = args.model
+
+    single = measure(1, args.requests, env)
+    multi = measure(args.workers, args.requests, env)
+
+    print(f"{'workers':>8} | {'sum RSS MB':>10} | {'total PSS MB':>12} | {'private MB/worker':>17}")
+    for result in [single, multi]:
+        print(f"{result['workers']:>8} | {result['rss_mb']:>10.0f} | {result['pss_mb']:>12.0f} | "
+              f"{result['worker_private_mb']:>17.0f}")
+    separate = single['pss_mb'] * args.workers
+    print(f"{args.workers} separate single-worker servers: ~{separate:.0f}MB; "
+          f"pre-fork: {multi['pss_mb']:.0f}MB ({separate / multi['pss_mb']:.1f}x less)")
+    print(f"each extra worker costs {(multi['pss_mb'] - single['pss_mb']) / max(args.workers - 1, 1):.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Compare fp32 and dynamic int8 BLIP on CPU.
+
+Each mode runs in its own interpreter so resident memory is measured
+cleanly. Reports load time (with a cold and a warm int8 cache), median
+caption latency, RSS after loading and after inference, and how often the
+int8 captions agree with fp32 on a fixed image set.
+
+Usage:
+    python benchmarks/bench_quantization.py [--images DIR] [--runs 3] [--model NAME]
+
+Without --images, a fixed set of synthetic images is used; real photos
+give far more meaningful agreement numbers.
+"""
+import argparse
+import difflib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def synthetic_images(count: int = 12) -> list[Image.Image]:
+    """Deterministic images with shapes and gradients"""
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(count):
+        gradient = np.linspace(0, 255, 384, dtype=np.uint8)
+        base = np.stack([np.tile(gradient, (384, 1)), np.tile(gradient[:, None], (1, 384)),
+                         np.full((384, 384), rng.integers(0, 256), dtype=np.uint8)], axis=-1)
+        image = Image.fromarray(base)
+        draw = ImageDraw.Draw(image)
+        for _ in range(3):
+            x, y = rng.integers(0, 300, size=2)
+            size = rng.integers(30, 120)
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            if i % 2:
+                draw.ellipse([x, y, x + size, y + size], fill=color)
+            else:
+                draw.rectangle([x, y, x + size, y + size], fill=color)
+        images.append(image)
+    return images
+
+
+def load_images(directory) -> list[Image.Image]:
+    if directory is None:
+        return synthetic_images()
+    paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    return [Image.open(p).convert('RGB') for p in paths]
+
+
+def _rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run_child(mode: str, images_dir, runs: int, max_length: int):
+    """Load one model variant and caption every image (runs in a fresh interpreter)"""
+    import config
+    config.MODEL_QUANTIZATION = mode
+    from models.model_loader import ModelLoader
+    from models import CaptionGenerator
+
+    config.BATCHING_ENABLED = False
+    images = load_images(images_dir)
+    baseline = _rss_mb()
+
+    start = time.perf_counter()
+    generator = CaptionGenerator()
+    generator.model_loader.load_model()
+    load_seconds = time.perf_counter() - start
+    loaded_rss = _rss_mb()
+
+    captions, latencies = [], []
+    for image in images:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            caption = generator._generate_batch_with_blip([image], max_length)[0]
+            timings.append((time.perf_counter() - start) * 1000)
+        captions.append(caption)
+        latencies.append(statistics.median(timings))
+
+    print(json.dumps({
+        'mode': mode,
+        'load_seconds': load_seconds,
+        'rss_loaded_mb': loaded_rss - baseline,
+        'rss_peak_mb': _rss_mb() - baseline,
+        'latency_ms': statistics.median(latencies),
+        'captions': captions,
+        'cache_path': str(ModelLoader.quantized_cache_path()),
+    }))
+
+
+def measure(mode: str, args, env: dict) -> dict:
+    command = [sys.executable, __file__, '--child', mode, '--runs', str(args.runs),
+               '--max-length', str(args.max_length)]
+    if args.images:
+        command += ['--images', args.images]
+    result = subprocess.run(command, check=True, capture_output=True, text=True, env=env)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', help='Directory of .jpg/.png images (default: synthetic set)')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per image')
+    parser.add_argument('--max-length', type=int, default=50)
+    parser.add_argument('--model', help='Model name or path (default: MODEL_NAME)')
+    parser.add_argument('--child', choices=['none', 'int8'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.images, args.runs, args.max_length)
+        return
+
+    env = dict(os.environ)
+    if args.model:
+        env['MODEL_NAME'] = args.model
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Cold run builds the int8 cache, warm run loads it
+        env['MODEL_CACHE_DIR'] = cache_dir
+        fp32 = measure('none', args, env)
+        int8_cold = measure('int8', args, env)
+        int8 = measure('int8', args, env)
+        cache_mb = Path(int8['cache_path']).stat().st_size / 1e6
+
+    print(f"{'':>10} | {'load s':>7} | {'RSS MB':>7} {'peak MB':>8} | {'latency ms':>10}")
+    for label, result in [('fp32', fp32), ('int8', int8)]:
+        print(f"{label:>10} | {result['load_seconds']:>7.2f} | {result['rss_loaded_mb']:>7.0f} "
+              f"{result['rss_peak_mb']:>8.0f} | {result['latency_ms']:>10.1f}")
+    print(f"int8 load without cache: {int8_cold['load_seconds']:.2f}s, cache file {cache_mb:.0f}MB")
+    print(f"speedup: {fp32['latency_ms'] / int8['latency_ms']:.2f}x, "
+          f"memory: {fp32['rss_peak_mb'] / int8['rss_peak_mb']:.2f}x less")
+
+    exact = sum(a == b for a, b in zip(fp32['captions'], int8['captions']))
+    similarity = statistics.mean(
+        difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+        for a, b in zip(fp32['captions'], int8['captions'])
+    )
+    print(f"caption agreement: {exact}/{len(fp32['captions'])} identical, "
+          f"mean token similarity {similarity:.3f}")
+    for a, b in zip(fp32['captions'], int8['captions']):
+        if a != b:
+            print(f"  fp32: {a}\n  int8: {b}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Load test rating inserts under each DB_WRITE_MODE.
+
+Runs concurrent clients against a throwaway database and reports
+throughput both for the bare Rating.create write path and for
+POST /api/rate through the Flask app in-process.
+
+Usage:
+    python benchmarks/bench_rate_throughput.py [--threads 16 --requests 200 --synchronous FULL --dir .]
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+
+
+def run_concurrently(fn, threads: int, requests_per_thread: int) -> float:
+    """Run fn(i) from several threads and return calls per second"""
+    def loop():
+        for i in range(requests_per_thread):
+            fn(i)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return threads * requests_per_thread / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per thread')
+    parser.add_argument('--synchronous', default='FULL', help='SQLite synchronous pragma')
+    parser.add_argument('--dir', default=None, help='directory for the throwaway database (use a real disk)')
+    args = parser.parse_args()
+
+    config.DB_SYNCHRONOUS = args.synchronous
+    from app import create_app
+    from database.models import Rating
+    from database.write_behind import get_write_stats, shutdown_write_queue
+
+    def rate_direct(i):
+        Rating.create(f'bench-{i}', 'benchmark caption', i % 5 + 1)
+
+    print(f"{args.threads} threads x {args.requests} requests, synchronous={args.synchronous}\n")
+    for mode in ('sync', 'group', 'async'):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            config.DATABASE_PATH = Path(tmp) / 'bench.db'
+            config.DB_WRITE_MODE = mode
+            app = create_app()
+
+            direct = run_concurrently(rate_direct, args.threads, args.requests)
+
+            client = app.test_client()
+
+            def rate_http(i):
+                response = client.post('/api/rate', json={
+                    'image_id': f'bench-{i}', 'caption': 'benchmark caption', 'rating': i % 5 + 1
+                })
+                assert response.status_code == 201, response.get_json()
+
+            http = run_concurrently(rate_http, args.threads, args.requests)
+
+            stats = get_write_stats()
+            shutdown_write_queue()
+            print(f"{mode:<6} Rating.create {direct:8.0f}/s   POST /api/rate {http:8.0f} req/s"
+                  f"   avg batch {stats['avg_batch_size']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare BlipProcessor with the vectorized TensorPreprocessor for building
+BLIP's pixel_values batch.
+
+Inputs are decoded uploads as they leave ImageProcessor (RGB, at most
+MAX_IMAGE_DIMENSION on a side). Reports the median time per batch and per
+image, and the largest difference between the two outputs.
+
+Usage:
+    python benchmarks/bench_tensor_preprocess.py [--runs 20] [--threads N]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BlipImageProcessor
+
+import config
+from models.tensor_preprocessor import TensorPreprocessor
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+
+
+def make_images(count: int) -> list[Image.Image]:
+    rng = np.random.default_rng(0)
+    max_dim = config.MAX_IMAGE_DIMENSION
+    sizes = [(max_dim, max_dim * 2 // 3), (max_dim * 3 // 4, max_dim), (max_dim, max_dim)]
+    return [
+        Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+        for w, h in (sizes[i % len(sizes)] for i in range(count))
+    ]
+
+
+def median_ms(fn, runs: int) -> float:
+    fn()  # warm up (allocates reusable buffers)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    image_processor = BlipImageProcessor()
+    preprocessor = TensorPreprocessor.from_processor(image_processor)
+
+    print(f"torch threads: {torch.get_num_threads()}, median of {args.runs} runs")
+    print(f"{'batch':>5} | {'BlipProcessor ms':>16} {'per image':>9} | {'vectorized ms':>13} {'per image':>9} | {'speedup':>7} {'max diff':>9}")
+
+    for batch_size in BATCH_SIZES:
+        images = make_images(batch_size)
+
+        def reference():
+            return image_processor(images, return_tensors='pt')['pixel_values']
+
+        def vectorized():
+            with preprocessor.batch(images) as pixel_values:
+                return pixel_values
+
+        reference_ms = median_ms(reference, args.runs)
+        vectorized_ms = median_ms(vectorized, args.runs)
+        diff = torch.max(torch.abs(reference() - preprocessor(images))).item()
+
+        print(f"{batch_size:>5} | {reference_ms:>16.2f} {reference_ms / batch_size:>9.2f} | "
+              f"{vectorized_ms:>13.2f} {vectorized_ms / batch_size:>9.2f} | "
+              f"{reference_ms / vectorized_ms:>6.1f}x {diff:>9.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,19 +14,137 @@ UPLOAD_FOLDER.mkdir(exist_ok=True)
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+# Batch upload configuration (/api/captions/batch)
+BATCH_CAPTION_MAX_FILES = int(os.getenv('BATCH_CAPTION_MAX_FILES', '32'))
+BATCH_MAX_CONTENT_LENGTH = 128 * 1024 * 1024  # 128MB max request size
+BATCH_DECODE_WORKERS = int(os.getenv('BATCH_DECODE_WORKERS', '4'))
+
 # Database configuration
 DATABASE_PATH = BASE_DIR / 'data.db'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))  # idle connections kept open
+DB_BUSY_TIMEOUT = 5  # seconds to wait on a locked database
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')  # OFF, NORMAL or FULL
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '20000'))  # page cache per connection
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+
+# History/rating inserts: 'sync' commits per request, 'group' waits for a
+# shared batch commit, 'async' returns before the row is written (ratings
+# only: caption rows hold upload references, so they always wait)
+DB_WRITE_MODE = os.getenv('DB_WRITE_MODE', 'group')
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '64'))
+DB_WRITE_BATCH_DELAY_MS = float(os.getenv('DB_WRITE_BATCH_DELAY_MS', '5'))
 
 # Model configuration
 MODEL_NAME = os.getenv('MODEL_NAME', 'Salesforce/blip-image-captioning-base')
 USE_GEMINI = os.getenv('USE_GEMINI', 'False').lower() == 'true'
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '30'))  # seconds per HTTP attempt
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))  # requests in flight
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '60'))  # 0 disables
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', '5'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '3'))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', '0.5'))  # seconds, doubled per retry
+# Consecutive failed calls that open the circuit, and seconds before a probe
+GEMINI_CIRCUIT_FAILURES = int(os.getenv('GEMINI_CIRCUIT_FAILURES', '5'))
+GEMINI_CIRCUIT_RESET = float(os.getenv('GEMINI_CIRCUIT_RESET', '30'))
+
+# 'int8' applies dynamic int8 quantization to BLIP's Linear layers (CPU only);
+# the converted model is cached in MODEL_CACHE_DIR
+MODEL_QUANTIZATION = os.getenv('MODEL_QUANTIZATION', 'none')
+MODEL_CACHE_DIR = Path(os.getenv('MODEL_CACHE_DIR', str(BASE_DIR / 'model_cache')))
+
+# 'onnx' runs BLIP on ONNX Runtime (CPU), exporting it to MODEL_CACHE_DIR on
+# first use; falls back to 'torch' if onnxruntime or the export is unavailable
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # 0 lets ONNX Runtime decide
+
+# Vision encoder outputs kept per image hash, so re-captioning an image only
+# runs the text decoder (about 1.8MB per image for BLIP base). Entries evicted
+# from memory spill to MODEL_CACHE_DIR if EMBEDDING_CACHE_SPILL_MAX_BYTES > 0
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+EMBEDDING_CACHE_SPILL_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_SPILL_MAX_BYTES', '0'))
+
+# Caption length limit in tokens (BLIP); part of the caption cache key
+CAPTION_MAX_LENGTH = int(os.getenv('CAPTION_MAX_LENGTH', '50'))
+
+# Alternative captions (num_candidates on /api/caption): BLIP samples them
+# with nucleus sampling from one encoder pass
+CAPTION_MAX_CANDIDATES = int(os.getenv('CAPTION_MAX_CANDIDATES', '5'))
+CANDIDATE_TOP_P = float(os.getenv('CANDIDATE_TOP_P', '0.9'))
+CANDIDATE_TEMPERATURE = float(os.getenv('CANDIDATE_TEMPERATURE', '1.0'))
+
+# Load the model and run a warm-up inference in the background at start-up
+MODEL_EAGER_LOAD = os.getenv('MODEL_EAGER_LOAD', 'False').lower() == 'true'
+MODEL_LOAD_TIMEOUT = float(os.getenv('MODEL_LOAD_TIMEOUT', '120'))  # seconds a request waits for loading
+
+# serve.py: pre-fork workers sharing one loaded model
+SERVE_HOST = os.getenv('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.getenv('SERVE_PORT', '5001'))
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '2'))
+SERVE_TORCH_THREADS = int(os.getenv('SERVE_TORCH_THREADS', '0'))  # per worker; 0 splits the CPU cores evenly
 
 # Performance configuration
 CACHE_ENABLED = True
-INFERENCE_TIMEOUT = 30  # seconds
-TARGET_INFERENCE_TIME = 5  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '0'))  # 0 disables expiry
+
+# Persistent cache tier, shared by all worker processes on the host
+DISK_CACHE_ENABLED = os.getenv('DISK_CACHE_ENABLED', 'True').lower() == 'true'
+DISK_CACHE_PATH = Path(os.getenv('DISK_CACHE_PATH', str(BASE_DIR / 'cache.db')))
+DISK_CACHE_MAX_ENTRIES = int(os.getenv('DISK_CACHE_MAX_ENTRIES', '200000'))
+DISK_CACHE_MAX_BYTES = int(os.getenv('DISK_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Near-duplicate caption reuse via perceptual hashing
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', 'False').lower() == 'true'
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '4'))  # bits out of 64
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '500000'))
+
+# Uploads are downscaled to fit within this before storage and inference
 MAX_IMAGE_DIMENSION = 512  # pixels
 
+# Per-request deadline and hedged requests: start the other backend (BLIP
+# or Gemini) when the configured one hasn't answered within its recent
+# HEDGE_PERCENTILE latency
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '30'))  # per-request deadline, seconds
+TARGET_INFERENCE_TIME = float(os.getenv('TARGET_INFERENCE_TIME', '5'))  # hedge delay until p95 is known
+HEDGING_ENABLED = os.getenv('HEDGING_ENABLED', 'False').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.5'))  # seconds
+
+# Image preprocessing (decode, resize, canonical hash) in worker processes;
+# 0 workers runs it inline on the request thread
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', '2'))
+PREPROCESS_QUEUE_DEPTH = int(os.getenv('PREPROCESS_QUEUE_DEPTH', '2'))  # in-flight images per worker
+
+# Batching configuration (BLIP only)
+BATCHING_ENABLED = os.getenv('BATCHING_ENABLED', 'True').lower() == 'true'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
+
+# Vectorized BLIP input preprocessing instead of BlipProcessor per batch
+TENSOR_PREPROCESSING_ENABLED = os.getenv('TENSOR_PREPROCESSING_ENABLED', 'True').lower() == 'true'
+
+# Admission control: concurrent inferences and the wait queue in front of
+# them; requests beyond the queue, or expected to wait longer than
+# ADMISSION_MAX_WAIT seconds, get 429 with Retry-After. Keep
+# ADMISSION_MAX_CONCURRENT at least BATCH_MAX_SIZE so batches can fill.
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'True').lower() == 'true'
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '8'))
+ADMISSION_MAX_QUEUED = int(os.getenv('ADMISSION_MAX_QUEUED', '32'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '30'))
+
+# Asynchronous caption jobs (/api/jobs)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))  # inference worker threads
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '100'))  # queued jobs before 503
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', '30'))  # longest long-poll, seconds
+JOB_POLL_INTERVAL = 2  # seconds between backlog checks by idle workers
+JOB_STALE_SECONDS = 300  # running jobs not updated for this long are requeued
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))  # runs before a job is failed
+
 # CORS configuration
 CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
@@ -1,4 +1,4 @@
-from .db import init_db, get_db
-from .models import Rating, CaptionHistory
+from .db import init_db, get_db, db_connection, close_db
+from .models import Rating, CaptionHistory, CaptionJob
 
-__all__ = ['init_db', 'get_db', 'Rating', 'CaptionHistory']
+__all__ = ['init_db', 'get_db', 'db_connection', 'close_db', 'Rating', 'CaptionHistory', 'CaptionJob']
@@ -1,13 +1,320 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 import config
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(config.DATABASE_PATH)
+
+def _configure(conn: sqlite3.Connection):
+    """Apply per-connection pragmas"""
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run concurrently with a writer; NORMAL skips the
+    # fsync on every commit (still durable across application crashes)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={config.DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size={-config.DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={config.DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+
+def get_db():
+    """Get a new standalone database connection"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=config.DB_BUSY_TIMEOUT)
+    _configure(conn)
     return conn
 
+
+class ConnectionPool:
+    """
+    Small pool of long-lived SQLite connections.
+
+    Connections are reused across requests, so pragmas are applied once
+    and sqlite3's per-connection statement cache keeps prepared
+    statements alive between calls. If every pooled connection is in
+    use, an overflow connection is opened and closed again on release.
+    """
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=config.DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE
+        )
+        _configure(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    """Get the process-wide pool, rebuilding it after a fork or path change"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid() or pool.path != config.DATABASE_PATH:
+        with _pool_lock:
+            pool = _pool
+            if pool is None or pool.pid != os.getpid() or pool.path != config.DATABASE_PATH:
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close_all()
+                # Connections inherited across fork are never reused
+                pool = _pool = ConnectionPool(config.DATABASE_PATH, config.DB_POOL_SIZE)
+    return pool
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a pooled database connection.
+
+    Usage:
+        with db_connection() as conn:
+            conn.execute(...)
+
+    Any transaction left open when the block exits is rolled back.
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def close_db():
+    """Close all idle pooled connections"""
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close_all()
+
+
+# Rollup scopes kept in rating_stats: (scope, SQL for the key given a ratings row)
+RATING_STATS_SCOPES = [
+    ('global', "''"),
+    ('model', "COALESCE((SELECT model_used FROM captions WHERE id = {row}.image_id), 'unknown')"),
+    ('image', '{row}.image_id'),
+    ('day', 'date({row}.created_at)'),
+]
+
+
+def _rating_stats_upsert(scope: str, key_sql: str, row: str, sign: int) -> str:
+    """Statement adding (sign=1) or removing (sign=-1) one rating from a rollup"""
+    key_sql = key_sql.format(row=row)
+    histogram = ', '.join(f'{sign} * ({row}.rating = {n})' for n in range(1, 6))
+    updates = ', '.join(f'count_{n} = count_{n} + excluded.count_{n}' for n in range(1, 6))
+    return f'''
+        INSERT INTO rating_stats (scope, key, rating_sum, rating_count,
+                                  count_1, count_2, count_3, count_4, count_5)
+        VALUES ('{scope}', {key_sql}, {sign} * {row}.rating, {sign}, {histogram})
+        ON CONFLICT(scope, key) DO UPDATE SET
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_count = rating_count + excluded.rating_count,
+            {updates};
+    '''
+
+
+def _rating_stats_backfill(scope: str, key_sql: str) -> str:
+    """Statement rebuilding one rollup scope from the ratings table"""
+    key_sql = key_sql.format(row='ratings')
+    histogram = ', '.join(f'SUM(rating = {n})' for n in range(1, 6))
+    return f'''
+        INSERT INTO rating_stats (scope, key, rating_sum, rating_count,
+                                  count_1, count_2, count_3, count_4, count_5)
+        SELECT '{scope}', {key_sql} AS stats_key, SUM(rating), COUNT(*), {histogram}
+        FROM ratings
+        GROUP BY stats_key
+    '''
+
+
+RATING_STATS_BACKFILL = ['DELETE FROM rating_stats'] + [
+    _rating_stats_backfill(scope, key_sql) for scope, key_sql in RATING_STATS_SCOPES
+]
+
+
+# Schema migrations applied by init_db, tracked in PRAGMA user_version.
+# Append new entries; never edit one that has shipped.
+MIGRATIONS = [
+    # 1: keyset pagination over history, optionally filtered by model
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_captions_created_at_id
+        ON captions(created_at, id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_captions_model_created_at_id
+        ON captions(model_used, created_at, id)
+        ''',
+    ],
+    # 2: O(1) rating aggregates, kept up to date by triggers
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS rating_stats (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            count_1 INTEGER NOT NULL DEFAULT 0,
+            count_2 INTEGER NOT NULL DEFAULT 0,
+            count_3 INTEGER NOT NULL DEFAULT 0,
+            count_4 INTEGER NOT NULL DEFAULT 0,
+            count_5 INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_stats_insert
+        AFTER INSERT ON ratings
+        BEGIN
+            {''.join(_rating_stats_upsert(scope, key_sql, 'NEW', 1) for scope, key_sql in RATING_STATS_SCOPES)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_stats_delete
+        AFTER DELETE ON ratings
+        BEGIN
+            {''.join(_rating_stats_upsert(scope, key_sql, 'OLD', -1) for scope, key_sql in RATING_STATS_SCOPES)}
+        END
+        ''',
+        *RATING_STATS_BACKFILL,
+    ],
+    # 3: asynchronous caption jobs
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS caption_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL CHECK(status IN ('queued', 'running', 'done', 'failed')),
+            filename TEXT NOT NULL,
+            upload_hash TEXT NOT NULL,
+            image_id TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            caption TEXT,
+            model_used TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_caption_jobs_status_created_at
+        ON caption_jobs(status, created_at)
+        ''',
+    ],
+    # 4: alternative captions generated with the main one (JSON array)
+    [
+        'ALTER TABLE captions ADD COLUMN candidates TEXT',
+    ],
+    # 5: content-addressed uploads, one file per distinct image shared by
+    # every captions row that refers to it
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS images (
+            hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_captions_release_image
+        AFTER DELETE ON captions
+        BEGIN
+            UPDATE images SET ref_count = ref_count - 1 WHERE path = OLD.image_path;
+        END
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_caption_jobs_image_id
+        ON caption_jobs(image_id)
+        ''',
+    ],
+    # 6: raw upload hashes of each stored image, so a repeat upload reuses
+    # the stored (preprocessed) file without being decoded again
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS image_uploads (
+            upload_hash TEXT PRIMARY KEY,
+            image_hash TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_image_uploads_image_hash
+        ON image_uploads(image_hash)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_images_forget_uploads
+        AFTER DELETE ON images
+        BEGIN
+            DELETE FROM image_uploads WHERE image_hash = OLD.hash;
+        END
+        ''',
+    ],
+]
+
+
+def _migrate(conn: sqlite3.Connection):
+    """Apply pending schema migrations"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        # Explicit BEGIN so DDL and the version bump commit atomically
+        conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied database migration {number}")
+
+
+def rebuild_rating_stats():
+    """Recompute every rating rollup from the ratings table"""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in RATING_STATS_BACKFILL:
+            conn.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
 def init_db():
     """Initialize database with schema"""
     db_path = Path(config.DATABASE_PATH)
@@ -46,6 +353,8 @@ def init_db():
     ''')
 
     conn.commit()
+
+    _migrate(conn)
     conn.close()
 
     print(f"Database initialized at {db_path}")
@@ -1,7 +1,10 @@
+import base64
+import json
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
-from .db import get_db
+from .db import db_connection
+from .write_behind import execute_write, execute_write_many, flush_pending_writes
 
 @dataclass
 class CaptionHistory:
@@ -11,55 +14,182 @@ class CaptionHistory:
     caption: str
     model_used: str
     created_at: datetime
+    candidates: Optional[list[str]] = None
 
     @staticmethod
-    def create(image_id: str, image_path: str, caption: str, model_used: str) -> 'CaptionHistory':
-        """Create new caption record"""
-        conn = get_db()
-        cursor = conn.cursor()
+    def create(image_id: str, image_path: str, caption: str, model_used: str,
+               candidates: Optional[list[str]] = None) -> 'CaptionHistory':
+        """
+        Create new caption record.
 
-        cursor.execute('''
-            INSERT INTO captions (id, image_path, caption, model_used)
-            VALUES (?, ?, ?, ?)
-        ''', (image_id, image_path, caption, model_used))
-
-        conn.commit()
-        conn.close()
+        Args:
+            candidates: All captions offered for the image, if more than
+                one was generated (caption is the first)
+        """
+        # Waited for even in async mode: the row holds a reference to the
+        # stored upload, which the caller releases if the insert fails
+        execute_write('''
+            INSERT INTO captions (id, image_path, caption, model_used, candidates)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (image_id, image_path, caption, model_used, json.dumps(candidates) if candidates else None),
+                      wait=True)
 
         return CaptionHistory(
             id=image_id,
             image_path=image_path,
             caption=caption,
             model_used=model_used,
-            created_at=datetime.now()
+            created_at=datetime.now(),
+            candidates=candidates
+        )
+
+    @staticmethod
+    def create_many(records: list[tuple[str, str, str, str]]) -> list['CaptionHistory']:
+        """
+        Create several caption records in one transaction.
+
+        Args:
+            records: (image_id, image_path, caption, model_used) tuples
+        """
+        # Waited for even in async mode, like create
+        execute_write_many('''
+            INSERT INTO captions (id, image_path, caption, model_used)
+            VALUES (?, ?, ?, ?)
+        ''', records, wait=True)
+
+        now = datetime.now()
+        return [
+            CaptionHistory(
+                id=image_id,
+                image_path=image_path,
+                caption=caption,
+                model_used=model_used,
+                created_at=now
+            )
+            for image_id, image_path, caption, model_used in records
+        ]
+
+    @staticmethod
+    def get(image_id: str) -> Optional['CaptionHistory']:
+        """Get a caption record by image id"""
+        flush_pending_writes()
+        with db_connection() as conn:
+            row = conn.execute('''
+                SELECT id, image_path, caption, model_used, created_at, candidates
+                FROM captions
+                WHERE id = ?
+            ''', (image_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return CaptionHistory(
+            id=row['id'],
+            image_path=row['image_path'],
+            caption=row['caption'],
+            model_used=row['model_used'],
+            created_at=datetime.fromisoformat(row['created_at']),
+            candidates=json.loads(row['candidates']) if row['candidates'] else None
         )
 
     @staticmethod
     def get_all(limit: int = 50) -> list['CaptionHistory']:
         """Get all caption history records"""
-        conn = get_db()
-        cursor = conn.cursor()
+        records, _ = CaptionHistory.get_page(limit=limit)
+        return records
 
-        cursor.execute('''
-            SELECT id, image_path, caption, model_used, created_at
-            FROM captions
-            ORDER BY created_at DESC
-            LIMIT ?
-        ''', (limit,))
+    @staticmethod
+    def get_page(limit: int = 50, cursor: Optional[str] = None, model_used: Optional[str] = None,
+                 created_after: Optional[datetime] = None,
+                 created_before: Optional[datetime] = None) -> tuple[list['CaptionHistory'], Optional[str]]:
+        """
+        Get one page of caption history, newest first.
 
-        rows = cursor.fetchall()
-        conn.close()
+        Uses keyset pagination on (created_at, id), so every page is an
+        index range scan no matter how deep it is.
 
-        return [
+        Args:
+            limit: Number of records to return
+            cursor: next_cursor from the previous page
+            model_used: Only return captions from this model
+            created_after: Only return captions created at or after this time
+            created_before: Only return captions created before this time
+
+        Returns:
+            (records, next_cursor) where next_cursor is None on the last page
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        conditions = []
+        params = []
+
+        if model_used:
+            conditions.append('model_used = ?')
+            params.append(model_used)
+        if created_after:
+            conditions.append('created_at >= ?')
+            params.append(_to_db_timestamp(created_after))
+        if created_before:
+            conditions.append('created_at < ?')
+            params.append(_to_db_timestamp(created_before))
+        if cursor:
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend(_decode_cursor(cursor))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        flush_pending_writes()
+        with db_connection() as conn:
+            # Fetch one extra row to learn whether another page exists
+            rows = conn.execute(f'''
+                SELECT id, image_path, caption, model_used, created_at, candidates
+                FROM captions
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (*params, limit + 1)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        records = [
             CaptionHistory(
                 id=row['id'],
                 image_path=row['image_path'],
                 caption=row['caption'],
                 model_used=row['model_used'],
-                created_at=datetime.fromisoformat(row['created_at'])
+                created_at=datetime.fromisoformat(row['created_at']),
+                candidates=json.loads(row['candidates']) if row['candidates'] else None
             )
             for row in rows
         ]
+        return records, next_cursor
+
+
+def _to_db_timestamp(value: datetime) -> str:
+    """Format a datetime the way SQLite's CURRENT_TIMESTAMP stores it"""
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _encode_cursor(created_at: str, record_id: str) -> str:
+    """Encode the last row's sort key as an opaque cursor"""
+    payload = json.dumps([created_at, record_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    """Decode a cursor produced by _encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, record_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(created_at, str) or not isinstance(record_id, str):
+            raise TypeError()
+        return created_at, record_id
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
 
 
 @dataclass
@@ -77,18 +207,12 @@ class Rating:
         if not 1 <= rating <= 5:
             raise ValueError("Rating must be between 1 and 5")
 
-        conn = get_db()
-        cursor = conn.cursor()
-
-        cursor.execute('''
+        # None when DB_WRITE_MODE is 'async' and the row is not yet written
+        rating_id = execute_write('''
             INSERT INTO ratings (image_id, caption, rating)
             VALUES (?, ?, ?)
         ''', (image_id, caption, rating))
 
-        rating_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-
         return Rating(
             id=rating_id,
             image_id=image_id,
@@ -100,18 +224,14 @@ class Rating:
     @staticmethod
     def get_by_image_id(image_id: str) -> list['Rating']:
         """Get all ratings for an image"""
-        conn = get_db()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT id, image_id, caption, rating, created_at
-            FROM ratings
-            WHERE image_id = ?
-            ORDER BY created_at DESC
-        ''', (image_id,))
-
-        rows = cursor.fetchall()
-        conn.close()
+        flush_pending_writes()
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, image_id, caption, rating, created_at
+                FROM ratings
+                WHERE image_id = ?
+                ORDER BY created_at DESC
+            ''', (image_id,)).fetchall()
 
         return [
             Rating(
@@ -127,11 +247,215 @@ class Rating:
     @staticmethod
     def get_average_rating() -> float:
         """Get average rating across all captions"""
-        conn = get_db()
-        cursor = conn.cursor()
+        stats = Rating.get_stats('global')
+        return stats['average'] if stats else 0.0
+
+    @staticmethod
+    def get_stats(scope: str, key: str = '') -> Optional[dict]:
+        """
+        Get the rating rollup for one scope.
+
+        Rollups are maintained by triggers on every insert, so this is a
+        single primary-key lookup regardless of table size.
 
-        cursor.execute('SELECT AVG(rating) as avg_rating FROM ratings')
-        row = cursor.fetchone()
-        conn.close()
+        Args:
+            scope: 'global', 'model', 'image' or 'day'
+            key: Model name, image id or YYYY-MM-DD date ('' for global)
+
+        Returns:
+            Dict with count, average and histogram, or None if nothing was rated
+        """
+        flush_pending_writes()
+        with db_connection() as conn:
+            row = conn.execute('''
+                SELECT key, rating_sum, rating_count, count_1, count_2, count_3, count_4, count_5
+                FROM rating_stats
+                WHERE scope = ? AND key = ?
+            ''', (scope, key)).fetchone()
+
+        return _rating_stats_from_row(row) if row else None
+
+    @staticmethod
+    def get_stats_by_scope(scope: str) -> dict[str, dict]:
+        """Get every rating rollup in a scope, keyed by model name, image id or date"""
+        flush_pending_writes()
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT key, rating_sum, rating_count, count_1, count_2, count_3, count_4, count_5
+                FROM rating_stats
+                WHERE scope = ? AND rating_count > 0
+            ''', (scope,)).fetchall()
+
+        return {row['key']: _rating_stats_from_row(row) for row in rows}
+
+
+def _rating_stats_from_row(row) -> Optional[dict]:
+    """Convert a rating_stats row to count, average and histogram"""
+    count = row['rating_count']
+    if not count:
+        return None
+    return {
+        'count': count,
+        'average': row['rating_sum'] / count,
+        'histogram': {str(n): row[f'count_{n}'] for n in range(1, 6)},
+    }
+
+
+@dataclass
+class CaptionJob:
+    """Asynchronous caption job model"""
+    id: str
+    status: str
+    filename: str
+    upload_hash: str
+    image_id: str
+    image_path: str
+    caption: Optional[str]
+    model_used: Optional[str]
+    error: Optional[str]
+    attempts: int
+    created_at: datetime
+    updated_at: datetime
+
+    # Job state is written straight through (never via the write-behind
+    # queue) so a job is never lost or run twice across restarts
+
+    @staticmethod
+    def create(job_id: str, filename: str, upload_hash: str, image_id: str, image_path: str) -> 'CaptionJob':
+        """Create a queued job"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO caption_jobs (id, status, filename, upload_hash, image_id, image_path)
+                VALUES (?, 'queued', ?, ?, ?, ?)
+            ''', (job_id, filename, upload_hash, image_id, image_path))
+
+        return CaptionJob.get(job_id)
+
+    @staticmethod
+    def create_done(job_id: str, filename: str, upload_hash: str, image_id: str, image_path: str,
+                    caption: str, model_used: str) -> 'CaptionJob':
+        """Create a job that is already complete (e.g. answered from cache)"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO caption_jobs (id, status, filename, upload_hash, image_id, image_path,
+                                          caption, model_used)
+                VALUES (?, 'done', ?, ?, ?, ?, ?, ?)
+            ''', (job_id, filename, upload_hash, image_id, image_path, caption, model_used))
+
+        return CaptionJob.get(job_id)
+
+    @staticmethod
+    def get(job_id: str) -> Optional['CaptionJob']:
+        """Get a job by id"""
+        with db_connection() as conn:
+            row = conn.execute('''
+                SELECT id, status, filename, upload_hash, image_id, image_path, caption,
+                       model_used, error, attempts, created_at, updated_at
+                FROM caption_jobs
+                WHERE id = ?
+            ''', (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return CaptionJob(
+            id=row['id'],
+            status=row['status'],
+            filename=row['filename'],
+            upload_hash=row['upload_hash'],
+            image_id=row['image_id'],
+            image_path=row['image_path'],
+            caption=row['caption'],
+            model_used=row['model_used'],
+            error=row['error'],
+            attempts=row['attempts'],
+            created_at=datetime.fromisoformat(row['created_at']),
+            updated_at=datetime.fromisoformat(row['updated_at'])
+        )
+
+    @staticmethod
+    def claim(job_id: str) -> bool:
+        """
+        Atomically move a queued job to running.
+
+        Returns:
+            True if this caller claimed the job, False if another worker did
+        """
+        with db_connection() as conn, conn:
+            cursor = conn.execute('''
+                UPDATE caption_jobs
+                SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (job_id,))
+            return cursor.rowcount == 1
+
+    @staticmethod
+    def touch(job_id: str):
+        """Mark a running job as still alive, so it isn't requeued as stale"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                UPDATE caption_jobs
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (job_id,))
+
+    @staticmethod
+    def requeue(job_id: str):
+        """Give a running job back to the queue without counting the attempt"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                UPDATE caption_jobs
+                SET status = 'queued', attempts = attempts - 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (job_id,))
+
+    @staticmethod
+    def complete(job_id: str, caption: str, model_used: str):
+        """Mark a job as done"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                UPDATE caption_jobs
+                SET status = 'done', caption = ?, model_used = ?, error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (caption, model_used, job_id))
+
+    @staticmethod
+    def fail(job_id: str, error: str):
+        """Mark a job as failed, unless another run already finished it"""
+        with db_connection() as conn, conn:
+            conn.execute('''
+                UPDATE caption_jobs
+                SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status != 'done'
+            ''', (error, job_id))
+
+    @staticmethod
+    def requeue_stale(stale_after: float) -> int:
+        """
+        Requeue running jobs whose worker stopped updating them (e.g. after
+        a crash or restart).
+
+        Returns:
+            Number of jobs requeued
+        """
+        with db_connection() as conn, conn:
+            cursor = conn.execute('''
+                UPDATE caption_jobs
+                SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND updated_at < datetime('now', ?)
+            ''', (f'-{int(stale_after)} seconds',))
+            return cursor.rowcount
+
+    @staticmethod
+    def get_queued_ids(limit: int) -> list[str]:
+        """Get the oldest queued job ids"""
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT id FROM caption_jobs
+                WHERE status = 'queued'
+                ORDER BY created_at
+                LIMIT ?
+            ''', (limit,)).fetchall()
 
-        return row['avg_rating'] if row['avg_rating'] else 0.0
+        return [row['id'] for row in rows]
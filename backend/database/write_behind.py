@@ -0,0 +1,277 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+import config
+from .db import db_connection
+
+WRITE_MODES = ('sync', 'group', 'async')
+
+
+class _PendingWrite:
+    """Single queued INSERT (or executemany group) and its outcome"""
+
+    __slots__ = ('sql', 'params', 'many', 'done', 'lastrowid', 'error')
+
+    def __init__(self, sql: str, params, many: bool = False):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.done = threading.Event()
+        self.lastrowid = None
+        self.error = None
+
+
+class WriteBehindQueue:
+    """
+    Batches INSERT statements into a single transaction.
+
+    A background thread commits queued writes once max_batch rows are
+    waiting or max_delay_ms has passed since the oldest one, so one
+    commit (and at most one fsync) is shared by many requests. Rows
+    queued while a commit is running are picked up by the next batch. If the
+    batch fails, each row is retried in its own transaction so one bad
+    row cannot take the others down with it.
+    """
+
+    def __init__(self, max_batch: Optional[int] = None, max_delay_ms: Optional[float] = None):
+        self.max_batch = max(1, config.DB_WRITE_BATCH_SIZE if max_batch is None else max_batch)
+        self.max_delay = (config.DB_WRITE_BATCH_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000.0
+        self.pid = os.getpid()
+
+        self._queue = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+        self._worker.start()
+
+        # Stats
+        self._total_writes = 0
+        self._total_batches = 0
+
+    def submit(self, sql: str, params, many: bool = False) -> _PendingWrite:
+        """
+        Queue a write; wait on the returned object's done event for the commit.
+
+        With many=True, params is a list of parameter tuples that are
+        always committed together in the same transaction.
+        """
+        write = _PendingWrite(sql, params, many)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Write-behind queue is shut down")
+            self._queue.append(write)
+            self._cond.notify_all()
+        return write
+
+    def has_pending(self) -> bool:
+        with self._cond:
+            return bool(self._queue) or self._in_flight > 0
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every write queued so far has been committed.
+
+        Returns:
+            True if the queue drained within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _next_batch(self) -> list:
+        """Wait for a batch to fill up or time out and take it off the queue"""
+        with self._cond:
+            while self._running and not self._queue:
+                self._cond.wait()
+            if not self._queue:
+                return []
+
+            deadline = time.monotonic() + self.max_delay
+            while self._running and len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            self._in_flight = len(batch)
+            return batch
+
+    def _commit(self, batch: list):
+        """Write a batch in one transaction, falling back to row by row"""
+        with db_connection() as conn:
+            try:
+                with conn:
+                    for write in batch:
+                        self._execute(conn, write)
+                return
+            except sqlite3.Error:
+                pass
+
+            for write in batch:
+                try:
+                    with conn:
+                        self._execute(conn, write)
+                except sqlite3.Error as e:
+                    write.error = e
+                    print(f"Error writing queued row: {e}")
+
+    @staticmethod
+    def _execute(conn: sqlite3.Connection, write: _PendingWrite):
+        if write.many:
+            conn.executemany(write.sql, write.params)
+        else:
+            write.lastrowid = conn.execute(write.sql, write.params).lastrowid
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return  # Shut down and drained
+
+            try:
+                self._commit(batch)
+            except Exception as e:
+                for write in batch:
+                    write.error = e
+                print(f"Error committing write batch: {e}")
+
+            with self._cond:
+                self._in_flight = 0
+                self._total_writes += len(batch)
+                self._total_batches += 1
+                self._cond.notify_all()
+            for write in batch:
+                write.done.set()
+
+    def shutdown(self, timeout: Optional[float] = 10):
+        """Flush outstanding writes and stop the worker thread"""
+        if self.pid != os.getpid():
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'mode': config.DB_WRITE_MODE,
+                'pending': len(self._queue) + self._in_flight,
+                'total_writes': self._total_writes,
+                'total_batches': self._total_batches,
+                'avg_batch_size': round(self._total_writes / self._total_batches, 2) if self._total_batches else 0.0,
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> WriteBehindQueue:
+    """Get the process-wide write queue, starting it on first use"""
+    global _queue
+    if _queue is None or _queue.pid != os.getpid():
+        with _queue_lock:
+            if _queue is None or _queue.pid != os.getpid():
+                # Group commit callers are blocked waiting, so holding the batch
+                # open only adds latency: rows that arrive while a commit is
+                # running already form the next batch
+                delay = None if config.DB_WRITE_MODE == 'async' else 0
+                _queue = WriteBehindQueue(max_delay_ms=delay)
+    return _queue
+
+
+def shutdown_write_queue():
+    """Flush outstanding writes and stop the queue (runs at exit)"""
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+    if queue is not None:
+        queue.shutdown()
+
+
+atexit.register(shutdown_write_queue)
+
+
+def execute_write(sql: str, params: tuple, wait: bool = False) -> Optional[int]:
+    """
+    Run an INSERT according to config.DB_WRITE_MODE.
+
+    - sync: commit on the calling thread
+    - group: queue it and wait for the shared batch commit
+    - async: queue it and return immediately (no row id)
+
+    Args:
+        wait: Wait for the commit even in async mode, for callers that
+            must hear about a failed insert
+
+    Returns:
+        The inserted row id, or None in async mode without wait
+    """
+    mode = config.DB_WRITE_MODE
+    if mode not in WRITE_MODES:
+        raise ValueError(f"Unknown DB_WRITE_MODE '{mode}', expected one of {', '.join(WRITE_MODES)}")
+
+    if mode == 'sync':
+        with db_connection() as conn, conn:
+            return conn.execute(sql, params).lastrowid
+
+    write = get_write_queue().submit(sql, params)
+    if mode == 'async' and not wait:
+        return None
+
+    write.done.wait()
+    if write.error is not None:
+        raise write.error
+    return write.lastrowid
+
+
+def execute_write_many(sql: str, rows: list[tuple], wait: bool = False):
+    """
+    Run an INSERT for several rows in a single transaction, honouring
+    config.DB_WRITE_MODE and wait like execute_write.
+    """
+    mode = config.DB_WRITE_MODE
+    if mode not in WRITE_MODES:
+        raise ValueError(f"Unknown DB_WRITE_MODE '{mode}', expected one of {', '.join(WRITE_MODES)}")
+    if not rows:
+        return
+
+    if mode == 'sync':
+        with db_connection() as conn, conn:
+            conn.executemany(sql, rows)
+        return
+
+    write = get_write_queue().submit(sql, rows, many=True)
+    if mode == 'async' and not wait:
+        return
+
+    write.done.wait()
+    if write.error is not None:
+        raise write.error
+
+
+def flush_pending_writes():
+    """Make queued writes visible before a read"""
+    if _queue is not None and _queue.pid == os.getpid() and _queue.has_pending():
+        _queue.flush()
+
+
+def get_write_stats() -> dict:
+    """Get write-behind queue statistics"""
+    if _queue is None or _queue.pid != os.getpid():
+        return {'mode': config.DB_WRITE_MODE, 'pending': 0, 'total_writes': 0,
+                'total_batches': 0, 'avg_batch_size': 0.0}
+    return _queue.stats()
@@ -1,3 +1,4 @@
 from .caption_generator import CaptionGenerator
+from .warmup import ModelWarmUp
 
-__all__ = ['CaptionGenerator']
+__all__ = ['CaptionGenerator', 'ModelWarmUp']
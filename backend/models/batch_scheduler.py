@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Hashable, Optional
+
+
+class _PendingRequest:
+    """Single caller waiting for its slot in a batch"""
+
+    __slots__ = ('item', 'key', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, item: Any, key: Hashable):
+        self.item = item
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching scheduler.
+
+    Concurrent callers submit single items; a background worker collects
+    them for up to max_wait_ms (or until max_batch_size is reached) and
+    runs batch_fn once for the whole group. Only items sharing the same
+    key are merged, so generation settings never get mixed in one batch.
+    """
+
+    def __init__(self, batch_fn: Callable[[list, Hashable], list],
+                 max_batch_size: int = 8, max_wait_ms: float = 10):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._running = False
+
+        # Stats
+        self._total_requests = 0
+        self._total_batches = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._batch_sizes = {}
+
+    def submit(self, item: Any, key: Hashable = None, timeout: Optional[float] = None) -> Any:
+        """
+        Queue an item and block until its batch has been processed.
+
+        Args:
+            item: Input passed to batch_fn as part of a list
+            key: Items are only batched with others sharing this key
+            timeout: Maximum seconds to wait for the result
+
+        Returns:
+            The result batch_fn produced for this item
+
+        Raises:
+            TimeoutError: If the result is not ready within timeout
+        """
+        request = _PendingRequest(item, key)
+
+        with self._cond:
+            self._ensure_worker()
+            self._pending.append(request)
+            self._total_requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            self._cond.notify()
+
+        if not request.done.wait(timeout):
+            with self._cond:
+                if request in self._pending:
+                    self._pending.remove(request)
+            raise TimeoutError("Timed out waiting for batched inference")
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use (caller holds the lock)"""
+        if self._worker is None or not self._worker.is_alive():
+            self._running = True
+            self._worker = threading.Thread(
+                target=self._run, name='blip-batch-scheduler', daemon=True
+            )
+            self._worker.start()
+
+    def _collect_batch(self) -> list:
+        """Wait for a batch window to close and pop its requests"""
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._running:
+                return []
+
+            # The window opens when the oldest request arrived
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            key = self._pending[0].key
+            while self._running:
+                same_key = sum(1 for r in self._pending if r.key == key)
+                remaining = deadline - time.monotonic()
+                if same_key >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            for request in list(self._pending):
+                if request.key == key:
+                    batch.append(request)
+                    if len(batch) == self.max_batch_size:
+                        break
+            for request in batch:
+                self._pending.remove(request)
+            if not batch:
+                # Every request in this window timed out while waiting
+                return batch
+
+            now = time.monotonic()
+            self._total_batches += 1
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._total_wait += sum(now - r.enqueued_at for r in batch)
+            return batch
+
+    def _run(self):
+        """Worker loop: collect a batch, run it, hand results back"""
+        while self._running:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            try:
+                results = self.batch_fn([r.item for r in batch], batch[0].key)
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"batch_fn returned {len(results)} results for {len(batch)} items"
+                    )
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+    def shutdown(self):
+        """Stop the worker thread; pending callers are released with an error"""
+        with self._cond:
+            self._running = False
+            pending = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        for request in pending:
+            request.error = RuntimeError("Batch scheduler shut down")
+            request.done.set()
+
+    def stats(self) -> dict:
+        """Get queue depth and batch size statistics"""
+        with self._cond:
+            batches = self._total_batches
+            batched_requests = sum(size * n for size, n in self._batch_sizes.items())
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': len(self._pending),
+                'max_queue_depth': self._max_queue_depth,
+                'total_requests': self._total_requests,
+                'total_batches': batches,
+                'avg_batch_size': round(batched_requests / batches, 2) if batches else 0.0,
+                'avg_wait_ms': round(self._total_wait / batched_requests * 1000.0, 2) if batched_requests else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            }
@@ -1,85 +1,484 @@
+import json
+import re
+from pathlib import Path
 from PIL import Image
+import threading
+from threading import Thread
+from typing import Iterator, Optional
 import torch
 import config
 from .model_loader import ModelLoader
+from .inference_backend import create_backend
+from .embedding_cache import EmbeddingCache
+from .gemini_client import GeminiClient, GeminiError
+from .deadline import Deadline, DeadlineExceeded, group_deadline
+from .hedging import Hedger
+from .batch_scheduler import BatchScheduler
+from .tensor_preprocessor import TensorPreprocessor
 
 PROMPT = 'You are a social media manager. Generate a social media caption based on the image. Make it witty and not cringey. Just return one caption.'
+CANDIDATES_PROMPT = 'You are a social media manager. Generate {n} different social media captions based on the image. Make them witty and not cringey. Return only a JSON array of {n} strings.'
+
+# Returned in place of a caption when BLIP fails; never cached
+FAILED_CAPTION = "Unable to generate caption at this time."
+
+def model_name(use_gemini: bool) -> str:
+    """Name a backend's captions are recorded under in history and cache keys"""
+    return 'gemini' if use_gemini else config.MODEL_NAME
+
 
 class CaptionGenerator:
     """Modular interface for generating image captions"""
 
     def __init__(self):
         self.use_gemini = config.USE_GEMINI
+        self.batch_scheduler = None
+        self.tensor_preprocessor = None
+        self.backend = None
+        # Guards lazy creation of the backend and tensor preprocessor
+        self._init_lock = threading.Lock()
+        self.embedding_cache = None
+        if config.EMBEDDING_CACHE_ENABLED:
+            self.embedding_cache = EmbeddingCache(
+                config.EMBEDDING_CACHE_MAX_BYTES,
+                spill_dir=Path(config.MODEL_CACHE_DIR) / 'embeddings' / (
+                    f"{ModelLoader.cache_name()}-{config.MODEL_QUANTIZATION}"
+                ),
+                spill_max_bytes=config.EMBEDDING_CACHE_SPILL_MAX_BYTES
+            )
+        if config.BATCHING_ENABLED:
+            self.batch_scheduler = BatchScheduler(
+                self._generate_scheduled_batch,
+                max_batch_size=config.BATCH_MAX_SIZE,
+                max_wait_ms=config.BATCH_MAX_WAIT_MS
+            )
         if self.use_gemini:
             self._init_gemini()
         else:
             self.model_loader = ModelLoader()
 
+        # Hedging needs the other backend as a fallback
+        self.hedger = None
+        if config.HEDGING_ENABLED:
+            if not config.GEMINI_API_KEY:
+                print("HEDGING_ENABLED needs GEMINI_API_KEY for the Gemini side, hedging disabled")
+            else:
+                if self.use_gemini:
+                    self.model_loader = ModelLoader()
+                else:
+                    self._init_gemini()
+                self.hedger = Hedger(config.HEDGE_PERCENTILE, config.HEDGE_MIN_DELAY,
+                                     config.TARGET_INFERENCE_TIME)
+
     def _init_gemini(self):
         """Initialize Gemini API client"""
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=config.GEMINI_API_KEY)
-            self.gemini_model = genai.GenerativeModel('gemini-2.5-flash')
-        except Exception as e:
-            print(f"Failed to initialize Gemini: {e}")
-            print("Falling back to BLIP model")
-            self.use_gemini = False
-            self.model_loader = ModelLoader()
+        self.gemini_client = GeminiClient()
 
-    def generate_caption(self, image: Image.Image, max_length: int = 50) -> str:
+    def generate_caption(self, image: Image.Image, max_length: int = 50,
+                         image_hash: Optional[str] = None, deadline: Optional[Deadline] = None) -> str:
         """
         Generate a caption for the given image.
 
         Args:
             image: PIL Image object
             max_length: Maximum length of generated caption
+            image_hash: Hash of the image, to reuse its vision embeddings
+                on a repeat caption
+            deadline: When the caller gives up (default: INFERENCE_TIMEOUT
+                from now); generation is cancelled once it expires
 
         Returns:
-            Generated caption string
+            Generated caption string, or FAILED_CAPTION if BLIP failed
+
+        Raises:
+            DeadlineExceeded: If no caption was ready before the deadline
+            GeminiUnavailable: With Gemini, if its circuit is open or the
+                rate limit is saturated
+            GeminiError: With Gemini, if the request failed after retries
+        """
+        return self.generate_caption_with_model(image, max_length, image_hash, deadline)[0]
+
+    def generate_caption_with_model(self, image: Image.Image, max_length: int = 50,
+                                    image_hash: Optional[str] = None,
+                                    deadline: Optional[Deadline] = None) -> tuple[str, str]:
         """
+        Generate a caption, reporting which model produced it.
+
+        With hedging this may be the other backend than the configured
+        one; otherwise it is always the configured one. Arguments and
+        errors are as for generate_caption.
+
+        Returns:
+            (caption, model name as given by model_name())
+        """
+        deadline = deadline or Deadline(config.INFERENCE_TIMEOUT)
+        if self.hedger is not None:
+            return self._generate_hedged(image, max_length, image_hash, deadline)
         if self.use_gemini:
-            return self._generate_with_gemini(image)
+            return self._generate_with_gemini(image, deadline), model_name(True)
         else:
-            return self._generate_with_blip(image, max_length)
+            return self._generate_with_blip(image, max_length, image_hash, deadline), model_name(False)
+
+    def _generate_hedged(self, image: Image.Image, max_length: int, image_hash: Optional[str],
+                         deadline: Deadline) -> tuple[str, str]:
+        """Configured backend first, the other one too if it is slower than usual"""
+        def gemini(branch_deadline):
+            return self._generate_with_gemini(image, branch_deadline)
+
+        def blip(branch_deadline):
+            return self._blip_caption(image, max_length, image_hash, branch_deadline)
+
+        primary, fallback = (gemini, blip) if self.use_gemini else (blip, gemini)
+        caption, winner = self.hedger.call(primary, fallback, deadline)
+        # The fallback is the backend that isn't configured
+        return caption, model_name(self.use_gemini == (winner == 'primary'))
+
+    def generate_caption_batch(self, images: list[Image.Image], max_length: int = 50,
+                               image_hashes: Optional[list[str]] = None,
+                               deadline: Optional[Deadline] = None) -> list[str]:
+        """
+        Generate captions for several images at once.
+
+        With BLIP all images go through a single generate call; with
+        Gemini each image is a separate API request, sent concurrently.
+
+        Args:
+            images: PIL Image objects
+            max_length: Maximum length of generated captions
+            image_hashes: Hashes of the images, for the embedding cache
+            deadline: When the caller gives up (default: INFERENCE_TIMEOUT
+                from now)
+
+        Returns:
+            Generated caption strings, in the same order as images
+        """
+        if not images:
+            return []
+        deadline = deadline or Deadline(config.INFERENCE_TIMEOUT)
+        if self.use_gemini:
+            return self.gemini_client.generate_many(PROMPT, images, deadline)
 
-    def _generate_with_blip(self, image: Image.Image, max_length: int) -> str:
-        """Generate caption using BLIP model"""
         try:
-            model = self.model_loader.model
-            processor = self.model_loader.processor
+            return self._generate_batch_with_blip(images, max_length, image_hashes, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error generating captions with BLIP: {e}")
+            return [FAILED_CAPTION] * len(images)
+
+    def generate_candidates(self, image: Image.Image, num_candidates: int, max_length: int = 50,
+                            image_hash: Optional[str] = None,
+                            deadline: Optional[Deadline] = None) -> list[str]:
+        """
+        Generate several distinct captions for an image.
+
+        With BLIP the first candidate is the regular (greedy) caption and
+        the rest are sampled in one decoder batch from the same image
+        embeddings, so the vision encoder runs at most once. With Gemini
+        all candidates come from a single request.
+
+        Args:
+            image: PIL Image object
+            num_candidates: Number of captions wanted
+            max_length: Maximum length of generated captions
+            image_hash: Hash of the image, for the embedding cache
+            deadline: When the caller gives up (default: INFERENCE_TIMEOUT
+                from now)
+
+        Returns:
+            Up to num_candidates distinct captions (fewer if sampling
+            keeps repeating itself)
+        """
+        if num_candidates <= 1:
+            return [self.generate_caption(image, max_length, image_hash, deadline)]
+        deadline = deadline or Deadline(config.INFERENCE_TIMEOUT)
+        if self.use_gemini:
+            return self._generate_candidates_with_gemini(image, num_candidates, deadline)
+
+        try:
+            return self._generate_candidates_with_blip(image, num_candidates, max_length, image_hash, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error generating caption candidates with BLIP: {e}")
+            return [FAILED_CAPTION]
+
+    def stream_caption(self, image: Image.Image, max_length: int = 50,
+                       image_hash: Optional[str] = None,
+                       deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Generate a caption, yielding text as soon as the model produces it.
+
+        Args:
+            image: PIL Image object
+            max_length: Maximum length of generated caption
+            image_hash: Hash of the image, for the embedding cache
+            deadline: When the caller gives up (default: INFERENCE_TIMEOUT
+                from now)
+
+        Yields:
+            Successive pieces of the caption
+        """
+        deadline = deadline or Deadline(config.INFERENCE_TIMEOUT)
+        if self.use_gemini:
+            yield from self._stream_with_gemini(image, deadline)
+        else:
+            yield from self._stream_with_blip(image, max_length, image_hash, deadline)
+
+    def _stream_with_blip(self, image: Image.Image, max_length: int,
+                          image_hash: Optional[str] = None,
+                          deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Stream caption tokens from BLIP via a TextIteratorStreamer"""
+        from transformers import TextIteratorStreamer
 
-            # Preprocess image
-            inputs = processor(image, return_tensors="pt")
+        backend = self._get_backend()
+        processor = self.model_loader.processor
 
-            # Move inputs to same device as model
-            device = next(model.parameters()).device
-            inputs = {k: v.to(device) for k, v in inputs.items()}
+        image_embeds = pixel_values = None
+        if self._use_embedding_cache([image_hash]):
+            image_embeds = self._image_embeds(backend, [image], [image_hash])
+        else:
+            # Own copy: the tensor outlives this call in the generate thread
+            pixel_values = self._preprocess([image])['pixel_values']
+
+        # generate() runs in a worker thread and pushes decoded text into
+        # the streamer as tokens are produced
+        streamer = TextIteratorStreamer(
+            processor.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=config.INFERENCE_TIMEOUT
+        )
+        errors = []
+
+        def run():
+            try:
+                if image_embeds is not None:
+                    backend.decode(image_embeds, max_length=max_length, streamer=streamer, deadline=deadline)
+                else:
+                    backend.generate(pixel_values, max_length=max_length, streamer=streamer, deadline=deadline)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
 
-            # Generate caption
-            with torch.no_grad():
-                output = model.generate(**inputs, max_length=max_length)
+        thread = Thread(target=run, name='blip-stream', daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
 
-            # Decode the output
-            caption = processor.decode(output[0], skip_special_tokens=True)
-            return caption
+        if errors:
+            raise errors[0]
 
+    def _stream_with_gemini(self, image: Image.Image, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Stream caption text from Gemini's streaming response mode"""
+        yield from self.gemini_client.stream(PROMPT, image, deadline)
+
+    def _generate_with_blip(self, image: Image.Image, max_length: int,
+                            image_hash: Optional[str] = None, deadline: Optional[Deadline] = None) -> str:
+        """Generate caption using BLIP model"""
+        try:
+            return self._blip_caption(image, max_length, image_hash, deadline)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error generating caption with BLIP: {e}")
-            return "Unable to generate caption at this time."
+            return FAILED_CAPTION
 
-    def _generate_with_gemini(self, image: Image.Image) -> str:
-        """Generate caption using Gemini Vision API"""
+    def _blip_caption(self, image: Image.Image, max_length: int, image_hash: Optional[str],
+                      deadline: Optional[Deadline]) -> str:
+        """BLIP caption for one image, raising on errors"""
+        if self.batch_scheduler is None:
+            return self._generate_batch_with_blip([image], max_length, [image_hash], deadline)[0]
+
+        # Merged with concurrent requests sharing the same max_length
         try:
-            response = self.gemini_model.generate_content([
-                PROMPT,
-                image
-            ])
-            return response.text.strip()
+            caption = self.batch_scheduler.submit(
+                (image, image_hash, deadline), key=max_length,
+                timeout=deadline.remaining() if deadline is not None else config.INFERENCE_TIMEOUT
+            )
+        except TimeoutError:
+            raise DeadlineExceeded("Caption request deadline exceeded") from None
+        if deadline is not None:
+            # Expired requests in a batch get a placeholder
+            deadline.check()
+        return caption
 
-        except Exception as e:
-            print(f"Error generating caption with Gemini: {e}")
-            # Fallback to BLIP
-            self.use_gemini = False
-            self.model_loader = ModelLoader()
-            return self._generate_with_blip(image, 120)
+    def _generate_scheduled_batch(self, items: list[tuple], max_length: int) -> list[str]:
+        """BatchScheduler callback: items are (image, image_hash, deadline) tuples"""
+        # Skip requests whose callers have already given up
+        live = [i for i, (_, _, deadline) in enumerate(items) if deadline is None or not deadline.expired]
+        captions = [''] * len(items)
+        if live:
+            results = self._generate_batch_with_blip(
+                [items[i][0] for i in live], max_length, [items[i][1] for i in live],
+                group_deadline(items[i][2] for i in live)
+            )
+            for i, caption in zip(live, results):
+                captions[i] = caption
+        return captions
+
+    def _generate_batch_with_blip(self, images: list[Image.Image], max_length: int,
+                                  image_hashes: Optional[list[str]] = None, deadline=None) -> list[str]:
+        """Generate captions for a batch of images in one BLIP forward pass"""
+        backend = self._get_backend()
+        processor = self.model_loader.processor
+
+        if self._use_embedding_cache(image_hashes):
+            # Only images missing from the cache go through the vision encoder
+            image_embeds = self._image_embeds(backend, images, image_hashes)
+            output = backend.decode(image_embeds, max_length=max_length, deadline=deadline)
+        elif self._use_tensor_preprocessor():
+            # Preprocess into a reused buffer, valid until generate returns
+            with self.tensor_preprocessor.batch(images) as pixel_values:
+                output = backend.generate(pixel_values, max_length=max_length, deadline=deadline)
+        else:
+            # Preprocess images
+            inputs = processor(images, return_tensors="pt")
+
+            # Generate captions
+            output = backend.generate(inputs['pixel_values'], max_length=max_length, deadline=deadline)
+
+        # Decode the output
+        return processor.batch_decode(output, skip_special_tokens=True)
+
+    def _generate_candidates_with_blip(self, image: Image.Image, num_candidates: int, max_length: int,
+                                       image_hash: Optional[str] = None, deadline=None) -> list[str]:
+        """Greedy caption plus sampled alternatives, decoded from one set of image embeddings"""
+        backend = self._get_backend()
+        processor = self.model_loader.processor
+        image_embeds = self._image_embeds(backend, [image], [image_hash])
+
+        greedy = backend.decode(image_embeds, max_length=max_length, deadline=deadline)
+        # Oversample, since short captions are often sampled more than once
+        samples = backend.sample(
+            image_embeds, max_length=max_length, num_samples=2 * (num_candidates - 1),
+            top_p=config.CANDIDATE_TOP_P, temperature=config.CANDIDATE_TEMPERATURE, deadline=deadline
+        )
+
+        captions = processor.batch_decode(greedy, skip_special_tokens=True)
+        captions += processor.batch_decode(samples, skip_special_tokens=True)
+        return _distinct(captions, num_candidates) or captions[:1]
+
+    def _use_embedding_cache(self, image_hashes: Optional[list[str]]) -> bool:
+        return self.embedding_cache is not None and bool(image_hashes) and any(image_hashes)
+
+    def _image_embeds(self, backend, images: list[Image.Image], image_hashes: list[str]) -> torch.Tensor:
+        """Vision encoder outputs for images, encoding only those not in the embedding cache"""
+        embeds = [self.embedding_cache.get(h) if h and self.embedding_cache else None for h in image_hashes]
+        missing = [i for i, e in enumerate(embeds) if e is None]
+
+        if missing:
+            missing_images = [images[i] for i in missing]
+            if self._use_tensor_preprocessor():
+                with self.tensor_preprocessor.batch(missing_images) as pixel_values:
+                    encoded = backend.encode(pixel_values)
+            else:
+                inputs = self.model_loader.processor(missing_images, return_tensors="pt")
+                encoded = backend.encode(inputs['pixel_values'])
+
+            for i, image_embeds in zip(missing, encoded):
+                # Own storage per image, not a view keeping the whole batch alive
+                embeds[i] = image_embeds.clone()
+                if image_hashes[i] and self.embedding_cache:
+                    self.embedding_cache.put(image_hashes[i], embeds[i])
+
+        return torch.stack([e.to(embeds[0].device) for e in embeds])
+
+    def _get_backend(self):
+        """Create the configured inference backend on first use"""
+        if self.backend is None:
+            with self._init_lock:
+                if self.backend is None:
+                    self.backend = create_backend(self.model_loader)
+        return self.backend
+
+    def _use_tensor_preprocessor(self) -> bool:
+        """Create the vectorized preprocessor on first use, if enabled"""
+        if not config.TENSOR_PREPROCESSING_ENABLED:
+            return False
+        if self.tensor_preprocessor is None:
+            with self._init_lock:
+                if self.tensor_preprocessor is None:
+                    self.tensor_preprocessor = TensorPreprocessor.from_processor(self.model_loader.processor)
+        return True
+
+    def _preprocess(self, images: list[Image.Image]) -> dict:
+        """BLIP model inputs for images, as a new tensor the caller owns"""
+        if self._use_tensor_preprocessor():
+            return {'pixel_values': self.tensor_preprocessor(images)}
+        return dict(self.model_loader.processor(images, return_tensors="pt"))
+
+    def warm_up(self):
+        """Load the model and run one inference, so the first request doesn't pay for either"""
+        if self.use_gemini and self.hedger is None:
+            return
+
+        self.model_loader.load_model()
+        max_dim = config.MAX_IMAGE_DIMENSION
+        self._generate_batch_with_blip([Image.new('RGB', (max_dim, max_dim))], max_length=20)
+
+    def get_model_status(self) -> dict:
+        """Get which model serves captions and whether it is loaded"""
+        if self.use_gemini:
+            return {'model': 'gemini', 'state': 'loaded', 'load_seconds': None, 'error': None,
+                    'circuit': self.gemini_client.breaker.state}
+        status = self.model_loader.status()
+        status['backend'] = self.backend.name if self.backend else None
+        return status
+
+    def get_stats(self) -> dict:
+        """Get batching, embedding cache, Gemini client and hedging statistics"""
+        return {
+            'batching': self.batch_scheduler.stats() if self.batch_scheduler else None,
+            'embeddings': self.embedding_cache.stats() if self.embedding_cache else None,
+            'gemini': self.gemini_client.stats() if self.use_gemini or self.hedger else None,
+            'hedging': self.hedger.stats() if self.hedger else None
+        }
+
+    def _generate_with_gemini(self, image: Image.Image, deadline: Optional[Deadline] = None) -> str:
+        """Generate caption using Gemini Vision API"""
+        return self.gemini_client.generate(PROMPT, image, deadline)
+
+    def _generate_candidates_with_gemini(self, image: Image.Image, num_candidates: int,
+                                         deadline: Optional[Deadline] = None) -> list[str]:
+        """Ask Gemini for all candidates in one request"""
+        text = self.gemini_client.generate(CANDIDATES_PROMPT.format(n=num_candidates), image, deadline)
+        candidates = _parse_candidates(text, num_candidates)
+        if not candidates:
+            raise GeminiError("No captions in Gemini response")
+        return candidates
+
+
+def _distinct(captions: list[str], limit: int) -> list[str]:
+    """First limit distinct non-empty captions, in order"""
+    distinct = []
+    for caption in captions:
+        caption = caption.strip()
+        if caption and caption not in distinct:
+            distinct.append(caption)
+    return distinct[:limit]
+
+
+def _parse_candidates(text: str, limit: int) -> list[str]:
+    """
+    Captions from a Gemini candidates response: a JSON array of strings,
+    possibly in a code fence, or failing that one caption per line.
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+        if text.startswith('json'):
+            text = text[len('json'):]
+
+    try:
+        captions = json.loads(text)
+        if isinstance(captions, list):
+            return _distinct([c for c in captions if isinstance(c, str)], limit)
+    except ValueError:
+        pass
+
+    # Not JSON: drop list markers and surrounding quotes from each line
+    lines = [re.sub(r'^\s*(?:[-*\u2022]|\d+[.)])\s*', '', line).strip().strip('"') for line in text.splitlines()]
+    return _distinct(lines, limit)
@@ -0,0 +1,111 @@
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+
+class DeadlineExceeded(Exception):
+    """A caption was not ready before its request's deadline"""
+
+
+class Deadline:
+    """
+    Point in time by which a request needs its caption, plus a cancel flag.
+
+    Passed down from the route to the generator and backend, which stop
+    working on the request once it has expired: BLIP between decoder
+    steps, Gemini by bounding socket timeouts and aborting the connection.
+    cancel() expires it early, e.g. for the losing side of a hedged
+    request. A child shares its parent's expiry and is cancelled with it,
+    but can be cancelled on its own.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional['Deadline'] = None):
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.parent = parent
+        if parent is not None and parent.expires_at is not None:
+            if self.expires_at is None or parent.expires_at < self.expires_at:
+                self.expires_at = parent.expires_at
+
+        self._cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent.add_callback(self.cancel)
+
+    def child(self, timeout: Optional[float] = None) -> 'Deadline':
+        """A deadline that expires no later than this one"""
+        return Deadline(timeout, parent=self)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (0 once expired), or None without a time limit"""
+        if self.cancelled:
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def expired(self) -> bool:
+        return self._cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def check(self):
+        """Raise DeadlineExceeded if expired"""
+        if self._cancelled:
+            raise DeadlineExceeded("Caption request was cancelled")
+        if self.expired:
+            raise DeadlineExceeded("Caption request deadline exceeded")
+
+    def cancel(self):
+        """Expire now, running the cancel callbacks"""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Run callback on cancel (at once if already cancelled)"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class DeadlineGroup:
+    """
+    The deadlines of every request in one batch.
+
+    Expired only once all of them are, so one cancelled or late request
+    doesn't stop a batch the others are still waiting for.
+    """
+
+    def __init__(self, deadlines: Iterable[Deadline]):
+        self.deadlines = list(deadlines)
+
+    @property
+    def expired(self) -> bool:
+        return all(deadline.expired for deadline in self.deadlines)
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded("Every request in the batch is past its deadline")
+
+
+def group_deadline(deadlines: Iterable[Optional[Deadline]]) -> Optional[DeadlineGroup]:
+    """DeadlineGroup for a batch, or None if any request in it has no deadline"""
+    deadlines = list(deadlines)
+    if not deadlines or any(deadline is None for deadline in deadlines):
+        return None
+    return DeadlineGroup(deadlines)
@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import torch
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of vision encoder outputs, keyed by image hash.
+
+    Holds one (patches, hidden) image_embeds tensor per image, so a
+    repeat caption of the same image (e.g. with another max_length) only
+    runs the text decoder.
+
+    With spill_dir set, entries evicted from memory are written there as
+    .npy files and read back through a memory map on a later miss. The
+    directory is bounded by spill_max_bytes, dropping the least recently
+    used files first. It should be specific to the model, since
+    embeddings from another model are meaningless.
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: Optional[Path] = None, spill_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir and spill_max_bytes > 0 else None
+        self.spill_max_bytes = spill_max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._spill_bytes = 0
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self._spill_bytes = sum(path.stat().st_size for path in self.spill_dir.glob('*/*.npy'))
+
+        # Stats
+        self._hits = 0
+        self._spill_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _spill_path(self, image_hash: str) -> Path:
+        return self.spill_dir / image_hash[:2] / f"{image_hash}.npy"
+
+    def get(self, image_hash: str) -> Optional[torch.Tensor]:
+        """Get the cached embeddings for an image, or None"""
+        with self._lock:
+            embeds = self._entries.get(image_hash)
+            if embeds is not None:
+                self._entries.move_to_end(image_hash)
+                self._hits += 1
+                return embeds
+
+        embeds = self._read_spill(image_hash)
+        with self._lock:
+            if embeds is None:
+                self._misses += 1
+                return None
+            self._spill_hits += 1
+        self.put(image_hash, embeds)
+        return embeds
+
+    def put(self, image_hash: str, embeds: torch.Tensor):
+        """Cache an image's embeddings; the caller must not modify the tensor afterwards"""
+        size = embeds.element_size() * embeds.nelement()
+        if size > self.max_bytes:
+            return
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(image_hash, None)
+            if previous is not None:
+                self._bytes -= previous.element_size() * previous.nelement()
+            self._entries[image_hash] = embeds
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                key, old = self._entries.popitem(last=False)
+                self._bytes -= old.element_size() * old.nelement()
+                self._evictions += 1
+                evicted.append((key, old))
+
+        # Disk writes happen outside the lock
+        for key, old in evicted:
+            self._write_spill(key, old)
+
+    def _read_spill(self, image_hash: str) -> Optional[torch.Tensor]:
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(image_hash)
+        try:
+            # Copy out of the memory map, so the file can be pruned
+            embeds = torch.from_numpy(np.array(np.load(path, mmap_mode='r')))
+            os.utime(path)  # Mark as recently used
+            return embeds
+        except (OSError, ValueError):
+            return None
+
+    def _write_spill(self, image_hash: str, embeds: torch.Tensor):
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(image_hash)
+        if path.exists():
+            return
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # Write then rename, so readers never map a partial file
+            tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeds.detach().cpu().numpy())
+            os.replace(tmp_path, path)
+            with self._spill_lock:
+                self._spill_bytes += path.stat().st_size
+                if self._spill_bytes > self.spill_max_bytes:
+                    self._prune_spill()
+        except OSError as e:
+            print(f"Failed to spill embeddings for {image_hash}: {e}")
+
+    def _prune_spill(self):
+        """Delete least recently used spill files down to 90% of the limit (caller holds _spill_lock)"""
+        files = []
+        for path in self.spill_dir.glob('*/*.npy'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = self.spill_max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._spill_bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._spill_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'spill_bytes': self._spill_bytes if self.spill_dir is not None else None,
+                'hits': self._hits,
+                'spill_hits': self._spill_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round((self._hits + self._spill_hits) / lookups, 3) if lookups else 0.0,
+            }
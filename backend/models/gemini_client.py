@@ -0,0 +1,528 @@
+import base64
+import http.client
+import io
+import json
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+from PIL import Image
+import config
+from .deadline import Deadline, DeadlineExceeded
+
+# Statuses worth retrying: rate limited or a server-side failure
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bound on a single backoff sleep, seconds
+MAX_RETRY_DELAY = 10.0
+
+# A pooled keep-alive connection the server has since closed fails like this
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class GeminiError(Exception):
+    """A Gemini request failed"""
+
+
+class GeminiUnavailable(GeminiError):
+    """Gemini was not called: the circuit is open or the rate limit wait is too long"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _RetryableError(GeminiError):
+    """One attempt failed in a way that may succeed on retry"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Aborter:
+    """Deadline cancel callback that aborts a call's current connection"""
+
+    def __init__(self):
+        self.connection = None
+
+    def __call__(self):
+        connection = self.connection
+        if connection is not None and connection.sock is not None:
+            try:
+                # Unblocks a recv in progress on another thread, unlike close()
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter: rate tokens per second, up to burst saved up.
+
+    Callers reserve a token and then sleep outside the lock until it is
+    theirs, so waiting callers are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Take a token.
+
+        Returns:
+            Seconds to sleep before using it, or None (and no token taken)
+            if that would be longer than max_wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def wait_time(self) -> float:
+        """Seconds until a token would be free"""
+        with self._lock:
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service, then probes it to recover.
+
+    After failure_threshold consecutive failed calls the circuit opens
+    and calls are refused for reset_timeout seconds. Then it is half-open:
+    one probe call is let through, and its outcome closes the circuit
+    again or reopens it for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> float:
+        """
+        Ask to make a call.
+
+        Returns:
+            0 if the call may go ahead, else seconds until it is worth asking again
+        """
+        with self._lock:
+            if self.state == 'open':
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probing:
+                    return self.reset_timeout
+                self._probing = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """A call ended without telling us anything about the service"""
+        with self._lock:
+            self._probing = False
+
+
+class GeminiClient:
+    """
+    Gemini REST API client for captioning, built on http.client.
+
+    Keep-alive connections are pooled and reused. Every call goes through
+    the circuit breaker and a token bucket, and retryable failures (429,
+    5xx, network errors) are retried with jittered exponential backoff,
+    honouring Retry-After. Non-streaming calls run on a bounded thread
+    pool, so many can be in flight at once; streaming calls run on the
+    caller's thread but count towards the same concurrency limit.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 base_url: Optional[str] = None, timeout: Optional[float] = None,
+                 max_concurrency: Optional[int] = None, requests_per_minute: Optional[float] = None,
+                 burst: Optional[int] = None, max_retries: Optional[int] = None,
+                 retry_base_delay: Optional[float] = None, circuit_failures: Optional[int] = None,
+                 circuit_reset: Optional[float] = None):
+        self.api_key = config.GEMINI_API_KEY if api_key is None else api_key
+        self.model = model or config.GEMINI_MODEL
+        self.timeout = config.GEMINI_TIMEOUT if timeout is None else timeout
+        self.max_concurrency = max(1, config.GEMINI_MAX_CONCURRENCY if max_concurrency is None else max_concurrency)
+        self.max_retries = max(0, config.GEMINI_MAX_RETRIES if max_retries is None else max_retries)
+        self.retry_base_delay = config.GEMINI_RETRY_BASE_DELAY if retry_base_delay is None else retry_base_delay
+
+        url = urlsplit(base_url or config.GEMINI_API_BASE)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = url.netloc
+        self._path_prefix = url.path.rstrip('/')
+
+        rpm = config.GEMINI_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        self.rate_limiter = TokenBucket(rpm / 60, config.GEMINI_BURST if burst is None else burst) if rpm > 0 else None
+        self.breaker = CircuitBreaker(
+            config.GEMINI_CIRCUIT_FAILURES if circuit_failures is None else circuit_failures,
+            config.GEMINI_CIRCUIT_RESET if circuit_reset is None else circuit_reset
+        )
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='gemini')
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._pool = []  # idle keep-alive connections
+        self._lock = threading.Lock()
+
+        # Stats
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+        self._refused = 0
+        self._connections_opened = 0
+        self._in_flight = 0
+
+    def submit(self, prompt: str, image: Image.Image, deadline: Optional[Deadline] = None) -> Future:
+        """Start a caption request on the client's thread pool"""
+        return self._executor.submit(self.generate_now, prompt, image, deadline)
+
+    def generate(self, prompt: str, image: Image.Image, deadline: Optional[Deadline] = None) -> str:
+        """
+        Generate text for a prompt and image.
+
+        Args:
+            deadline: Optional Deadline; the call is aborted once it expires
+                or is cancelled
+
+        Raises:
+            GeminiUnavailable: If the circuit is open or the rate limit is saturated
+            GeminiError: If the request failed after retries
+            DeadlineExceeded: If the deadline expired first
+        """
+        return self.generate_many(prompt, [image], deadline)[0]
+
+    def generate_many(self, prompt: str, images: list[Image.Image],
+                      deadline: Optional[Deadline] = None) -> list[str]:
+        """Generate text for several images concurrently, in the same order"""
+        # One child per call, so giving up cancels calls still in flight
+        call_deadline = deadline.child() if deadline is not None else None
+        futures = [self.submit(prompt, image, call_deadline) for image in images]
+        try:
+            return [future.result(timeout=deadline.remaining() if deadline is not None else None)
+                    for future in futures]
+        except FutureTimeoutError:
+            raise DeadlineExceeded("Gemini request deadline exceeded") from None
+        finally:
+            if call_deadline is not None:
+                call_deadline.cancel()
+            for future in futures:
+                future.cancel()
+
+    def generate_now(self, prompt: str, image: Image.Image, deadline: Optional[Deadline] = None) -> str:
+        """generate() on the calling thread"""
+        aborter = _Aborter()
+        if deadline is not None:
+            deadline.add_callback(aborter)
+        try:
+            with self._slot():
+                connection, response = self._call('generateContent', self._body(prompt, image), deadline, aborter)
+                try:
+                    payload = json.loads(response.read())
+                except (OSError, http.client.HTTPException, ValueError) as e:
+                    connection.close()
+                    if deadline is not None:
+                        deadline.check()
+                    raise GeminiError(f"Unreadable Gemini response: {e}") from e
+                self._put_connection(connection, deadline)
+        finally:
+            if deadline is not None:
+                deadline.remove_callback(aborter)
+
+        text = _response_text(payload).strip()
+        if not text:
+            raise GeminiError(f"No text in Gemini response: {_finish_reason(payload)}")
+        return text
+
+    def stream(self, prompt: str, image: Image.Image, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Generate text for a prompt and image, yielding it as it arrives.
+
+        Retries only happen before the first piece of text is yielded.
+        """
+        aborter = _Aborter()
+        if deadline is not None:
+            deadline.add_callback(aborter)
+        try:
+            with self._slot():
+                connection, response = self._call('streamGenerateContent', self._body(prompt, image),
+                                                  deadline, aborter, query='?alt=sse')
+                try:
+                    # Server-Sent Events, one JSON response chunk per data line
+                    while True:
+                        line = response.readline()
+                        if deadline is not None:
+                            deadline.check()
+                        if not line:
+                            break
+                        if line.startswith(b'data:'):
+                            text = _response_text(json.loads(line[len(b'data:'):]))
+                            if text:
+                                yield text
+                except BaseException:
+                    # Abandoned mid-body (error, deadline or client gone): the
+                    # connection is in an unknown state
+                    connection.close()
+                    raise
+                self._put_connection(connection, deadline)
+        finally:
+            if deadline is not None:
+                deadline.remove_callback(aborter)
+
+    @contextmanager
+    def _slot(self):
+        """One of max_concurrency in-flight calls"""
+        with self._slots:
+            with self._lock:
+                self._in_flight += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    def _body(self, prompt: str, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=90)
+        return json.dumps({
+            'contents': [{
+                'parts': [
+                    {'text': prompt},
+                    {'inline_data': {'mime_type': 'image/jpeg', 'data': base64.b64encode(buffer.getvalue()).decode()}}
+                ]
+            }]
+        }).encode()
+
+    def _call(self, method: str, body: bytes, deadline: Optional[Deadline], aborter: _Aborter,
+              query: str = ''):
+        """
+        Send one API call through the breaker, rate limiter and retries.
+
+        Returns:
+            (connection, response) with a 200 status; the caller reads the
+            body and then returns the connection with _put_connection
+        """
+        wait = self.breaker.allow()
+        if wait:
+            with self._lock:
+                self._refused += 1
+            raise GeminiUnavailable(f"Gemini circuit open, retry in {wait:.0f}s", wait)
+
+        outcome = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._rate_limit(deadline)
+                try:
+                    connection, response = self._attempt(
+                        f'{self._path_prefix}/v1beta/models/{self.model}:{method}{query}', body, deadline, aborter
+                    )
+                except _RetryableError as e:
+                    if deadline is not None and deadline.expired:
+                        # Timed out by the deadline counts against the service;
+                        # cancelled (e.g. a hedge that lost) does not
+                        outcome = None if deadline.cancelled else False
+                        deadline.check()
+                    delay = self._backoff(attempt, e.retry_after)
+                    if attempt == self.max_retries or not _fits(deadline, delay):
+                        outcome = False
+                        with self._lock:
+                            self._failures += 1
+                        raise GeminiError(f"Gemini request failed after {attempt + 1} attempts: {e}") from e
+                    with self._lock:
+                        self._retries += 1
+                    time.sleep(delay)
+                except (GeminiUnavailable, DeadlineExceeded):
+                    raise
+                except GeminiError:
+                    # The service answered; the request itself was bad
+                    outcome = True
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                else:
+                    outcome = True
+                    return connection, response
+        finally:
+            if outcome is True:
+                self.breaker.record_success()
+            elif outcome is False:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+
+    def _rate_limit(self, deadline: Optional[Deadline]):
+        if self.rate_limiter is None:
+            return
+        wait = self.rate_limiter.reserve(max_wait=_timeout(self.timeout, deadline))
+        if wait is None:
+            with self._lock:
+                self._refused += 1
+            retry_after = self.rate_limiter.wait_time()
+            raise GeminiUnavailable(f"Gemini rate limit saturated, retry in {retry_after:.0f}s", retry_after)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After plus some jitter"""
+        if retry_after is not None:
+            return min(MAX_RETRY_DELAY, retry_after) + random.uniform(0, self.retry_base_delay)
+        return random.uniform(0, min(MAX_RETRY_DELAY, self.retry_base_delay * 2 ** attempt))
+
+    def _attempt(self, path: str, body: bytes, deadline: Optional[Deadline], aborter: _Aborter):
+        """One HTTP request, on a pooled connection if there is one"""
+        timeout = _timeout(self.timeout, deadline)
+        if timeout <= 0:
+            deadline.check()
+        headers = {'Content-Type': 'application/json', 'x-goog-api-key': self.api_key}
+        connection, reused = self._get_connection()
+        with self._lock:
+            self._requests += 1
+        try:
+            try:
+                aborter.connection = connection
+                _set_timeout(connection, timeout)
+                connection.request('POST', path, body=body, headers=headers)
+                response = connection.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused or (deadline is not None and deadline.expired):
+                    raise
+                # Closed by the server while idle in the pool: not a real failure
+                connection.close()
+                connection = self._new_connection()
+                aborter.connection = connection
+                _set_timeout(connection, timeout)
+                connection.request('POST', path, body=body, headers=headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+
+        if response.status == 200:
+            return connection, response
+
+        detail = response.read()[:500].decode(errors='replace')
+        self._put_connection(connection, deadline)
+        message = f"HTTP {response.status}: {detail}"
+        if response.status in RETRYABLE_STATUSES:
+            raise _RetryableError(message, _retry_after(response.getheader('Retry-After')))
+        raise GeminiError(message)
+
+    def _new_connection(self):
+        with self._lock:
+            self._connections_opened += 1
+        return self._connection_class(self._netloc, timeout=self.timeout)
+
+    def _get_connection(self):
+        """An idle pooled connection, or a new one; returns (connection, reused)"""
+        with self._lock:
+            if self._pool:
+                return self._pool.pop(), True
+        return self._new_connection(), False
+
+    def _put_connection(self, connection, deadline: Optional[Deadline] = None):
+        """Return a connection whose response has been fully read to the pool"""
+        if connection.sock is None:
+            return  # Server asked to close it
+        if deadline is not None and deadline.cancelled:
+            # The aborter may have shut it down
+            connection.close()
+            return
+        with self._lock:
+            if len(self._pool) < self.max_concurrency:
+                self._pool.append(connection)
+                return
+        connection.close()
+
+    def stats(self) -> dict:
+        """Get client statistics"""
+        with self._lock:
+            return {
+                'model': self.model,
+                'circuit': self.breaker.state,
+                'in_flight': self._in_flight,
+                'requests': self._requests,
+                'retries': self._retries,
+                'failures': self._failures,
+                'refused': self._refused,
+                'connections_opened': self._connections_opened,
+                'idle_connections': len(self._pool)
+            }
+
+
+def _timeout(timeout: float, deadline: Optional[Deadline]) -> float:
+    """Per-attempt timeout, cut short by the deadline"""
+    remaining = deadline.remaining() if deadline is not None else None
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+def _fits(deadline: Optional[Deadline], delay: float) -> bool:
+    """Whether a retry after delay seconds could still finish before the deadline"""
+    remaining = deadline.remaining() if deadline is not None else None
+    return remaining is None or delay < remaining
+
+
+def _set_timeout(connection, timeout: float):
+    connection.timeout = timeout
+    if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+
+
+def _response_text(payload: dict) -> str:
+    """Text of the first candidate in a generateContent response"""
+    candidates = payload.get('candidates') or []
+    if not candidates:
+        return ''
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return ''.join(part.get('text', '') for part in parts)
+
+
+def _finish_reason(payload: dict) -> str:
+    """Why a response has no text, for error messages"""
+    candidates = payload.get('candidates') or []
+    if candidates:
+        return candidates[0].get('finishReason', 'unknown')
+    feedback = payload.get('promptFeedback', {})
+    return feedback.get('blockReason', 'no candidates')
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header in seconds (HTTP dates are not worth parsing here)"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
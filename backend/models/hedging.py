@@ -0,0 +1,148 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+from .deadline import Deadline
+
+# Primary latencies needed before the percentile replaces the default delay
+MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies, for percentile estimates"""
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """p-th percentile (nearest rank) of the window, or None with too few samples"""
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Hedger:
+    """
+    Hedged requests between a primary and a fallback backend.
+
+    The primary starts at once. If it has not answered after the hedge
+    delay (the primary's recent p-th percentile latency), or fails, the
+    fallback starts too. The first successful result wins and the other
+    call's deadline is cancelled, which stops its work. Only slow tail
+    requests pay for a second call, so at the 95th percentile about one
+    request in twenty is hedged.
+    """
+
+    def __init__(self, percentile: float, min_delay: float, default_delay: float):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+
+        # Stats
+        self._requests = 0
+        self._hedged = 0
+        self._wins = {'primary': 0, 'fallback': 0}
+
+    def delay(self) -> float:
+        """Seconds to give the primary before starting the fallback"""
+        estimate = self.latency.percentile(self.percentile)
+        return max(self.min_delay, self.default_delay if estimate is None else estimate)
+
+    def call(self, primary: Callable[[Deadline], Any], fallback: Callable[[Deadline], Any],
+             deadline: Deadline) -> tuple[Any, str]:
+        """
+        Run primary, hedged with fallback; each is called with its own child deadline.
+
+        Returns:
+            (result, 'primary' or 'fallback')
+
+        Raises:
+            DeadlineExceeded: If neither answered before the deadline
+            Exception: The primary's error, if both failed
+        """
+        results = queue.Queue()
+        branches = {}
+        errors = {}
+        primary_reported = False
+        started = time.monotonic()
+        hedge_at = started + self.delay()
+
+        def start(name: str, fn: Callable[[Deadline], Any]):
+            branch_deadline = deadline.child()
+            branches[name] = branch_deadline
+
+            def run():
+                try:
+                    results.put((name, fn(branch_deadline), None))
+                except Exception as e:
+                    results.put((name, None, e))
+
+            threading.Thread(target=run, name=f'hedge-{name}', daemon=True).start()
+
+        with self._lock:
+            self._requests += 1
+        start('primary', primary)
+
+        try:
+            while True:
+                remaining = deadline.remaining()
+                if 'fallback' not in branches:
+                    until_hedge = max(0.0, hedge_at - time.monotonic())
+                    remaining = until_hedge if remaining is None else min(remaining, until_hedge)
+                try:
+                    name, result, error = results.get(timeout=remaining)
+                except queue.Empty:
+                    deadline.check()
+                    # The primary is in the slow tail: hedge
+                    self._start_fallback(start, fallback)
+                    continue
+
+                if name == 'primary':
+                    primary_reported = True
+                    self.latency.record(time.monotonic() - started)
+                if error is None:
+                    with self._lock:
+                        self._wins[name] += 1
+                    return result, name
+
+                errors[name] = error
+                if 'fallback' not in branches:
+                    # Don't wait out the hedge delay after a failure
+                    self._start_fallback(start, fallback)
+                elif len(errors) == len(branches):
+                    raise errors['primary']
+        finally:
+            # Stop the loser, or both on a deadline or error
+            for branch_deadline in branches.values():
+                branch_deadline.cancel()
+            if not primary_reported:
+                # It lost or ran out of time, so it would have taken at least this long
+                self.latency.record(time.monotonic() - started)
+
+    def _start_fallback(self, start, fallback):
+        with self._lock:
+            self._hedged += 1
+        start('fallback', fallback)
+
+    def stats(self) -> dict:
+        """Get hedging statistics"""
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'hedged': self._hedged,
+                'hedge_rate': round(self._hedged / self._requests, 3) if self._requests else 0.0,
+                'primary_wins': self._wins['primary'],
+                'fallback_wins': self._wins['fallback'],
+                'delay_ms': round(self.delay() * 1000, 1)
+            }
@@ -0,0 +1,488 @@
+import inspect
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Optional
+import numpy as np
+import torch
+import transformers
+import config
+from .model_loader import ModelLoader
+
+BACKENDS = ('torch', 'onnx')
+
+ONNX_OPSET = 17
+
+
+class InferenceBackend:
+    """
+    Runs BLIP captioning on preprocessed pixel_values.
+
+    Split into encode (vision encoder) and decode (text decoder) so
+    callers can reuse image embeddings; generate does both.
+    """
+
+    name = 'base'
+
+    def encode(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run the vision encoder, returning image embeddings"""
+        raise NotImplementedError
+
+    def decode(self, image_embeds: torch.Tensor, max_length: int, streamer=None,
+               deadline=None) -> torch.Tensor:
+        """
+        Generate caption token ids from image embeddings.
+
+        Args:
+            image_embeds: Output of encode
+            max_length: Maximum sequence length, including the BOS token
+            streamer: Optional transformers streamer fed each new token
+                (batch size 1 only)
+            deadline: Optional Deadline (or DeadlineGroup); decoding stops
+                between steps once it has expired
+
+        Returns:
+            (batch, length) token ids, starting with BOS
+
+        Raises:
+            DeadlineExceeded: If the deadline expired before decoding finished
+        """
+        raise NotImplementedError
+
+    def sample(self, image_embeds: torch.Tensor, max_length: int, num_samples: int,
+               top_p: float = 0.9, temperature: float = 1.0, deadline=None) -> torch.Tensor:
+        """
+        Sample several captions per image with nucleus (top-p) sampling.
+
+        The image embeddings are shared by every sample; only the decoder
+        batch grows.
+
+        Returns:
+            (batch * num_samples, length) token ids; rows for image i are
+            i * num_samples to (i + 1) * num_samples - 1
+        """
+        raise NotImplementedError
+
+    def generate(self, pixel_values: torch.Tensor, max_length: int, streamer=None,
+                 deadline=None) -> torch.Tensor:
+        """Encode and decode in one call"""
+        if deadline is not None:
+            deadline.check()
+        return self.decode(self.encode(pixel_values), max_length, streamer=streamer, deadline=deadline)
+
+
+class _DeadlineCriteria(transformers.StoppingCriteria):
+    """Stops generate() between decoder steps once the deadline has expired"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.deadline.expired
+
+
+def _deadline_kwargs(deadline) -> dict:
+    if deadline is None:
+        return {}
+    return {'stopping_criteria': transformers.StoppingCriteriaList([_DeadlineCriteria(deadline)])}
+
+
+class TorchBackend(InferenceBackend):
+    """Eager PyTorch: BlipForConditionalGeneration as loaded by ModelLoader"""
+
+    name = 'torch'
+
+    def __init__(self, model_loader):
+        self.model = model_loader.model
+        self.device = next(self.model.parameters()).device
+
+    def encode(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model.vision_model(pixel_values=pixel_values.to(self.device))[0]
+
+    def decode(self, image_embeds: torch.Tensor, max_length: int, streamer=None,
+               deadline=None) -> torch.Tensor:
+        return self._generate_text(image_embeds, deadline, max_length=max_length, streamer=streamer)
+
+    def sample(self, image_embeds: torch.Tensor, max_length: int, num_samples: int,
+               top_p: float = 0.9, temperature: float = 1.0, deadline=None) -> torch.Tensor:
+        # top_k=0: nucleus sampling only, as in the ONNX backend
+        return self._generate_text(image_embeds, deadline, max_length=max_length, do_sample=True, top_k=0,
+                                   top_p=top_p, temperature=temperature,
+                                   num_return_sequences=num_samples)
+
+    def _generate_text(self, image_embeds: torch.Tensor, deadline, **kwargs) -> torch.Tensor:
+        # Same decoder call BlipForConditionalGeneration.generate makes
+        text_config = self.model.config.text_config
+        batch_size = image_embeds.shape[0]
+        image_embeds = image_embeds.to(self.device)
+        input_ids = torch.full((batch_size, 1), text_config.bos_token_id, dtype=torch.long, device=self.device)
+
+        with torch.no_grad():
+            output = self.model.text_decoder.generate(
+                input_ids=input_ids,
+                eos_token_id=text_config.sep_token_id,
+                pad_token_id=text_config.pad_token_id,
+                encoder_hidden_states=image_embeds,
+                encoder_attention_mask=torch.ones(image_embeds.shape[:-1], dtype=torch.long, device=self.device),
+                **_deadline_kwargs(deadline),
+                **kwargs
+            )
+        # Stopped early: the output is a truncated caption
+        if deadline is not None:
+            deadline.check()
+        return output
+
+    def generate(self, pixel_values: torch.Tensor, max_length: int, streamer=None,
+                 deadline=None) -> torch.Tensor:
+        with torch.no_grad():
+            output = self.model.generate(pixel_values=pixel_values.to(self.device), max_length=max_length,
+                                         streamer=streamer, **_deadline_kwargs(deadline))
+        if deadline is not None:
+            deadline.check()
+        return output
+
+
+def _split_heads(x: torch.Tensor, num_heads: int) -> torch.Tensor:
+    """(batch, seq, hidden) -> (batch, heads, seq, head_dim)"""
+    batch, seq, hidden = x.shape
+    return x.view(batch, seq, num_heads, hidden // num_heads).transpose(1, 2)
+
+
+def _attend(query: torch.Tensor, key: torch.Tensor, value: torch.Tensor, scale: float) -> torch.Tensor:
+    """Unmasked scaled dot-product attention, heads merged back into (batch, seq, hidden)"""
+    scores = torch.matmul(query, key.transpose(-1, -2)) * scale
+    context = torch.matmul(torch.softmax(scores, dim=-1), value)
+    batch, heads, seq, head_dim = context.shape
+    return context.transpose(1, 2).reshape(batch, seq, heads * head_dim)
+
+
+class _VisionEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+class _CrossAttentionCache(torch.nn.Module):
+    """Every decoder layer's cross-attention keys and values, computed once per image"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.layers = model.text_decoder.bert.encoder.layer
+        self.num_heads = model.config.text_config.num_attention_heads
+
+    def forward(self, image_embeds):
+        keys, values = [], []
+        for layer in self.layers:
+            attention = layer.crossattention.self
+            keys.append(_split_heads(attention.key(image_embeds), self.num_heads))
+            values.append(_split_heads(attention.value(image_embeds), self.num_heads))
+        return torch.stack(keys), torch.stack(values)
+
+
+class _DecoderStep(torch.nn.Module):
+    """
+    One BLIP text decoder step over explicit KV tensors.
+
+    Mirrors BlipTextLMHeadModel's forward for a single new token, using
+    its own submodules, with self-attention keys/values stacked as
+    (layers, batch, heads, past_length, head_dim) so the exported graph
+    needs no cache objects.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.embeddings = model.text_decoder.bert.embeddings
+        self.layers = model.text_decoder.bert.encoder.layer
+        self.head = model.text_decoder.cls
+        text_config = model.config.text_config
+        self.num_heads = text_config.num_attention_heads
+        self.scale = 1 / math.sqrt(text_config.hidden_size // text_config.num_attention_heads)
+
+    def forward(self, input_ids, position_ids, past_key, past_value, cross_key, cross_value):
+        embeddings = self.embeddings
+        hidden = embeddings.word_embeddings(input_ids) + embeddings.position_embeddings(position_ids)
+        hidden = embeddings.LayerNorm(hidden)
+
+        present_keys, present_values = [], []
+        for i, layer in enumerate(self.layers):
+            attention = layer.attention.self
+            key = torch.cat([past_key[i], _split_heads(attention.key(hidden), self.num_heads)], dim=2)
+            value = torch.cat([past_value[i], _split_heads(attention.value(hidden), self.num_heads)], dim=2)
+            present_keys.append(key)
+            present_values.append(value)
+
+            context = _attend(_split_heads(attention.query(hidden), self.num_heads), key, value, self.scale)
+            output = layer.attention.output
+            hidden = output.LayerNorm(output.dense(context) + hidden)
+
+            cross = layer.crossattention.self
+            context = _attend(_split_heads(cross.query(hidden), self.num_heads), cross_key[i], cross_value[i], self.scale)
+            output = layer.crossattention.output
+            hidden = output.LayerNorm(output.dense(context) + hidden)
+
+            intermediate = layer.intermediate.intermediate_act_fn(layer.intermediate.dense(hidden))
+            hidden = layer.output.LayerNorm(layer.output.dense(intermediate) + hidden)
+
+        logits = self.head(hidden)[:, -1, :]
+        return logits, torch.stack(present_keys), torch.stack(present_values)
+
+
+class OnnxBlipBackend(InferenceBackend):
+    """
+    ONNX Runtime (CPU execution provider) backend.
+
+    BLIP is exported once into three graphs, cached under MODEL_CACHE_DIR:
+    - vision.onnx: pixel_values -> image_embeds
+    - cross_kv.onnx: image_embeds -> cross-attention keys/values for every layer
+    - decoder_step.onnx: one token plus past self-attention keys/values ->
+      logits and updated keys/values
+
+    Captions are decoded greedily, feeding each step's keys/values back
+    in, so every step only processes the newest token.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_loader):
+        import onnxruntime as ort
+
+        self.export_dir = self.ensure_exported(model_loader)
+
+        with open(self.export_dir / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if config.ONNX_THREADS:
+            options.intra_op_num_threads = config.ONNX_THREADS
+
+        def session(name):
+            return ort.InferenceSession(str(self.export_dir / name), options,
+                                        providers=['CPUExecutionProvider'])
+
+        self.vision = session('vision.onnx')
+        self.cross_kv = session('cross_kv.onnx')
+        self.step = session('decoder_step.onnx')
+
+    @staticmethod
+    def export_path(model=None) -> Path:
+        """
+        Export directory for the configured model and quantization mode,
+        the loaded model's revision, and the library versions.
+        """
+        name = ModelLoader.cache_name()
+        # Hub snapshot the weights were loaded from, if known
+        revision = getattr(getattr(model, 'config', None), '_commit_hash', None)
+        if revision:
+            name += f"@{revision[:12]}"
+        return Path(config.MODEL_CACHE_DIR) / (
+            f"{name}-{config.MODEL_QUANTIZATION}-onnx{ONNX_OPSET}"
+            f"-torch{torch.__version__}-transformers{transformers.__version__}"
+        )
+
+    @classmethod
+    def ensure_exported(cls, model_loader) -> Path:
+        """Export the configured model unless a cached export exists"""
+        model = model_loader.model
+        export_dir = cls.export_path(model)
+        if not (export_dir / 'meta.json').exists():
+            cls.export(model, export_dir)
+        return export_dir
+
+    @staticmethod
+    def export(model, export_dir: Path):
+        """Export the three graphs, writing to a temporary directory first"""
+        print(f"Exporting ONNX graphs to {export_dir}")
+        model.eval()
+        vision_config = model.config.vision_config
+        text_config = model.config.text_config
+        num_layers = text_config.num_hidden_layers
+        num_heads = text_config.num_attention_heads
+        head_dim = text_config.hidden_size // num_heads
+
+        tmp_dir = export_dir.with_name(f"{export_dir.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        # Use the TorchScript exporter where torch also offers the dynamo one
+        export_kwargs = {'opset_version': ONNX_OPSET, 'do_constant_folding': True}
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs['dynamo'] = False
+
+        pixel_values = torch.zeros(2, 3, vision_config.image_size, vision_config.image_size)
+        with torch.no_grad():
+            image_embeds = model.vision_model(pixel_values=pixel_values)[0]
+            cross_key, cross_value = _CrossAttentionCache(model)(image_embeds)
+
+            torch.onnx.export(
+                _VisionEncoder(model), (pixel_values,), str(tmp_dir / 'vision.onnx'),
+                input_names=['pixel_values'], output_names=['image_embeds'],
+                dynamic_axes={'pixel_values': {0: 'batch'}, 'image_embeds': {0: 'batch'}},
+                **export_kwargs
+            )
+            torch.onnx.export(
+                _CrossAttentionCache(model), (image_embeds,), str(tmp_dir / 'cross_kv.onnx'),
+                input_names=['image_embeds'], output_names=['cross_key', 'cross_value'],
+                dynamic_axes={'image_embeds': {0: 'batch', 1: 'patches'},
+                              'cross_key': {1: 'batch', 3: 'patches'},
+                              'cross_value': {1: 'batch', 3: 'patches'}},
+                **export_kwargs
+            )
+
+            past = torch.zeros(num_layers, 2, num_heads, 3, head_dim)
+            torch.onnx.export(
+                _DecoderStep(model),
+                (torch.zeros(2, 1, dtype=torch.long), torch.full((2, 1), 3, dtype=torch.long),
+                 past, past, cross_key, cross_value),
+                str(tmp_dir / 'decoder_step.onnx'),
+                input_names=['input_ids', 'position_ids', 'past_key', 'past_value', 'cross_key', 'cross_value'],
+                output_names=['logits', 'present_key', 'present_value'],
+                dynamic_axes={
+                    'input_ids': {0: 'batch'},
+                    'position_ids': {0: 'batch'},
+                    'past_key': {1: 'batch', 3: 'past'},
+                    'past_value': {1: 'batch', 3: 'past'},
+                    'cross_key': {1: 'batch', 3: 'patches'},
+                    'cross_value': {1: 'batch', 3: 'patches'},
+                    'logits': {0: 'batch'},
+                    'present_key': {1: 'batch', 3: 'length'},
+                    'present_value': {1: 'batch', 3: 'length'},
+                },
+                **export_kwargs
+            )
+
+        with open(tmp_dir / 'meta.json', 'w') as f:
+            json.dump({
+                'num_layers': num_layers,
+                'num_heads': num_heads,
+                'head_dim': head_dim,
+                'bos_token_id': text_config.bos_token_id,
+                'sep_token_id': text_config.sep_token_id,
+                'pad_token_id': text_config.pad_token_id,
+            }, f)
+
+        # Another worker may have finished the same export first
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not (export_dir / 'meta.json').exists():
+                raise
+
+    def encode(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        pixel_values = pixel_values.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.vision.run(None, {'pixel_values': pixel_values})[0])
+
+    def decode(self, image_embeds: torch.Tensor, max_length: int, streamer=None,
+               deadline=None) -> torch.Tensor:
+        cross_key, cross_value = self._cross_attention(image_embeds)
+        return self._decode(cross_key, cross_value, max_length, _greedy, streamer=streamer, deadline=deadline)
+
+    def sample(self, image_embeds: torch.Tensor, max_length: int, num_samples: int,
+               top_p: float = 0.9, temperature: float = 1.0, deadline=None) -> torch.Tensor:
+        # Cross-attention keys/values are computed once per image, then
+        # shared by its samples
+        cross_key, cross_value = self._cross_attention(image_embeds)
+        cross_key = np.repeat(cross_key, num_samples, axis=1)
+        cross_value = np.repeat(cross_value, num_samples, axis=1)
+
+        rng = np.random.default_rng()
+        return self._decode(cross_key, cross_value, max_length,
+                            lambda logits: _sample_top_p(logits, top_p, temperature, rng), deadline=deadline)
+
+    def _cross_attention(self, image_embeds: torch.Tensor) -> tuple[np.ndarray, np.ndarray]:
+        image_embeds = image_embeds.detach().cpu().numpy().astype(np.float32, copy=False)
+        return self.cross_kv.run(None, {'image_embeds': image_embeds})
+
+    def _decode(self, cross_key: np.ndarray, cross_value: np.ndarray, max_length: int,
+                next_token: Callable[[np.ndarray], np.ndarray], streamer=None, deadline=None) -> torch.Tensor:
+        """Run decoder steps until every sequence emits SEP, max_length is reached or the deadline expires"""
+        meta = self.meta
+        batch_size = cross_key.shape[1]
+
+        past_shape = (meta['num_layers'], batch_size, meta['num_heads'], 0, meta['head_dim'])
+        past_key = np.zeros(past_shape, dtype=np.float32)
+        past_value = np.zeros(past_shape, dtype=np.float32)
+
+        input_ids = np.full((batch_size, 1), meta['bos_token_id'], dtype=np.int64)
+        tokens = [input_ids]
+        finished = np.zeros(batch_size, dtype=bool)
+        if streamer is not None:
+            streamer.put(torch.from_numpy(input_ids))
+
+        for position in range(max_length - 1):
+            if deadline is not None:
+                deadline.check()
+            logits, past_key, past_value = self.step.run(None, {
+                'input_ids': input_ids,
+                'position_ids': np.full((batch_size, 1), position, dtype=np.int64),
+                'past_key': past_key,
+                'past_value': past_value,
+                'cross_key': cross_key,
+                'cross_value': cross_value,
+            })
+
+            # Finished sequences are padded like generate() does
+            next_ids = np.where(finished, meta['pad_token_id'], next_token(logits)).astype(np.int64)
+            tokens.append(next_ids[:, None])
+            if streamer is not None:
+                streamer.put(torch.from_numpy(next_ids))
+
+            finished |= next_ids == meta['sep_token_id']
+            if finished.all():
+                break
+            input_ids = next_ids[:, None]
+
+        if streamer is not None:
+            streamer.end()
+        return torch.from_numpy(np.concatenate(tokens, axis=1))
+
+
+def _greedy(logits: np.ndarray) -> np.ndarray:
+    return logits.argmax(-1)
+
+
+def _sample_top_p(logits: np.ndarray, top_p: float, temperature: float,
+                  rng: np.random.Generator) -> np.ndarray:
+    """Sample one token per row from the smallest set of tokens whose probability exceeds top_p"""
+    logits = logits / temperature
+    probs = np.exp(logits - logits.max(-1, keepdims=True))
+    probs /= probs.sum(-1, keepdims=True)
+
+    order = np.argsort(-probs, axis=-1)
+    sorted_probs = np.take_along_axis(probs, order, axis=-1)
+    # Keep tokens until the ones before them cover top_p (always keeps the first)
+    sorted_probs = np.where(np.cumsum(sorted_probs, axis=-1) - sorted_probs < top_p, sorted_probs, 0.0)
+    cumulative = np.cumsum(sorted_probs, axis=-1)
+
+    draws = rng.random((len(logits), 1)) * cumulative[:, -1:]
+    choice = np.minimum((cumulative <= draws).sum(-1), logits.shape[-1] - 1)
+    return order[np.arange(len(logits)), choice]
+
+
+def create_backend(model_loader, name: Optional[str] = None) -> InferenceBackend:
+    """
+    Create the configured inference backend, falling back to PyTorch if
+    it can't be set up (e.g. onnxruntime missing or export failed).
+    """
+    name = name or config.INFERENCE_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{name}', expected one of {', '.join(BACKENDS)}")
+
+    if name == 'onnx':
+        if torch.cuda.is_available():
+            # ONNX Runtime runs on the CPU execution provider only
+            print("INFERENCE_BACKEND=onnx is CPU only, using PyTorch")
+            return TorchBackend(model_loader)
+        try:
+            return OnnxBlipBackend(model_loader)
+        except Exception as e:
+            print(f"ONNX backend unavailable, falling back to PyTorch: {e}")
+
+    return TorchBackend(model_loader)
@@ -1,36 +1,175 @@
 from transformers import BlipProcessor, BlipForConditionalGeneration
+from pathlib import Path
+from typing import Optional
+import os
+import re
+import threading
+import time
 import torch
+import transformers
 import config
 import warnings
 
 # Suppress the resume_download deprecation warning from huggingface_hub
 warnings.filterwarnings("ignore", category=FutureWarning, module="huggingface_hub.file_download")
 
+QUANTIZATION_MODES = ('none', 'int8')
+
+# BLIP submodules whose nn.Linear layers are quantized in int8 mode
+QUANTIZED_SUBMODULES = ('vision_model', 'text_decoder')
+
 class ModelLoader:
     """Lazy loading singleton for ML models"""
     _instance = None
     _model = None
     _processor = None
+    _load_seconds = None
+    _error = None
+
+    # Serializes loading: concurrent callers wait for the one load in
+    # progress instead of each starting their own
+    _instance_lock = threading.Lock()
+    _load_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
         return cls._instance
 
-    def load_model(self):
-        """Load the BLIP model and processor (lazy initialization)"""
-        if self._model is None or self._processor is None:
-            print(f"Loading model: {config.MODEL_NAME}")
-            self._processor = BlipProcessor.from_pretrained(config.MODEL_NAME)
-            self._model = BlipForConditionalGeneration.from_pretrained(config.MODEL_NAME)
+    def load_model(self, timeout: Optional[float] = None):
+        """
+        Load the BLIP model and processor (lazy initialization).
+
+        Args:
+            timeout: Seconds to wait for a load already in progress
+                (defaults to config.MODEL_LOAD_TIMEOUT)
+
+        Raises:
+            TimeoutError: If another thread is still loading after timeout
+        """
+        if self._model is not None and self._processor is not None:
+            return self._model, self._processor
 
-            # Use GPU if available
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            self._model.to(device)
-            print(f"Model loaded on device: {device}")
+        timeout = config.MODEL_LOAD_TIMEOUT if timeout is None else timeout
+        if not self._load_lock.acquire(timeout=timeout):
+            raise TimeoutError(f"Model still loading after {timeout}s")
+        try:
+            if self._model is None or self._processor is None:
+                print(f"Loading model: {config.MODEL_NAME}")
+                started = time.monotonic()
+                try:
+                    processor = BlipProcessor.from_pretrained(config.MODEL_NAME)
+
+                    # Use GPU if available
+                    device = "cuda" if torch.cuda.is_available() else "cpu"
+                    if self._quantization(device) == 'int8':
+                        model = self._load_int8()
+                    else:
+                        model = BlipForConditionalGeneration.from_pretrained(config.MODEL_NAME)
+                        model.to(device)
+                except Exception as e:
+                    ModelLoader._error = str(e)
+                    raise
+
+                # Publish only once fully loaded and on its device
+                ModelLoader._processor = processor
+                ModelLoader._model = model
+                ModelLoader._load_seconds = time.monotonic() - started
+                ModelLoader._error = None
+                print(f"Model loaded on device: {device} in {self._load_seconds:.1f}s")
+        finally:
+            self._load_lock.release()
 
         return self._model, self._processor
 
+    @staticmethod
+    def _quantization(device: str) -> str:
+        """Quantization mode to use on this device"""
+        mode = config.MODEL_QUANTIZATION
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown MODEL_QUANTIZATION '{mode}', expected one of {', '.join(QUANTIZATION_MODES)}")
+        if mode == 'int8' and device != 'cpu':
+            # Dynamic quantization only has CPU kernels
+            print("MODEL_QUANTIZATION=int8 is CPU only, loading fp32 weights")
+            return 'none'
+        return mode
+
+    @staticmethod
+    def cache_name() -> str:
+        """Filesystem-safe name of the configured model, for cache paths"""
+        return re.sub(r'[^A-Za-z0-9._-]+', '--', config.MODEL_NAME.strip('/'))
+
+    @staticmethod
+    def quantized_cache_path() -> Path:
+        """
+        Where the int8 model for the configured model is cached.
+
+        The torch and transformers versions are part of the name because
+        the cache is a pickled module tree.
+        """
+        return Path(config.MODEL_CACHE_DIR) / (
+            f"{ModelLoader.cache_name()}-int8-torch{torch.__version__}-transformers{transformers.__version__}.pt"
+        )
+
+    @staticmethod
+    def quantize(model: BlipForConditionalGeneration) -> BlipForConditionalGeneration:
+        """Apply dynamic int8 quantization to the vision encoder and text decoder Linear layers"""
+        from torch.ao.quantization import quantize_dynamic
+
+        model.eval()
+        for name in QUANTIZED_SUBMODULES:
+            quantize_dynamic(getattr(model, name), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    def _load_int8(self) -> BlipForConditionalGeneration:
+        """Load the int8 model from the disk cache, building and caching it on a miss"""
+        path = self.quantized_cache_path()
+        if path.exists():
+            try:
+                # Our own cache file; quantized modules are not plain tensors
+                model = torch.load(path, weights_only=False)
+                print(f"Loaded int8 model from {path}")
+                return model.eval()
+            except Exception as e:
+                print(f"Ignoring unreadable int8 model cache {path}: {e}")
+
+        model = self.quantize(BlipForConditionalGeneration.from_pretrained(config.MODEL_NAME))
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so other workers never read a partial file
+            tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+            torch.save(model, tmp_path)
+            os.replace(tmp_path, path)
+            print(f"Cached int8 model at {path}")
+        except OSError as e:
+            print(f"Failed to cache int8 model: {e}")
+        return model
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None and self._processor is not None
+
+    def status(self) -> dict:
+        """Get model loading state"""
+        if self.is_loaded:
+            state = 'loaded'
+        elif self._load_lock.locked():
+            state = 'loading'
+        elif self._error:
+            state = 'failed'
+        else:
+            state = 'not_loaded'
+        return {
+            'model': config.MODEL_NAME,
+            'quantization': config.MODEL_QUANTIZATION,
+            'state': state,
+            'load_seconds': round(self._load_seconds, 2) if self._load_seconds is not None else None,
+            'error': self._error
+        }
+
     @property
     def model(self):
         if self._model is None:
@@ -0,0 +1,112 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+import numpy as np
+import torch
+from PIL import Image
+
+# BLIP's normalization constants (OPENAI_CLIP_MEAN / OPENAI_CLIP_STD)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+# Idle buffer sets kept for reuse; more are allocated under heavier concurrency
+MAX_IDLE_BUFFERS = 4
+
+
+class _Buffers:
+    """Preallocated uint8 staging and float32 output buffers for one batch"""
+
+    def __init__(self, capacity: int, height: int, width: int):
+        self.capacity = capacity
+        self.pixels = np.empty((capacity, height, width, 3), dtype=np.uint8)
+        self.values = torch.empty((capacity, 3, height, width), dtype=torch.float32)
+
+
+class TensorPreprocessor:
+    """
+    Drop-in replacement for BlipProcessor's image path.
+
+    Each image is resized with PIL (the same bicubic filter BlipProcessor
+    uses) and copied into a preallocated uint8 NHWC buffer. The whole batch
+    is then converted to float, transposed to NCHW, rescaled and
+    normalized by one vectorized torch copy plus an in-place
+    multiply-add, into a preallocated float32 buffer.
+
+    Buffers are reused across calls. batch() lends a set out for the
+    duration of a with block, so concurrent callers never share one.
+    """
+
+    def __init__(self, size: tuple[int, int] = (384, 384), mean=CLIP_MEAN, std=CLIP_STD,
+                 rescale_factor: float = 1 / 255, resample=Image.Resampling.BICUBIC):
+        self.height, self.width = size
+        self.resample = resample
+
+        # (x * rescale - mean) / std == x * scale + offset
+        mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self._scale = rescale_factor / std
+        self._offset = -mean / std
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_processor(cls, processor) -> 'TensorPreprocessor':
+        """Build one with the same settings as a BlipProcessor"""
+        image_processor = getattr(processor, 'image_processor', processor)
+        size = image_processor.size
+        return cls(
+            size=(size['height'], size['width']),
+            mean=tuple(image_processor.image_mean),
+            std=tuple(image_processor.image_std),
+            rescale_factor=image_processor.rescale_factor,
+            resample=Image.Resampling(int(image_processor.resample))
+        )
+
+    def _acquire(self, batch_size: int) -> _Buffers:
+        with self._lock:
+            for i, buffers in enumerate(self._idle):
+                if buffers.capacity >= batch_size:
+                    return self._idle.pop(i)
+        return _Buffers(batch_size, self.height, self.width)
+
+    def _release(self, buffers: _Buffers):
+        with self._lock:
+            self._idle.append(buffers)
+            if len(self._idle) > MAX_IDLE_BUFFERS:
+                # Drop the smallest set
+                self._idle.remove(min(self._idle, key=lambda b: b.capacity))
+
+    @contextmanager
+    def batch(self, images: list[Image.Image]) -> Iterator[torch.Tensor]:
+        """
+        Preprocess images into a (N, 3, H, W) float32 tensor.
+
+        The tensor is a view of a reused buffer: it is only valid inside
+        the with block.
+        """
+        buffers = self._acquire(len(images))
+        try:
+            yield self._fill(buffers, images)
+        finally:
+            self._release(buffers)
+
+    def __call__(self, images: list[Image.Image]) -> torch.Tensor:
+        """Preprocess images into a new tensor the caller can keep"""
+        with self.batch(images) as pixel_values:
+            return pixel_values.clone()
+
+    def _fill(self, buffers: _Buffers, images: list[Image.Image]) -> torch.Tensor:
+        n = len(images)
+        for i, image in enumerate(images):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if image.size != (self.width, self.height):
+                image = image.resize((self.width, self.height), self.resample)
+            buffers.pixels[i] = np.asarray(image)
+
+        # uint8 NHWC -> float32 NCHW in one strided copy, then normalize in place
+        values = buffers.values[:n]
+        values.copy_(torch.from_numpy(buffers.pixels[:n]).permute(0, 3, 1, 2))
+        values.mul_(self._scale).add_(self._offset)
+        return values
@@ -0,0 +1,76 @@
+import threading
+import time
+from typing import Callable, Optional
+
+
+class ModelWarmUp:
+    """
+    Loads the caption model and runs one inference in a background thread.
+
+    Started from create_app, so the server accepts connections (and
+    answers /health) right away while the model loads. Requests that
+    arrive in the meantime wait for the warm-up instead of starting a
+    load of their own.
+    """
+
+    def __init__(self, get_generator: Callable):
+        self._get_generator = get_generator
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self._state = 'not_started'
+        self._started_at = None
+        self._seconds = None
+        self._error = None
+
+    def start(self):
+        """Start warming up in the background (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._state = 'warming_up'
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='model-warm-up', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            self._get_generator().warm_up()
+            state, error = 'ready', None
+        except Exception as e:
+            print(f"Model warm-up failed: {e}")
+            state, error = 'failed', str(e)
+
+        with self._lock:
+            self._state = state
+            self._error = error
+            self._seconds = time.monotonic() - started
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block while a warm-up is in progress.
+
+        Returns:
+            False if it is still running after timeout
+        """
+        if self._thread is None:
+            return True
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            # Without eager loading the model is loaded on first use
+            return self._state in ('not_started', 'ready')
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'ready': self._state in ('not_started', 'ready'),
+                'state': self._state,
+                'started_at': self._started_at,
+                'warm_up_seconds': round(self._seconds, 2) if self._seconds is not None else None,
+                'error': self._error
+            }
@@ -1,5 +1,7 @@
 from .caption import caption_bp
 from .rating import rating_bp
 from .history import history_bp
+from .stats import stats_bp
+from .jobs import jobs_bp
 
-__all__ = ['caption_bp', 'rating_bp', 'history_bp']
+__all__ = ['caption_bp', 'rating_bp', 'history_bp', 'stats_bp', 'jobs_bp']
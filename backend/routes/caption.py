@@ -1,7 +1,18 @@
-from flask import Blueprint, request, jsonify
-from models import CaptionGenerator
+import json
+import math
+import threading
+from contextlib import nullcontext
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from models import CaptionGenerator, ModelWarmUp
+from models.deadline import Deadline, DeadlineExceeded
+from models.caption_generator import FAILED_CAPTION, PROMPT, model_name
+from models.gemini_client import GeminiUnavailable
 from services import ImageProcessor, StorageService
+from services.admission import AdmissionController, Overloaded
 from services.cache_service import cache
+from services.preprocess_pool import get_preprocess_pool
 from database.models import CaptionHistory
 import config
 
@@ -11,23 +22,216 @@ caption_bp = Blueprint('caption', __name__)
 image_processor = ImageProcessor()
 storage_service = StorageService()
 caption_generator = None  # Will be initialized on first request
+decode_pool = None  # Shared by batch requests, created on first use
+
+
+_caption_generator_lock = threading.Lock()
 
 
 def get_caption_generator():
     """Lazy initialization of caption generator"""
     global caption_generator
     if caption_generator is None:
-        caption_generator = CaptionGenerator()
+        with _caption_generator_lock:
+            if caption_generator is None:
+                caption_generator = CaptionGenerator()
     return caption_generator
 
 
+# Background model load, started by create_app when MODEL_EAGER_LOAD is set
+warm_up = ModelWarmUp(get_caption_generator)
+
+
+def _model_loading_response():
+    """
+    Wait for an in-progress warm-up, up to MODEL_LOAD_TIMEOUT.
+
+    Returns:
+        A 503 response if the model is still loading, else None
+    """
+    if warm_up.wait(config.MODEL_LOAD_TIMEOUT):
+        return None
+    response = jsonify({'error': 'Model is still loading, try again later'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+# Shared by every endpoint and job that runs the model
+admission = AdmissionController()
+
+
+def inference_slot(shed: bool = True, timeout: Optional[float] = None):
+    """Context manager holding an admission slot for one inference, if enabled"""
+    if not config.ADMISSION_ENABLED:
+        return nullcontext()
+    return admission.slot(shed, timeout)
+
+
+def _overloaded_response(e: Overloaded):
+    """429 telling the client when capacity is expected to free up"""
+    response = jsonify({'error': 'Server is busy, try again later', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+
+def _gemini_unavailable_response(e: GeminiUnavailable):
+    """503 while Gemini calls are being refused (open circuit or saturated rate limit)"""
+    retry_after = max(1, math.ceil(e.retry_after))
+    response = jsonify({'error': 'Caption service temporarily unavailable, try again later',
+                        'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+
+def _deadline_response():
+    """504 when the caption wasn't ready within INFERENCE_TIMEOUT"""
+    return jsonify({'error': 'Caption generation timed out'}), 504
+
+
+_decode_pool_lock = threading.Lock()
+
+
+def get_decode_pool():
+    """Lazy initialization of the batch decode thread pool"""
+    global decode_pool
+    if decode_pool is None:
+        with _decode_pool_lock:
+            if decode_pool is None:
+                decode_pool = ThreadPoolExecutor(
+                    max_workers=config.BATCH_DECODE_WORKERS,
+                    thread_name_prefix='batch-decode'
+                )
+    return decode_pool
+
+
+def cache_settings(model: Optional[str] = None) -> dict:
+    """
+    Generation settings a cached caption is keyed by: the model, its
+    prompt (Gemini only) and max_length.
+
+    Args:
+        model: Model that generated the caption (default: the configured one)
+    """
+    model = model or model_name(config.USE_GEMINI)
+    return {
+        'model': model,
+        'prompt': PROMPT if model == model_name(True) else None,
+        'max_length': config.CAPTION_MAX_LENGTH
+    }
+
+
+def is_cacheable(caption: str) -> bool:
+    """Whether a generated caption may be cached: not empty or the failure placeholder"""
+    return bool(caption) and caption != FAILED_CAPTION
+
+
+def _lookup_upload(image_data: bytes, upload_hash: str):
+    """
+    Look up an upload in the caption cache, decoding it only if needed.
+
+    The raw upload hash is checked first; on a miss the image is decoded
+    (in the preprocessing pool) and checked under its canonical key and,
+    if enabled, its perceptual hash.
+
+    Returns:
+        (caption, image, canonical_hash, phash): caption is None on a miss,
+        image is None on a raw-hash hit
+    """
+    # Fast path: an identical upload was captioned before, skip decoding
+    caption = cache.get_by_hash(upload_hash, **cache_settings())
+    if caption:
+        print("Cache hit (raw upload) - returning cached caption")
+        return caption, None, None, None
+
+    # Process image
+    image, canonical_hash = get_preprocess_pool().preprocess(image_data)
+
+    # Check cache under the canonical post-resize key
+    caption = cache.get_by_hash(canonical_hash, **cache_settings())
+
+    # Near-duplicate lookup for resized or recompressed copies
+    phash = None
+    if not caption and cache.near_duplicates_enabled:
+        phash = image_processor.compute_dhash(image)
+        caption = cache.get_near_duplicate(phash, **cache_settings())
+
+    if caption:
+        print("Cache hit - returning cached caption")
+        cache.set_by_hash(upload_hash, caption, **cache_settings())
+    return caption, image, canonical_hash, phash
+
+
+def _remember_caption(upload_hash: str, canonical_hash: str, phash, caption: str,
+                      model: Optional[str] = None):
+    """Store a newly generated caption under every cache key for the upload"""
+    if not is_cacheable(caption):
+        return
+    settings = cache_settings(model)
+    cache.set_by_hash(canonical_hash, caption, **settings)
+    if phash is not None:
+        cache.set_near_duplicate(phash, caption, **settings)
+    cache.set_by_hash(upload_hash, caption, **settings)
+
+
+def store_upload(image_data: bytes, upload_hash: str, filename: str, image=None) -> tuple[str, str]:
+    """
+    Save an upload in its stored form, the preprocessed image.
+
+    Without a decoded image (a raw-hash hit), the file stored for an
+    earlier upload of the same bytes is reused; the upload is only
+    decoded if there is none.
+
+    Returns:
+        (image_id, image_path)
+    """
+    if image is None:
+        saved = storage_service.save_upload(upload_hash)
+        if saved is not None:
+            return saved
+        image, _ = get_preprocess_pool().preprocess(image_data)
+    return storage_service.save_image(image, filename, upload_hash=upload_hash)
+
+
+def _save_and_record(image_data: bytes, upload_hash: str, image, filename: str, caption: str,
+                     candidates: Optional[list[str]] = None,
+                     model_used: Optional[str] = None) -> tuple[str, str]:
+    """
+    Save the upload and record the caption in history.
+
+    Args:
+        model_used: Model that generated the caption (default: the
+            configured one)
+
+    Returns:
+        (image_id, model_used)
+    """
+    image_id, image_path = store_upload(image_data, upload_hash, filename, image)
+
+    model_used = model_used or model_name(config.USE_GEMINI)
+    try:
+        CaptionHistory.create(
+            image_id=image_id,
+            image_path=image_path,
+            caption=caption,
+            model_used=model_used,
+            candidates=candidates
+        )
+    except Exception:
+        # No captions row will hold the reference the save took
+        storage_service.release(image_path)
+        raise
+    return image_id, model_used
+
+
 @caption_bp.route('/caption', methods=['POST'])
 def generate_caption():
     """
     Generate caption for uploaded image.
 
-    Expected: multipart/form-data with 'image' file
-    Returns: JSON with caption and image_id
+    Expected: multipart/form-data with 'image' file and optional
+    'num_candidates' (1 to CAPTION_MAX_CANDIDATES, default 1)
+    Returns: JSON with caption and image_id, plus 'candidates' (the
+    caption first, then alternatives) if num_candidates > 1
     """
     # Check if file is in request
     if 'image' not in request.files:
@@ -40,45 +244,352 @@ def generate_caption():
     if not is_valid:
         return jsonify({'error': error_msg}), 400
 
+    num_candidates = request.form.get('num_candidates', 1, type=int)
+    if not 1 <= num_candidates <= config.CAPTION_MAX_CANDIDATES:
+        return jsonify({'error': f'num_candidates must be between 1 and {config.CAPTION_MAX_CANDIDATES}'}), 400
+
     try:
-        # Process image
-        image = image_processor.process_image(file)
+        # Read the upload, hashing the raw bytes as they stream in
+        image_data, upload_hash = image_processor.read_upload(file)
 
-        # Check cache
-        image_bytes = image_processor.image_to_bytes(image)
-        cached_caption = cache.get(image_bytes)
+        candidates = None
+        model_used = None  # the configured model, unless hedging says otherwise
+        if num_candidates > 1:
+            # Alternatives are sampled fresh each time, so the caption
+            # cache is bypassed
+            loading = _model_loading_response()
+            if loading:
+                return loading
+            deadline = Deadline(config.INFERENCE_TIMEOUT)
 
-        if cached_caption:
-            print("Cache hit - returning cached caption")
-            caption = cached_caption
+            image, canonical_hash = get_preprocess_pool().preprocess(image_data)
+            with inference_slot():
+                candidates = get_caption_generator().generate_candidates(
+                    image, num_candidates, max_length=config.CAPTION_MAX_LENGTH,
+                    image_hash=canonical_hash, deadline=deadline
+                )
+            caption = candidates[0]
         else:
-            # Generate caption
-            generator = get_caption_generator()
-            caption = generator.generate_caption(image)
+            caption, image, canonical_hash, phash = _lookup_upload(image_data, upload_hash)
 
-            # Store in cache
-            cache.set(image_bytes, caption)
+            if not caption:
+                loading = _model_loading_response()
+                if loading:
+                    return loading
+                # Counted from here, so waiting out a warm-up doesn't use it up
+                deadline = Deadline(config.INFERENCE_TIMEOUT)
 
-        # Save image and record to database
-        image_id, image_path = storage_service.save_image(image, file.filename)
-        model_used = 'gemini' if config.USE_GEMINI else config.MODEL_NAME
+                # Generate caption; with hedging either backend may answer
+                generator = get_caption_generator()
+                with inference_slot():
+                    caption, model_used = generator.generate_caption_with_model(
+                        image, max_length=config.CAPTION_MAX_LENGTH,
+                        image_hash=canonical_hash, deadline=deadline
+                    )
 
-        CaptionHistory.create(
-            image_id=image_id,
-            image_path=image_path,
-            caption=caption,
-            model_used=model_used
-        )
+                # Store in cache
+                _remember_caption(upload_hash, canonical_hash, phash, caption, model_used)
 
-        return jsonify({
+        # Save image and record to database
+        image_id, model_used = _save_and_record(image_data, upload_hash, image, file.filename, caption,
+                                                candidates, model_used)
+
+        result = {
             'success': True,
             'image_id': image_id,
             'caption': caption,
             'model': model_used
-        }), 200
+        }
+        if candidates is not None:
+            result['candidates'] = candidates
+        return jsonify(result), 200
 
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except GeminiUnavailable as e:
+        return _gemini_unavailable_response(e)
+    except DeadlineExceeded:
+        return _deadline_response()
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error generating caption: {e}")
         return jsonify({'error': 'Failed to generate caption'}), 500
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@caption_bp.route('/caption/stream', methods=['POST'])
+def stream_caption():
+    """
+    Generate caption for uploaded image, streaming tokens as Server-Sent Events.
+
+    Expected: multipart/form-data with 'image' file
+    Returns: text/event-stream with events:
+    - token: {"text": "..."} for each generated piece of the caption
+    - done: {"success": true, "image_id", "caption", "model", "cached"}
+    - error: {"error": "..."} if generation fails mid-stream
+    """
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
+
+    file = request.files['image']
+
+    is_valid, error_msg = image_processor.validate_file(file)
+    if not is_valid:
+        return jsonify({'error': error_msg}), 400
+
+    try:
+        image_data, upload_hash = image_processor.read_upload(file)
+        caption, image, canonical_hash, phash = _lookup_upload(image_data, upload_hash)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error generating caption: {e}")
+        return jsonify({'error': 'Failed to generate caption'}), 500
+
+    # The slot is held until the response is closed, as tokens are
+    # generated while the body streams
+    started = None
+    deadline = None
+    if not caption:
+        loading = _model_loading_response()
+        if loading:
+            return loading
+        deadline = Deadline(config.INFERENCE_TIMEOUT)
+        if config.ADMISSION_ENABLED:
+            try:
+                started = admission.acquire()
+            except Overloaded as e:
+                return _overloaded_response(e)
+
+    filename = file.filename
+
+    def events():
+        nonlocal caption
+        try:
+            cached = bool(caption)
+            if cached:
+                yield _sse_event('token', {'text': caption})
+            else:
+                pieces = []
+                for text in get_caption_generator().stream_caption(image, max_length=config.CAPTION_MAX_LENGTH,
+                                                                   image_hash=canonical_hash,
+                                                                   deadline=deadline):
+                    pieces.append(text)
+                    yield _sse_event('token', {'text': text})
+                caption = ''.join(pieces).strip()
+                _remember_caption(upload_hash, canonical_hash, phash, caption)
+
+            image_id, model_used = _save_and_record(image_data, upload_hash, image, filename, caption)
+            yield _sse_event('done', {
+                'success': True,
+                'image_id': image_id,
+                'caption': caption,
+                'model': model_used,
+                'cached': cached
+            })
+
+        except DeadlineExceeded:
+            yield _sse_event('error', {'error': 'Caption generation timed out'})
+        except Exception as e:
+            print(f"Error streaming caption: {e}")
+            yield _sse_event('error', {'error': 'Failed to generate caption'})
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if started is not None:
+        response.call_on_close(lambda: admission.release(started))
+    return response
+
+
+def _read_batch_upload(file):
+    """Validate, read and hash one file of a batch upload"""
+    is_valid, error_msg = image_processor.validate_file(file)
+    if not is_valid:
+        raise ValueError(error_msg)
+    return image_processor.read_upload(file)
+
+
+def _decode_batch_upload(image_data):
+    """Decode one upload and hash its canonical form"""
+    return get_preprocess_pool().preprocess(image_data)
+
+
+def _map_in_pool(fn, args):
+    """
+    Run fn over args on the decode pool.
+
+    Each thread hands its upload to the preprocessing pool and waits, so
+    uploads are processed in parallel. Returns a (result, error_message) pair per arg.
+    """
+    futures = [get_decode_pool().submit(fn, arg) for arg in args]
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append((future.result(), None))
+        except ValueError as e:
+            outcomes.append((None, str(e)))
+        except Exception as e:
+            print(f"Error processing batch item: {e}")
+            outcomes.append((None, 'Failed to process image'))
+    return outcomes
+
+
+@caption_bp.route('/captions/batch', methods=['POST'])
+def generate_caption_batch():
+    """
+    Generate captions for several uploaded images in one request.
+
+    Expected: multipart/form-data with one or more 'images' files
+    Returns: JSON with a result or error per file, in upload order
+    """
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'No image files provided'}), 400
+
+    if len(files) > config.BATCH_CAPTION_MAX_FILES:
+        return jsonify({
+            'error': f'Too many files: at most {config.BATCH_CAPTION_MAX_FILES} per batch'
+        }), 400
+
+    try:
+        items = [{'filename': file.filename, 'error': None, 'caption': None} for file in files]
+
+        # Validate, read and hash every upload in parallel
+        for item, (result, error) in zip(items, _map_in_pool(_read_batch_upload, files)):
+            if error:
+                item['error'] = error
+            else:
+                item['data'], item['upload_hash'] = result
+
+        # Bulk lookup under the raw upload hashes
+        pending = [item for item in items if not item['error']]
+        settings = cache_settings()
+        raw_hits = cache.get_many_by_hash([item['upload_hash'] for item in pending], **settings)
+        for item, caption in zip(pending, raw_hits):
+            item['caption'] = caption
+            item['cached'] = caption is not None
+
+        # Decode the rest in parallel
+        to_decode = [item for item in pending if item['caption'] is None]
+        for item, (result, error) in zip(to_decode, _map_in_pool(_decode_batch_upload, [i['data'] for i in to_decode])):
+            if error:
+                item['error'] = error
+            else:
+                item['image'], item['canonical_hash'] = result
+
+        # Bulk lookup under the canonical post-resize keys
+        decoded = [item for item in to_decode if not item['error']]
+        for item, caption in zip(decoded, cache.get_many_by_hash([i['canonical_hash'] for i in decoded], **settings)):
+            item['caption'] = caption
+            item['cached'] = caption is not None
+
+        misses = [item for item in decoded if item['caption'] is None]
+        if cache.near_duplicates_enabled:
+            for item in misses:
+                item['phash'] = image_processor.compute_dhash(item['image'])
+                item['caption'] = cache.get_near_duplicate(item['phash'], **settings)
+                item['cached'] = item['caption'] is not None
+            misses = [item for item in misses if item['caption'] is None]
+
+        # Only the misses go through the model, in one batched call;
+        # identical images within the batch are generated once
+        unique_misses = {}
+        for item in misses:
+            unique_misses.setdefault(item['canonical_hash'], []).append(item)
+
+        if unique_misses:
+            loading = _model_loading_response()
+            if loading:
+                return loading
+            deadline = Deadline(config.INFERENCE_TIMEOUT)
+
+            groups = list(unique_misses.values())
+            with inference_slot():
+                captions = get_caption_generator().generate_caption_batch(
+                    [group[0]['image'] for group in groups],
+                    max_length=config.CAPTION_MAX_LENGTH,
+                    image_hashes=[group[0]['canonical_hash'] for group in groups],
+                    deadline=deadline
+                )
+            for group, caption in zip(groups, captions):
+                for item in group:
+                    item['caption'] = caption
+                if not is_cacheable(caption):
+                    continue
+                cache.set_by_hash(group[0]['canonical_hash'], caption, **settings)
+                for item in group:
+                    if item.get('phash') is not None:
+                        cache.set_near_duplicate(item['phash'], caption, **settings)
+
+        for item in decoded:
+            if is_cacheable(item['caption']):
+                cache.set_by_hash(item['upload_hash'], item['caption'], **settings)
+
+        # Save images in parallel
+        def save(item):
+            return store_upload(item['data'], item['upload_hash'], item['filename'], item.get('image'))
+
+        completed = [item for item in items if not item['error']]
+        for item, (result, error) in zip(completed, _map_in_pool(save, completed)):
+            if error:
+                item['error'] = error
+            else:
+                item['image_id'], item['image_path'] = result
+
+        # Record every caption in a single transaction
+        model_used = model_name(config.USE_GEMINI)
+        saved = [item for item in completed if not item['error']]
+        try:
+            CaptionHistory.create_many([
+                (item['image_id'], item['image_path'], item['caption'], model_used)
+                for item in saved
+            ])
+        except Exception:
+            for item in saved:
+                storage_service.release(item['image_path'])
+            raise
+
+        results = []
+        for index, item in enumerate(items):
+            if item['error']:
+                results.append({
+                    'index': index,
+                    'filename': item['filename'],
+                    'success': False,
+                    'error': item['error']
+                })
+            else:
+                results.append({
+                    'index': index,
+                    'filename': item['filename'],
+                    'success': True,
+                    'image_id': item['image_id'],
+                    'caption': item['caption'],
+                    'cached': item['cached']
+                })
+
+        return jsonify({
+            'success': True,
+            'model': model_used,
+            'results': results,
+            'succeeded': len(saved),
+            'failed': len(items) - len(saved)
+        }), 200
+
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except GeminiUnavailable as e:
+        return _gemini_unavailable_response(e)
+    except DeadlineExceeded:
+        return _deadline_response()
+    except Exception as e:
+        print(f"Error generating batch captions: {e}")
+        return jsonify({'error': 'Failed to generate captions'}), 500
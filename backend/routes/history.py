@@ -1,3 +1,4 @@
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
 from database.models import CaptionHistory, Rating
 
@@ -7,10 +8,14 @@ history_bp = Blueprint('history', __name__)
 @history_bp.route('/history', methods=['GET'])
 def get_history():
     """
-    Get caption history with optional limit.
+    Get caption history, newest first, one page at a time.
 
     Query params:
     - limit: Number of records to return (default: 50)
+    - cursor: next_cursor from the previous response
+    - model: Only return captions from this model
+    - since: Only return captions created at or after this ISO date/time (UTC)
+    - until: Only return captions created before this ISO date/time (UTC)
     """
     limit = request.args.get('limit', 50, type=int)
 
@@ -18,15 +23,28 @@ def get_history():
     if limit < 1 or limit > 100:
         return jsonify({'error': 'Limit must be between 1 and 100'}), 400
 
+    try:
+        created_after = _parse_datetime(request.args.get('since'))
+        created_before = _parse_datetime(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 dates'}), 400
+
     try:
         # Get caption history
-        history = CaptionHistory.get_all(limit=limit)
+        history, next_cursor = CaptionHistory.get_page(
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            model_used=request.args.get('model'),
+            created_after=created_after,
+            created_before=created_before
+        )
 
         # Convert to JSON-serializable format
         history_data = [
             {
                 'image_id': record.id,
                 'caption': record.caption,
+                'candidates': record.candidates,
                 'model_used': record.model_used,
                 'created_at': record.created_at.isoformat()
             }
@@ -40,14 +58,28 @@ def get_history():
             'success': True,
             'history': history_data,
             'total_records': len(history_data),
+            'next_cursor': next_cursor,
             'average_rating': round(avg_rating, 2)
         }), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error fetching history: {e}")
         return jsonify({'error': 'Failed to fetch history'}), 500
 
 
+def _parse_datetime(value):
+    """Parse an optional ISO 8601 query parameter"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # Stored timestamps are naive UTC
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 @history_bp.route('/history/<image_id>/ratings', methods=['GET'])
 def get_image_ratings(image_id):
     """Get all ratings for a specific image"""
@@ -0,0 +1,213 @@
+import time
+import uuid
+from pathlib import Path
+from flask import Blueprint, request, jsonify, url_for
+from routes.caption import (image_processor, storage_service, get_caption_generator, warm_up, inference_slot,
+                            cache_settings, is_cacheable, store_upload)
+from models.caption_generator import model_name
+from services.admission import Overloaded
+from services.cache_service import cache
+from services.job_queue import JobQueue
+from services.preprocess_pool import get_preprocess_pool
+from database.models import CaptionHistory, CaptionJob
+import config
+
+jobs_bp = Blueprint('jobs', __name__)
+
+FINISHED_STATUSES = ('done', 'failed')
+
+
+def _process_job(job_id: str):
+    """Run one queued job on an inference worker"""
+    if not CaptionJob.claim(job_id):
+        return  # Already taken by another worker or process
+
+    job = CaptionJob.get(job_id)
+    # A stale job may have been recorded by an earlier run before it was
+    # requeued; running it again would release a reference that run's
+    # captions row holds
+    if _complete_from_history(job):
+        return
+    if job.attempts > config.JOB_MAX_ATTEMPTS:
+        _fail_job(job, f'Gave up after {config.JOB_MAX_ATTEMPTS} attempts')
+        return
+
+    try:
+        # Jobs queued during start-up wait for the warm-up rather than
+        # failing, and go back to the queue if it takes too long
+        if not warm_up.wait(config.MODEL_LOAD_TIMEOUT):
+            CaptionJob.requeue(job_id)
+            return
+        image, canonical_hash = get_preprocess_pool().preprocess(Path(job.image_path).read_bytes())
+        # Jobs already wait in their own queue, so they are never shed up
+        # front, but a job that can't get a slot in time is requeued too
+        with inference_slot(shed=False, timeout=config.ADMISSION_MAX_WAIT):
+            # Only time spent running counts towards JOB_STALE_SECONDS
+            CaptionJob.touch(job_id)
+            caption, model_used = get_caption_generator().generate_caption_with_model(
+                image, max_length=config.CAPTION_MAX_LENGTH, image_hash=canonical_hash
+            )
+        if is_cacheable(caption):
+            cache.set_by_hash(job.upload_hash, caption, **cache_settings(model_used))
+
+        CaptionHistory.create(
+            image_id=job.image_id,
+            image_path=job.image_path,
+            caption=caption,
+            model_used=model_used
+        )
+        CaptionJob.complete(job_id, caption, model_used)
+
+    except Overloaded:
+        CaptionJob.requeue(job_id)
+    except Exception as e:
+        print(f"Error processing caption job {job_id}: {e}")
+        # Another run of the same job may have recorded it meanwhile
+        if not _complete_from_history(job):
+            _fail_job(job, 'Failed to generate caption')
+
+
+def _complete_from_history(job: CaptionJob) -> bool:
+    """Mark the job done if its captions row has already been written"""
+    record = CaptionHistory.get(job.image_id)
+    if record is None:
+        return False
+    CaptionJob.complete(job.id, record.caption, record.model_used)
+    return True
+
+
+def _fail_job(job: CaptionJob, error: str):
+    """Fail a job whose caption was never recorded"""
+    # No captions row will hold the upload's reference. Released before
+    # the job is marked failed, so pollers see the finished state
+    try:
+        storage_service.release(job.image_path)
+    except Exception as release_error:
+        print(f"Error releasing upload for caption job {job.id}: {release_error}")
+    CaptionJob.fail(job.id, error)
+
+
+def _job_backlog(limit: int) -> list[str]:
+    """Queued jobs from the database, including ones orphaned by a restart"""
+    if limit <= 0:
+        return []
+    CaptionJob.requeue_stale(config.JOB_STALE_SECONDS)
+    return CaptionJob.get_queued_ids(limit)
+
+
+job_queue = JobQueue(_process_job, backlog_fn=_job_backlog)
+
+
+def _job_to_dict(job: CaptionJob) -> dict:
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'image_id': job.image_id,
+        'caption': job.caption,
+        'model': job.model_used,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat()
+    }
+
+
+@jobs_bp.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Submit an image for captioning without waiting for the result.
+
+    Expected: multipart/form-data with 'image' file
+    Returns: 202 with job_id (poll GET /api/jobs/<job_id>), or 200 with
+    the finished job if the caption was already cached
+    """
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
+
+    file = request.files['image']
+
+    is_valid, error_msg = image_processor.validate_file(file)
+    if not is_valid:
+        return jsonify({'error': error_msg}), 400
+
+    try:
+        image_data, upload_hash = image_processor.read_upload(file)
+        job_id = str(uuid.uuid4())
+
+        caption = cache.get_by_hash(upload_hash, **cache_settings())
+        if caption:
+            image_id, image_path = store_upload(image_data, upload_hash, file.filename)
+            model_used = model_name(config.USE_GEMINI)
+            try:
+                CaptionHistory.create(
+                    image_id=image_id,
+                    image_path=image_path,
+                    caption=caption,
+                    model_used=model_used
+                )
+            except Exception:
+                storage_service.release(image_path)
+                raise
+            job = CaptionJob.create_done(job_id, file.filename, upload_hash, image_id,
+                                         image_path, caption, model_used)
+            return jsonify({'success': True, **_job_to_dict(job)}), 200
+
+        if job_queue.is_full():
+            response = jsonify({'error': 'Too many pending jobs, try again later'})
+            response.headers['Retry-After'] = str(int(config.JOB_POLL_INTERVAL) or 1)
+            return response, 503
+
+        # Persist the image first so the job can be picked up by any worker
+        image_id, image_path = store_upload(image_data, upload_hash, file.filename)
+        try:
+            job = CaptionJob.create(job_id, file.filename, upload_hash, image_id, image_path)
+        except Exception:
+            storage_service.release(image_path)
+            raise
+
+        # If the queue filled up meanwhile, the job stays queued in the
+        # database and an idle worker picks it up from there
+        job_queue.submit(job_id)
+
+        response = jsonify({'success': True, **_job_to_dict(job)})
+        response.headers['Location'] = url_for('jobs.get_job', job_id=job_id)
+        return response, 202
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error creating caption job: {e}")
+        return jsonify({'error': 'Failed to create caption job'}), 500
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Get the status of a caption job.
+
+    Query params:
+    - wait: Seconds to wait for the job to finish before responding
+      (long polling, default: 0, at most JOB_MAX_WAIT)
+    """
+    wait = request.args.get('wait', 0, type=float)
+    wait = min(max(wait, 0), config.JOB_MAX_WAIT)
+
+    try:
+        deadline = time.monotonic() + wait
+        job = CaptionJob.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        while job.status not in FINISHED_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Woken early by local workers; the short cap covers jobs
+            # finished by another process
+            job_queue.wait(min(remaining, 0.5))
+            job = CaptionJob.get(job_id)
+
+        return jsonify({'success': True, **_job_to_dict(job)}), 200
+
+    except Exception as e:
+        print(f"Error fetching caption job: {e}")
+        return jsonify({'error': 'Failed to fetch caption job'}), 500
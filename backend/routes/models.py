@@ -23,7 +23,7 @@ def get_available_models():
         {
             'id': 'gemini',
             'name': 'Gemini 2.5 Flash',
-            'full_name': 'gemini-2.5-flash',
+            'full_name': config.GEMINI_MODEL,
             'description': 'Google\'s latest vision-language model with fast inference. Takes a few seconds.',
             'provider': 'Google',
             'type': 'api',
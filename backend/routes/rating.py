@@ -45,6 +45,14 @@ def rate_caption():
             rating=rating
         )
 
+        if rating_record.id is None:
+            # DB_WRITE_MODE=async: queued, but not written yet, so there
+            # is no id to return
+            return jsonify({
+                'success': True,
+                'message': 'Rating accepted'
+            }), 202
+
         return jsonify({
             'success': True,
             'rating_id': rating_record.id,
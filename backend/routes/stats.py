@@ -0,0 +1,67 @@
+from flask import Blueprint, request, jsonify
+from routes.caption import get_caption_generator, admission, storage_service
+from routes.jobs import job_queue
+from services.cache_service import cache
+from services.preprocess_pool import get_preprocess_pool
+from database.write_behind import get_write_stats
+from database.models import Rating
+
+stats_bp = Blueprint('stats', __name__)
+
+
+@stats_bp.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Get runtime statistics for tuning the serving pipeline.
+
+    Returns: JSON with inference batching, admission, preprocessing, cache,
+    upload storage, database write and job queue statistics
+    """
+    try:
+        generator = get_caption_generator()
+
+        return jsonify({
+            'success': True,
+            **generator.get_stats(),
+            'admission': admission.stats(),
+            'preprocess': get_preprocess_pool().stats(),
+            'cache': cache.stats(),
+            'storage': storage_service.stats(),
+            'writes': get_write_stats(),
+            'jobs': job_queue.stats()
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching stats: {e}")
+        return jsonify({'error': 'Failed to fetch stats'}), 500
+
+
+@stats_bp.route('/stats/ratings', methods=['GET'])
+def get_rating_stats():
+    """
+    Get rating aggregates (count, average, 1-5 histogram).
+
+    Query params:
+    - image_id: Also return stats for this image
+    - day: Also return stats for this date (YYYY-MM-DD, UTC)
+    """
+    try:
+        result = {
+            'success': True,
+            'global': Rating.get_stats('global'),
+            'models': Rating.get_stats_by_scope('model'),
+        }
+
+        image_id = request.args.get('image_id')
+        if image_id:
+            result['image'] = Rating.get_stats('image', image_id)
+
+        day = request.args.get('day')
+        if day:
+            result['day'] = Rating.get_stats('day', day)
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        print(f"Error fetching rating stats: {e}")
+        return jsonify({'error': 'Failed to fetch rating stats'}), 500
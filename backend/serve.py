@@ -0,0 +1,229 @@
+"""
+Production entry point: load the model once, then fork worker processes.
+
+The master loads BLIP before forking, so every worker shares its weights
+through copy-on-write pages instead of loading a copy of its own. Workers
+accept connections on one listening socket opened by the master, each
+running a threaded WSGI server with its share of the CPU cores as torch
+threads. The master restarts workers that die.
+
+Usage:
+    python serve.py [--workers 4] [--host 0.0.0.0] [--port 5001] [--threads N]
+
+Send SIGUSR1 to the master to print a memory report. SIGTERM or SIGINT
+stops the workers after their current requests.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import config
+
+# Minimum seconds between restarts of a worker that keeps crashing
+RESTART_BACKOFF = 1.0
+
+
+def worker_threads(workers: int) -> int:
+    """Torch threads per worker, so workers don't oversubscribe the cores"""
+    if config.SERVE_TORCH_THREADS > 0:
+        return config.SERVE_TORCH_THREADS
+    return max(1, len(os.sched_getaffinity(0)) // workers)
+
+
+def process_memory(pid: int) -> dict:
+    """
+    Memory use of a process in MB, from /proc/<pid>/smaps_rollup.
+
+    rss counts shared pages in full for every process mapping them; pss
+    divides them between those processes, so pss adds up across processes.
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': fields.get('Rss', 0.0),
+        'pss_mb': fields.get('Pss', 0.0),
+        'shared_mb': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+        'private_mb': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0),
+    }
+
+
+def memory_report(pids: dict) -> str:
+    """
+    Per-process and total memory for the master and its workers.
+
+    Args:
+        pids: Process label -> pid
+    """
+    lines = [f"{'process':>12} | {'RSS MB':>8} {'PSS MB':>8} {'shared MB':>9} {'private MB':>10}"]
+    total_rss = total_pss = 0.0
+    for label, pid in pids.items():
+        try:
+            memory = process_memory(pid)
+        except OSError:
+            continue
+        total_rss += memory['rss_mb']
+        total_pss += memory['pss_mb']
+        lines.append(f"{label:>12} | {memory['rss_mb']:>8.0f} {memory['pss_mb']:>8.0f} "
+                     f"{memory['shared_mb']:>9.0f} {memory['private_mb']:>10.0f}")
+    lines.append(f"{'total':>12} | {total_rss:>8.0f} {total_pss:>8.0f}   (PSS is the real total)")
+    return '\n'.join(lines)
+
+
+def load_shared_state():
+    """Master only: everything workers should inherit instead of building themselves"""
+    import torch
+    from database.db import init_db
+
+    # The master never runs inference. One thread keeps OpenMP from
+    # starting a thread pool, which forked children can't use.
+    torch.set_num_threads(1)
+
+    init_db()
+    if not config.USE_GEMINI:
+        from models.model_loader import ModelLoader
+        loader = ModelLoader()
+        loader.load_model()
+
+        if config.INFERENCE_BACKEND == 'onnx':
+            # Export once here rather than racing in every worker; sessions
+            # are created per worker after the fork
+            from models.inference_backend import OnnxBlipBackend
+            try:
+                OnnxBlipBackend.ensure_exported(loader)
+            except Exception as e:
+                print(f"ONNX export failed, workers will fall back to PyTorch: {e}")
+
+    # Keep the cyclic GC from touching (and so copying) inherited objects
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(sock: socket.socket, host: str, port: int, threads: int):
+    """Worker body, run in a forked child"""
+    import torch
+    from werkzeug.serving import make_server
+    from database.write_behind import shutdown_write_queue
+
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    if not config.ONNX_THREADS:
+        config.ONNX_THREADS = threads
+
+    # The app (job workers, warm-up, DB and cache connections) is created
+    # after the fork, since threads and connections don't survive it
+    from app import create_app
+    server = make_server(host, port, create_app(), threaded=True, fd=sock.fileno())
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Worker {os.getpid()} serving on {host}:{port} with {threads} torch threads")
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass
+    finally:
+        server.server_close()
+        # Commit history rows still queued for a group or async write
+        shutdown_write_queue()
+
+
+class Supervisor:
+    """Forks the workers and restarts any that exit"""
+
+    def __init__(self, workers: int, host: str, port: int, threads: int):
+        self.num_workers = workers
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.workers = {}  # pid -> (slot, started_at)
+        self.stopping = False
+
+        self.sock = socket.create_server((host, port), backlog=128)
+        self.sock.set_inheritable(True)
+
+    def spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, self.host, self.port, self.threads)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers[pid] = (slot, time.monotonic())
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(self, signum, frame):
+        pids = {'master': os.getpid()}
+        for pid, (slot, _) in sorted(self.workers.items(), key=lambda item: item[1][0]):
+            pids[f'worker {slot}'] = pid
+        print(memory_report(pids), flush=True)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.report)
+
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+        print(f"Master {os.getpid()} started {self.num_workers} workers on {self.host}:{self.port}")
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            slot, started_at = self.workers.pop(pid, (None, None))
+            if slot is None or self.stopping:
+                continue
+
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            if time.monotonic() - started_at < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF)
+            if not self.stopping:
+                self.spawn(slot)
+
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=config.SERVE_WORKERS)
+    parser.add_argument('--host', default=config.SERVE_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVE_PORT)
+    parser.add_argument('--threads', type=int, help='Torch threads per worker (default: cores / workers)')
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads or worker_threads(workers)
+
+    load_shared_state()
+    Supervisor(workers, args.host, args.port, threads).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 from .image_processor import ImageProcessor
 from .cache_service import CacheService
+from .disk_cache import DiskCache
+from .near_duplicate_index import NearDuplicateIndex
 from .storage_service import StorageService
+from .job_queue import JobQueue
+from .preprocess_pool import PreprocessPool
+from .admission import AdmissionController, Overloaded
 
-__all__ = ['ImageProcessor', 'CacheService', 'StorageService']
+__all__ = ['ImageProcessor', 'CacheService', 'DiskCache', 'NearDuplicateIndex', 'StorageService', 'JobQueue', 'PreprocessPool', 'AdmissionController', 'Overloaded']
@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import config
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of queued"""
+
+    def __init__(self, retry_after: int, queued: int, estimated_wait: float):
+        super().__init__(f"Server overloaded: {queued} requests queued, ~{estimated_wait:.1f}s wait")
+        self.retry_after = retry_after
+        self.queued = queued
+        self.estimated_wait = estimated_wait
+
+
+class AdmissionController:
+    """
+    Bounds concurrent inferences, with a bounded wait queue in front.
+
+    At most max_concurrent callers hold a slot at once; the rest wait in
+    arrival order. A caller is shed with Overloaded when the queue is
+    full, when its estimated wait exceeds max_wait, or when it has waited
+    max_wait without getting a slot, so latency stays bounded instead of
+    growing with the backlog.
+
+    The estimated wait is the number of callers ahead divided by
+    max_concurrent, times an exponentially weighted moving average of how
+    long a slot is held.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_queued: Optional[int] = None,
+                 max_wait: Optional[float] = None, alpha: float = 0.2):
+        self.max_concurrent = max(1, config.ADMISSION_MAX_CONCURRENT if max_concurrent is None else max_concurrent)
+        self.max_queued = max(0, config.ADMISSION_MAX_QUEUED if max_queued is None else max_queued)
+        self.max_wait = config.ADMISSION_MAX_WAIT if max_wait is None else max_wait
+        self.alpha = alpha
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []  # tickets in arrival order
+        self._latency = None  # EWMA of slot hold time, seconds
+
+        # Stats
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def _estimate(self, ahead: int) -> float:
+        """Seconds until a caller with this many callers ahead of it gets a slot"""
+        if self._latency is None or (ahead == 0 and self._active < self.max_concurrent):
+            return 0.0
+        return self._latency * (ahead + 1) / self.max_concurrent
+
+    def _overloaded(self, queued: int, estimated_wait: float) -> Overloaded:
+        # Without a latency estimate yet, this suggests a 1s retry
+        retry_after = max(1, math.ceil(estimated_wait))
+        return Overloaded(retry_after, queued, estimated_wait)
+
+    def acquire(self, shed: bool = True, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a slot.
+
+        Args:
+            shed: If False, queue past a full queue or long estimated wait
+                instead of raising Overloaded (for background jobs, which
+                have their own queue)
+            timeout: With shed=False, raise Overloaded after waiting this
+                long (default: wait as long as it takes)
+
+        Returns:
+            Start time, to pass to release()
+
+        Raises:
+            Overloaded: If the request should be rejected with 429
+        """
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._admitted += 1
+                return time.monotonic()
+
+            queued = len(self._waiting)
+            estimated_wait = self._estimate(queued)
+            if shed and (queued >= self.max_queued or estimated_wait > self.max_wait):
+                self._rejected += 1
+                raise self._overloaded(queued, estimated_wait)
+
+            ticket = object()
+            self._waiting.append(ticket)
+            max_wait = self.max_wait if shed else timeout
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
+            try:
+                while self._waiting[0] is not ticket or self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self._timed_out += 1
+                        raise self._overloaded(len(self._waiting), self._estimate(len(self._waiting)))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # The next in line may be able to go now
+                self._cond.notify_all()
+
+            self._active += 1
+            self._admitted += 1
+            return time.monotonic()
+
+    def release(self, started: float):
+        """Give the slot back and update the latency estimate"""
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._active -= 1
+            if self._latency is None:
+                self._latency = elapsed
+            else:
+                self._latency = self.alpha * elapsed + (1 - self.alpha) * self._latency
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, shed: bool = True, timeout: Optional[float] = None):
+        """Hold a slot for the duration of a with block"""
+        started = self.acquire(shed, timeout)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def stats(self) -> dict:
+        """Get admission statistics"""
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queued': self.max_queued,
+                'active': self._active,
+                'queued': len(self._waiting),
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'latency_ms': round(self._latency * 1000, 1) if self._latency is not None else None,
+                'estimated_wait_ms': round(self._estimate(len(self._waiting)) * 1000, 1)
+            }
@@ -1,24 +1,83 @@
 import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 import config
+from .disk_cache import DiskCache
+from .near_duplicate_index import NearDuplicateIndex
+
+# Approximate per-entry bookkeeping cost (OrderedDict node, tuple, floats)
+ENTRY_OVERHEAD_BYTES = 200
+
 
 class CacheService:
-    """Simple in-memory cache for image captions"""
+    """
+    Bounded, thread-safe LRU cache for image captions.
+
+    Entries are keyed by image hash together with the model, prompt and
+    max_length used to generate them, so a model switch never returns a
+    caption produced by another model. The cache is bounded by entry
+    count and approximate size in bytes, and entries can expire after a
+    TTL.
+
+    An optional disk tier is checked on a memory miss and written
+    through on every set, so captions survive restarts and are shared
+    between worker processes.
 
-    def __init__(self):
-        self._cache = {}
+    An optional near-duplicate index reuses captions for images whose
+    perceptual hash is within a small Hamming distance of a cached one.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, disk_tier: Optional[DiskCache] = None,
+                 near_duplicates: Optional[NearDuplicateIndex] = None):
+        self._cache = OrderedDict()
+        self.disk_tier = disk_tier
+        self.near_duplicates = near_duplicates
+        self._lock = threading.Lock()
         self.enabled = config.CACHE_ENABLED
+        self.max_entries = config.CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = (config.CACHE_TTL_SECONDS if ttl is None else ttl) or None
+        self._bytes = 0
+
+        # Stats
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
 
     def _get_image_hash(self, image_bytes: bytes) -> str:
         """Generate hash for image content"""
         return hashlib.sha256(image_bytes).hexdigest()
 
-    def get(self, image_bytes: bytes) -> Optional[str]:
+    @staticmethod
+    def _default_model() -> str:
+        """Name of the model currently serving captions, as history records it"""
+        # Imported here so importing services doesn't pull in torch
+        from models.caption_generator import model_name
+        return model_name(config.USE_GEMINI)
+
+    def _make_key(self, image_hash: str, model: Optional[str] = None,
+                  prompt: Optional[str] = None, max_length: Optional[int] = None) -> str:
+        """Build a cache key from the image hash and generation settings"""
+        model = model or self._default_model()
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16] if prompt else ''
+        return f"{image_hash}:{model}:{max_length or ''}:{prompt_hash}"
+
+    def get(self, image_bytes: bytes, model: Optional[str] = None,
+            prompt: Optional[str] = None, max_length: Optional[int] = None) -> Optional[str]:
         """
         Retrieve cached caption for image.
 
         Args:
             image_bytes: Raw image bytes
+            model: Model name (defaults to the active model)
+            prompt: Prompt used for generation, if any
+            max_length: Maximum caption length used for generation, if any
 
         Returns:
             Cached caption or None if not found
@@ -26,31 +85,236 @@ class CacheService:
         if not self.enabled:
             return None
 
-        image_hash = self._get_image_hash(image_bytes)
-        return self._cache.get(image_hash)
+        key = self._make_key(self._get_image_hash(image_bytes), model, prompt, max_length)
+        return self._get(key)
 
-    def set(self, image_bytes: bytes, caption: str):
+    def set(self, image_bytes: bytes, caption: str, model: Optional[str] = None,
+            prompt: Optional[str] = None, max_length: Optional[int] = None):
         """
         Store caption in cache.
 
         Args:
             image_bytes: Raw image bytes
             caption: Generated caption
+            model: Model name (defaults to the active model)
+            prompt: Prompt used for generation, if any
+            max_length: Maximum caption length used for generation, if any
+        """
+        if not self.enabled:
+            return
+
+        key = self._make_key(self._get_image_hash(image_bytes), model, prompt, max_length)
+        self._set(key, caption)
+
+    def get_by_hash(self, image_hash: str, model: Optional[str] = None,
+                    prompt: Optional[str] = None, max_length: Optional[int] = None) -> Optional[str]:
+        """
+        Retrieve cached caption by a precomputed image hash.
+
+        Used for the upload fast path, where the raw upload bytes are
+        hashed while being read so a hit needs no decode work.
+        """
+        if not self.enabled:
+            return None
+
+        return self._get(self._make_key(image_hash, model, prompt, max_length))
+
+    def set_by_hash(self, image_hash: str, caption: str, model: Optional[str] = None,
+                    prompt: Optional[str] = None, max_length: Optional[int] = None):
+        """Store caption under a precomputed image hash"""
+        if not self.enabled:
+            return
+
+        self._set(self._make_key(image_hash, model, prompt, max_length), caption)
+
+    def get_many_by_hash(self, image_hashes: list[str], model: Optional[str] = None,
+                         prompt: Optional[str] = None, max_length: Optional[int] = None) -> list[Optional[str]]:
+        """
+        Retrieve cached captions for several precomputed image hashes.
+
+        Memory hits are resolved under one lock acquisition and the
+        remaining keys are fetched from the disk tier in one query.
+
+        Returns:
+            Cached caption or None for each hash, in order
         """
         if not self.enabled:
+            return [None] * len(image_hashes)
+
+        keys = [self._make_key(h, model, prompt, max_length) for h in image_hashes]
+        results = [None] * len(keys)
+        missing = []
+
+        with self._lock:
+            now = time.monotonic()
+            for i, key in enumerate(keys):
+                entry = self._cache.get(key)
+                if entry is not None and (entry[1] is None or entry[1] > now):
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    results[i] = entry[0]
+                else:
+                    missing.append(i)
+
+        found = {}
+        if missing and self.disk_tier is not None:
+            try:
+                found = self.disk_tier.get_many([keys[i] for i in missing])
+            except sqlite3.Error as e:
+                print(f"Disk cache lookup failed: {e}")
+
+        with self._lock:
+            for i in missing:
+                if keys[i] in found:
+                    self._hits += 1
+                    self._disk_hits += 1
+                else:
+                    self._misses += 1
+
+        for i in missing:
+            caption = found.get(keys[i])
+            if caption is not None:
+                self._set(keys[i], caption, write_through=False)
+                results[i] = caption
+        return results
+
+    def get_many(self, image_bytes_list: list[bytes], model: Optional[str] = None,
+                 prompt: Optional[str] = None, max_length: Optional[int] = None) -> list[Optional[str]]:
+        """Retrieve cached captions for several images"""
+        return self.get_many_by_hash(
+            [self._get_image_hash(b) for b in image_bytes_list], model, prompt, max_length
+        )
+
+    @property
+    def near_duplicates_enabled(self) -> bool:
+        return self.enabled and self.near_duplicates is not None
+
+    def get_near_duplicate(self, phash: int, model: Optional[str] = None,
+                           prompt: Optional[str] = None, max_length: Optional[int] = None) -> Optional[str]:
+        """
+        Retrieve the caption of a visually near-identical cached image.
+
+        Args:
+            phash: Perceptual hash from ImageProcessor.compute_dhash
+
+        Returns:
+            Cached caption or None if no image is close enough
+        """
+        if not self.near_duplicates_enabled:
+            return None
+
+        match = self.near_duplicates.find(phash, self._make_key('', model, prompt, max_length))
+        return match[0] if match else None
+
+    def set_near_duplicate(self, phash: int, caption: str, model: Optional[str] = None,
+                           prompt: Optional[str] = None, max_length: Optional[int] = None):
+        """Index caption under the image's perceptual hash"""
+        if not self.near_duplicates_enabled:
             return
 
-        image_hash = self._get_image_hash(image_bytes)
-        self._cache[image_hash] = caption
+        self.near_duplicates.add(phash, caption, self._make_key('', model, prompt, max_length))
+
+    def _get(self, key: str) -> Optional[str]:
+        """Look up a key in memory, then on disk, refreshing its LRU position"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                caption, expires_at, size = entry
+                if expires_at is not None and expires_at <= time.monotonic():
+                    del self._cache[key]
+                    self._bytes -= size
+                    self._expirations += 1
+                else:
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    return caption
+
+        caption = None
+        if self.disk_tier is not None:
+            try:
+                caption = self.disk_tier.get(key)
+            except sqlite3.Error as e:
+                print(f"Disk cache lookup failed: {e}")
+
+        with self._lock:
+            if caption is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._disk_hits += 1
+
+        # Promote to the memory tier
+        self._set(key, caption, write_through=False)
+        return caption
+
+    def _set(self, key: str, caption: str, write_through: bool = True):
+        """Insert or replace a key, evicting least recently used entries"""
+        size = len(key) + len(caption.encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._cache[key] = (caption, expires_at, size)
+            self._bytes += size
+            self._evict()
+
+        if write_through and self.disk_tier is not None:
+            try:
+                self.disk_tier.set(key, caption, ttl=self.ttl)
+            except sqlite3.Error as e:
+                print(f"Disk cache write failed: {e}")
+
+    def _evict(self):
+        """Drop LRU entries until within limits (caller holds the lock)"""
+        while self._cache and (
+            (self.max_entries and len(self._cache) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, (_, _, size) = self._cache.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
 
     def clear(self):
         """Clear all cached captions"""
-        self._cache.clear()
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+        if self.disk_tier is not None:
+            self.disk_tier.clear()
 
     def size(self) -> int:
         """Get number of cached items"""
         return len(self._cache)
 
+    def stats(self) -> dict:
+        """Get cache hit, miss and eviction counters"""
+        near_duplicate = self.near_duplicates.stats() if self.near_duplicates is not None else None
+
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._cache),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'disk_enabled': self.disk_tier is not None,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'near_duplicate': near_duplicate,
+            }
+
 
 # Global cache instance
-cache = CacheService()
+cache = CacheService(
+    disk_tier=DiskCache() if config.DISK_CACHE_ENABLED else None,
+    near_duplicates=NearDuplicateIndex() if config.NEAR_DUPLICATE_ENABLED else None
+)
@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+import config
+
+# Only refresh accessed_at when it is older than this, to keep hits read-only
+ACCESS_TOUCH_INTERVAL = 60  # seconds
+
+# Check size limits once every N writes instead of on every insert
+EVICT_CHECK_INTERVAL = 64
+
+
+class DiskCache:
+    """
+    Persistent caption cache shared by every worker process on the host.
+
+    Backed by a SQLite file in WAL mode so concurrent readers never block
+    and writers from several processes serialize on SQLite's own lock.
+    The table is bounded by entry count and total caption size; the least
+    recently accessed rows are evicted first.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        self.path = Path(path or config.DISK_CACHE_PATH)
+        self.max_entries = config.DISK_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = config.DISK_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        # Created on first use, so constructing the cache (e.g. when a
+        # spawned preprocessing worker imports this package) opens no file
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._schema_ready:
+                with self._schema_lock:
+                    if not self._schema_ready:
+                        self._init_schema(conn)
+                        self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _init_schema(conn: sqlite3.Connection):
+        """Create the cache table if it doesn't exist"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS caption_cache (
+                key TEXT PRIMARY KEY,
+                caption TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_caption_cache_accessed_at
+            ON caption_cache(accessed_at)
+        ''')
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a caption, returning None if missing or expired"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT caption, expires_at, accessed_at FROM caption_cache WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        caption, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            conn.execute('DELETE FROM caption_cache WHERE key = ?', (key,))
+            return None
+
+        if now - accessed_at > ACCESS_TOUCH_INTERVAL:
+            conn.execute('UPDATE caption_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return caption
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Look up several captions in one query, skipping missing or expired keys"""
+        if not keys:
+            return {}
+
+        now = time.time()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._connect().execute(
+            f'SELECT key, caption, expires_at FROM caption_cache WHERE key IN ({placeholders})',
+            keys
+        ).fetchall()
+        return {key: caption for key, caption, expires_at in rows
+                if expires_at is None or expires_at > now}
+
+    def set(self, key: str, caption: str, ttl: Optional[float] = None):
+        """Insert or replace a caption"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO caption_cache (key, caption, size, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (key, caption, len(key) + len(caption.encode('utf-8')), now + ttl if ttl else None, now))
+
+        with self._writes_lock:
+            self._writes += 1
+            check = self._writes % EVICT_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired rows, then least recently accessed rows until the
+        table is within its limits.
+
+        Returns:
+            Number of rows removed
+        """
+        conn = self._connect()
+        removed = conn.execute(
+            'DELETE FROM caption_cache WHERE expires_at IS NOT NULL AND expires_at <= ?',
+            (time.time(),)
+        ).rowcount
+
+        count, total = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM caption_cache'
+        ).fetchone()
+
+        excess = 0
+        if self.max_entries and count > self.max_entries:
+            excess = count - self.max_entries
+        if self.max_bytes and total > self.max_bytes and count:
+            # Trim to 90% of the byte budget, assuming average-sized rows
+            avg = total / count
+            excess = max(excess, int((total - self.max_bytes * 0.9) / avg) + 1)
+
+        if excess:
+            removed += conn.execute('''
+                DELETE FROM caption_cache WHERE key IN (
+                    SELECT key FROM caption_cache ORDER BY accessed_at LIMIT ?
+                )
+            ''', (excess,)).rowcount
+        return removed
+
+    def clear(self):
+        """Remove all cached captions"""
+        self._connect().execute('DELETE FROM caption_cache')
+
+    def size(self) -> int:
+        """Get number of cached items"""
+        return self._connect().execute('SELECT COUNT(*) FROM caption_cache').fetchone()[0]
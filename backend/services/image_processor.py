@@ -1,8 +1,17 @@
 from PIL import Image
+import hashlib
 import io
 import config
 from werkzeug.datastructures import FileStorage
 
+# Upload streams are read (and hashed) in chunks of this size
+READ_CHUNK_SIZE = 256 * 1024
+
+# Formats without DCT scaling (e.g. PNG) are box-reduced by an integer
+# factor down to this multiple of the target size before the final LANCZOS
+# resize (same default as Image.thumbnail)
+DECODE_REDUCING_GAP = 2.0
+
 class ImageProcessor:
     """Handle image validation, sanitization, and preprocessing"""
 
@@ -30,6 +39,27 @@ class ImageProcessor:
 
         return True, ""
 
+    @staticmethod
+    def read_upload(file: FileStorage) -> tuple[bytes, str]:
+        """
+        Read the upload stream, hashing it as it is read.
+
+        The hash identifies the exact uploaded bytes, so it can be used
+        for a cache lookup before any decode work is done.
+
+        Returns:
+            (image_data, sha256_hexdigest)
+        """
+        hasher = hashlib.sha256()
+        chunks = []
+        while True:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks), hasher.hexdigest()
+
     @staticmethod
     def process_image(file: FileStorage) -> Image.Image:
         """
@@ -44,27 +74,72 @@ class ImageProcessor:
         Raises:
             ValueError: If image cannot be processed
         """
-        try:
-            # Read image data
-            image_data = file.read()
+        image_data, _ = ImageProcessor.read_upload(file)
+        return ImageProcessor.decode_image(image_data)
+
+    @staticmethod
+    def decode_image(image_data: bytes) -> Image.Image:
+        """
+        Decode and sanitize raw image bytes.
 
+        Args:
+            image_data: Raw bytes of the uploaded file
+
+        Returns:
+            PIL Image object
+
+        Raises:
+            ValueError: If image cannot be processed
+        """
+        try:
             # Open with PIL (this validates it's a real image)
             image = Image.open(io.BytesIO(image_data))
 
+            max_dim = config.MAX_IMAGE_DIMENSION
+            if max(image.size) > max_dim:
+                # JPEG can decode straight to 1/2, 1/4 or 1/8 scale (DCT
+                # scaling, itself a filtered downscale). Ask for the final
+                # size: the decoder never goes below it, and the image is
+                # downscaled to MAX_IMAGE_DIMENSION before storage and
+                # inference anyway
+                scale = max_dim / max(image.size)
+                image.draft('RGB', (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+
             # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
             if image.mode != 'RGB':
                 image = image.convert('RGB')
 
             # Resize if too large (optimization)
-            max_dim = config.MAX_IMAGE_DIMENSION
             if max(image.size) > max_dim:
-                image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+                image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS,
+                                reducing_gap=DECODE_REDUCING_GAP)
 
             return image
 
         except Exception as e:
             raise ValueError(f"Failed to process image: {str(e)}")
 
+    @staticmethod
+    def compute_dhash(image: Image.Image, hash_size: int = 8) -> int:
+        """
+        Compute a difference hash (dHash) of the image.
+
+        Robust to resizing and recompression, so re-saved copies of the
+        same photo land within a few bits of each other.
+
+        Returns:
+            hash_size * hash_size bit integer
+        """
+        gray = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+        pixels = gray.tobytes()
+
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
     @staticmethod
     def image_to_bytes(image: Image.Image, format: str = 'JPEG') -> bytes:
         """Convert PIL Image to bytes"""
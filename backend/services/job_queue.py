@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+import config
+
+
+class JobQueue:
+    """
+    Bounded queue of caption jobs served by a fixed pool of worker threads.
+
+    Request threads only enqueue job ids, so a slow model call ties up
+    an inference worker instead of a web worker. The queue holds at most
+    max_queued ids; submit() reports when it is full so the caller can
+    shed load.
+
+    Job state lives in the database, not here. When a worker is idle it
+    calls backlog_fn to pick up jobs that never made it into this queue,
+    such as those left over from a restart or submitted while it was full.
+    The handler must claim each job atomically, since the same id may be
+    enqueued more than once or by another process.
+    """
+
+    def __init__(self, handler: Callable[[str], None],
+                 backlog_fn: Optional[Callable[[int], list[str]]] = None,
+                 workers: Optional[int] = None, max_queued: Optional[int] = None,
+                 poll_interval: Optional[float] = None):
+        self.handler = handler
+        self.backlog_fn = backlog_fn
+        self.workers = max(1, config.JOB_WORKERS if workers is None else workers)
+        self.max_queued = config.JOB_QUEUE_SIZE if max_queued is None else max_queued
+        self.poll_interval = config.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.pid = os.getpid()
+
+        self._queue = queue.Queue(maxsize=self.max_queued)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._finished = threading.Condition()
+        self._running = False
+        self._last_refill = 0.0
+
+        # Stats
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def start(self):
+        """Start the worker threads (idempotent, and restarts them in a forked child)"""
+        with self._lock:
+            if self.pid != os.getpid():
+                # Threads don't survive a fork; the copied state is stale
+                self.pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.max_queued)
+                self._threads = []
+                self._running = False
+            if self._running:
+                return
+            self._running = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'caption-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job_id: str) -> bool:
+        """
+        Queue a job for processing.
+
+        Returns:
+            False if the queue is full
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(job_id)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def wait(self, timeout: float):
+        """Block until any job finishes in this process or timeout passes"""
+        with self._finished:
+            self._finished.wait(timeout)
+
+    def _refill(self):
+        """Enqueue backlog jobs from the database, at most once per poll interval"""
+        now = time.monotonic()
+        with self._lock:
+            if self.backlog_fn is None or now - self._last_refill < self.poll_interval:
+                return
+            self._last_refill = now
+
+        try:
+            job_ids = self.backlog_fn(self.max_queued - self._queue.qsize())
+        except Exception as e:
+            print(f"Error loading job backlog: {e}")
+            return
+
+        for job_id in job_ids:
+            try:
+                self._queue.put_nowait(job_id)
+            except queue.Full:
+                break
+
+    def _run(self):
+        self._refill()
+        while self._running:
+            try:
+                job_id = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                self._refill()
+                continue
+
+            with self._lock:
+                self._active += 1
+            try:
+                self.handler(job_id)
+            except Exception as e:
+                print(f"Error processing job {job_id}: {e}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                with self._finished:
+                    self._finished.notify_all()
+
+    def shutdown(self, timeout: Optional[float] = 5):
+        """Stop the workers once their current job finishes"""
+        with self._lock:
+            self._running = False
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'max_queued': self.max_queued,
+                'active': self._active,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
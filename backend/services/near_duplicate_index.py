@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+import config
+
+HASH_BITS = 64
+
+
+class NearDuplicateIndex:
+    """
+    Hamming-distance index over 64-bit perceptual hashes.
+
+    Uses multi-index hashing: each hash is split into max_distance + 1
+    disjoint chunks and every chunk is indexed in its own table. By the
+    pigeonhole principle, two hashes within max_distance bits share at
+    least one identical chunk, so a lookup only has to compare against
+    the entries in max_distance + 1 buckets rather than the whole index.
+
+    Entries are scoped by a context string (model, prompt, max_length)
+    and the oldest entries are dropped once max_entries is reached.
+    """
+
+    def __init__(self, max_distance: Optional[int] = None, max_entries: Optional[int] = None):
+        self.max_distance = config.NEAR_DUPLICATE_MAX_DISTANCE if max_distance is None else max_distance
+        self.max_entries = config.NEAR_DUPLICATE_MAX_ENTRIES if max_entries is None else max_entries
+
+        # Split the hash into (max_distance + 1) chunks of near-equal width
+        num_chunks = min(self.max_distance + 1, HASH_BITS)
+        widths = [HASH_BITS // num_chunks + (1 if i < HASH_BITS % num_chunks else 0)
+                  for i in range(num_chunks)]
+        self._chunks = []
+        shift = 0
+        for width in widths:
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._entries = OrderedDict()  # (context, phash) -> caption
+        self._buckets = [{} for _ in self._chunks]  # (context, chunk) -> set of phash
+        self._lock = threading.Lock()
+
+        # Stats
+        self._lookups = 0
+        self._hits = 0
+        self._distance_total = 0
+
+    def _chunk_keys(self, context: str, phash: int):
+        for (shift, mask), buckets in zip(self._chunks, self._buckets):
+            yield buckets, (context, (phash >> shift) & mask)
+
+    def add(self, phash: int, caption: str, context: str = ''):
+        """Index a caption under its image's perceptual hash"""
+        with self._lock:
+            key = (context, phash)
+            if key in self._entries:
+                self._entries[key] = caption
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = caption
+            for buckets, bucket_key in self._chunk_keys(context, phash):
+                buckets.setdefault(bucket_key, set()).add(phash)
+
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._remove(*self._entries.popitem(last=False)[0])
+
+    def _remove(self, context: str, phash: int):
+        """Drop a hash from every chunk table (caller holds the lock)"""
+        for buckets, bucket_key in self._chunk_keys(context, phash):
+            bucket = buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(phash)
+                if not bucket:
+                    del buckets[bucket_key]
+
+    def find(self, phash: int, context: str = '') -> Optional[tuple[str, int]]:
+        """
+        Find the closest indexed hash within max_distance.
+
+        Returns:
+            (caption, hamming_distance) or None if nothing is close enough
+        """
+        with self._lock:
+            self._lookups += 1
+            best, best_distance = None, self.max_distance + 1
+
+            for buckets, bucket_key in self._chunk_keys(context, phash):
+                for candidate in buckets.get(bucket_key, ()):
+                    distance = (candidate ^ phash).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+                if best_distance == 0:
+                    break
+
+            if best is None:
+                return None
+
+            self._hits += 1
+            self._distance_total += best_distance
+            return self._entries[(context, best)], best_distance
+
+    def size(self) -> int:
+        """Get number of indexed hashes"""
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Get lookup and near-duplicate hit counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'lookups': self._lookups,
+                'hits': self._hits,
+                'hit_rate': round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+                'avg_distance': round(self._distance_total / self._hits, 2) if self._hits else 0.0,
+            }
@@ -0,0 +1,180 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Optional
+from PIL import Image
+import config
+from .image_processor import ImageProcessor
+
+
+def _preprocess(image_data: bytes) -> tuple[Image.Image, str]:
+    """Decode an upload and hash its canonical (resized, re-encoded) form"""
+    image = ImageProcessor.decode_image(image_data)
+    canonical_hash = hashlib.sha256(ImageProcessor.image_to_bytes(image)).hexdigest()
+    return image, canonical_hash
+
+
+def _preprocess_in_worker(shm_name: str, size: int) -> tuple[int, int, str]:
+    """
+    Worker side: read the upload from shared memory and write the RGB
+    pixels back into the same block.
+
+    Returns:
+        (width, height, canonical_hash)
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image, canonical_hash = _preprocess(bytes(shm.buf[:size]))
+        pixels = image.tobytes()
+        shm.buf[:len(pixels)] = pixels
+        return image.width, image.height, canonical_hash
+    finally:
+        shm.close()
+
+
+class PreprocessPool:
+    """
+    Image preprocessing (decode, RGB conversion, resize, canonical
+    re-encode and hash) in a pool of worker processes.
+
+    Keeps PIL work off the request threads so it doesn't compete with
+    PyTorch for the GIL. Uploads and decoded pixels are exchanged through
+    one shared memory block per image instead of pickling; only the
+    block name and image size cross the process boundary.
+
+    At most max_pending images are in flight; further callers block
+    until a slot frees up, so a burst of uploads queues here instead of
+    piling up in worker memory. With workers=0 everything runs inline on
+    the calling thread.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.workers = config.PREPROCESS_WORKERS if workers is None else workers
+        self.max_pending = max(1, max_pending or config.PREPROCESS_QUEUE_DEPTH * max(self.workers, 1))
+        # Decoded images are at most MAX_IMAGE_DIMENSION on each side
+        self.max_output_bytes = config.MAX_IMAGE_DIMENSION * config.MAX_IMAGE_DIMENSION * 3
+        self.pid = os.getpid()
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+
+        # Stats
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._time_total = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: never fork a process that may hold torch threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        """Drop a broken pool (e.g. a worker was killed) so the next call starts a new one"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def preprocess(self, image_data: bytes) -> tuple[Image.Image, str]:
+        """
+        Decode and resize an upload.
+
+        Args:
+            image_data: Raw bytes of the uploaded file
+
+        Returns:
+            (RGB PIL Image, canonical_hash), where canonical_hash is the
+            SHA-256 of the image re-encoded by ImageProcessor.image_to_bytes
+
+        Raises:
+            ValueError: If image cannot be processed
+        """
+        if self.workers <= 0:
+            return _preprocess(image_data)
+
+        queued_at = time.monotonic()
+        if not self._slots.acquire(timeout=config.INFERENCE_TIMEOUT):
+            raise RuntimeError("Timed out waiting for a preprocessing slot")
+        started_at = time.monotonic()
+
+        with self._stats_lock:
+            self._pending += 1
+        shm = None
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(len(image_data), self.max_output_bytes))
+            shm.buf[:len(image_data)] = image_data
+
+            try:
+                future = self._get_executor().submit(_preprocess_in_worker, shm.name, len(image_data))
+                width, height, canonical_hash = future.result()
+            except BrokenProcessPool:
+                self._reset_executor()
+                raise RuntimeError("Preprocessing worker died")
+
+            image = Image.frombytes('RGB', (width, height), bytes(shm.buf[:width * height * 3]))
+
+            with self._stats_lock:
+                self._completed += 1
+                self._wait_total += started_at - queued_at
+                self._time_total += time.monotonic() - started_at
+            return image, canonical_hash
+
+        except Exception:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            with self._stats_lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'completed': self._completed,
+                'failed': self._failed,
+                'avg_wait_ms': round(self._wait_total / self._completed * 1000, 2) if self._completed else 0.0,
+                'avg_time_ms': round(self._time_total / self._completed * 1000, 2) if self._completed else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool() -> PreprocessPool:
+    """Get the process-wide preprocessing pool (rebuilt after a fork)"""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = PreprocessPool()
+    return _pool
@@ -1,52 +1,217 @@
+import hashlib
+import io
+import os
 import uuid
 from pathlib import Path
+from typing import Optional
 from PIL import Image
 import config
+from database.db import db_connection
+from database.write_behind import flush_pending_writes
+
+# Uploads are stored at <upload folder>/ab/cd/<hash>.<ext>, so no
+# directory grows past 256 entries per level
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
 
 class StorageService:
-    """Handle file storage operations"""
+    """
+    Handle file storage operations.
+
+    Uploads are content-addressed: the file name is the SHA-256 of the
+    stored bytes, so identical uploads share one file. What is stored is
+    always the preprocessed image; the raw upload's hash is recorded
+    against it, so a repeat upload reuses the file without being decoded.
+    Each stored file has a row in the images table with its exact path
+    and a reference count. Saving an upload takes a reference, which the
+    captions row for that upload then holds; deleting the captions row
+    releases it, and the file is removed with its last reference.
+    """
 
     def __init__(self):
         self.upload_folder = config.UPLOAD_FOLDER
         self.upload_folder.mkdir(exist_ok=True)
 
-    def save_image(self, image: Image.Image, original_filename: str) -> tuple[str, str]:
+    def save_image(self, image: Image.Image, original_filename: str,
+                   upload_hash: Optional[str] = None) -> tuple[str, str]:
         """
-        Save image to disk with unique filename.
+        Save image to disk, encoded in the format its extension names.
 
         Args:
-            image: PIL Image object
+            image: PIL Image object (the preprocessed upload)
             original_filename: Original filename from upload
+            upload_hash: SHA-256 of the raw upload, so a later upload of
+                the same bytes can reuse the file via save_upload
 
         Returns:
             (unique_id, file_path)
+
+        Raises:
+            ValueError: If the extension is not an image format PIL can write
+        """
+        ext = _extension(original_filename)
+        image_format = Image.registered_extensions().get(f'.{ext}')
+        if image_format is None:
+            raise ValueError(f"Unknown image file extension: {ext}")
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=95)
+
+        return str(uuid.uuid4()), self._store(buffer.getvalue(), ext, upload_hash)
+
+    def save_upload(self, upload_hash: str) -> Optional[tuple[str, str]]:
+        """
+        Save a repeat upload by taking a reference to the file stored for
+        the first upload of the same bytes, without decoding it.
+
+        Args:
+            upload_hash: SHA-256 of the raw upload
+
+        Returns:
+            (unique_id, file_path), or None if no file is stored for these
+            bytes, in which case the caller decodes and uses save_image
+        """
+        with db_connection() as conn, conn:
+            row = conn.execute('''
+                SELECT images.hash, images.path FROM image_uploads
+                JOIN images ON images.hash = image_uploads.image_hash
+                WHERE image_uploads.upload_hash = ?
+            ''', (upload_hash,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE images SET ref_count = ref_count + 1 WHERE hash = ?', (row['hash'],))
+
+        if not Path(row['path']).exists():
+            # Removed behind our back; store it afresh from the upload
+            self.release(row['path'])
+            return None
+        return str(uuid.uuid4()), row['path']
+
+    def _store(self, data: bytes, ext: str, upload_hash: Optional[str] = None) -> str:
+        """
+        Take a reference to the file holding data, writing it if needed.
+
+        Returns:
+            Path of the stored file. For a duplicate this is the existing
+            file, whose extension comes from the first upload.
         """
-        # Generate unique ID
-        unique_id = str(uuid.uuid4())
+        image_hash = hashlib.sha256(data).hexdigest()
+        file_path = self.shard_path(image_hash, ext)
+
+        with db_connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO images (hash, path, ref_count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(hash) DO UPDATE SET ref_count = ref_count + 1
+            ''', (image_hash, str(file_path)))
+            if upload_hash:
+                conn.execute('''
+                    INSERT OR IGNORE INTO image_uploads (upload_hash, image_hash)
+                    VALUES (?, ?)
+                ''', (upload_hash, image_hash))
+            path = conn.execute('SELECT path FROM images WHERE hash = ?', (image_hash,)).fetchone()['path']
 
-        # Get extension from original filename
-        ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'jpg'
+        # The reference taken above keeps release() from removing the file,
+        # so checking after the commit is safe
+        file_path = Path(path)
+        if not file_path.exists():
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write under a temporary name so a concurrent reader never
+            # sees a partial file
+            temp_path = file_path.with_name(f'.{file_path.name}.{uuid.uuid4().hex}.tmp')
+            temp_path.write_bytes(data)
+            os.replace(temp_path, file_path)
 
-        # Create filename
-        filename = f"{unique_id}.{ext}"
-        file_path = self.upload_folder / filename
+        return path
 
-        # Save image
-        image.save(file_path, quality=95)
+    def shard_path(self, image_hash: str, ext: str) -> Path:
+        """Where an upload with this content hash is stored"""
+        shards = [image_hash[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+        return self.upload_folder.joinpath(*shards, f"{image_hash}.{ext}")
 
-        return unique_id, str(file_path)
+    def get_image_path(self, image_id: str) -> Optional[Path]:
+        """
+        Get path for stored image.
+
+        Reads the exact path recorded with the caption, or with the job
+        for an image still waiting in the job queue.
+        """
+        flush_pending_writes()
+        with db_connection() as conn:
+            row = conn.execute('SELECT image_path FROM captions WHERE id = ?', (image_id,)).fetchone()
+            if row is None:
+                row = conn.execute('''
+                    SELECT image_path FROM caption_jobs WHERE image_id = ? LIMIT 1
+                ''', (image_id,)).fetchone()
 
-    def get_image_path(self, image_id: str) -> Path:
-        """Get path for stored image"""
-        # Find file with this ID (extension may vary)
-        for file in self.upload_folder.glob(f"{image_id}.*"):
-            return file
-        return None
+        return Path(row['image_path']) if row else None
 
     def delete_image(self, image_id: str) -> bool:
-        """Delete stored image"""
-        image_path = self.get_image_path(image_id)
-        if image_path and image_path.exists():
-            image_path.unlink()
-            return True
-        return False
+        """
+        Delete an upload's caption record and release its image.
+
+        The file is only removed once no other upload refers to it.
+
+        Returns:
+            True if the upload existed
+        """
+        flush_pending_writes()
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT image_path FROM captions WHERE id = ?', (image_id,)).fetchone()
+                if row is None:
+                    conn.rollback()
+                    return False
+                # The captions delete trigger releases the reference
+                conn.execute('DELETE FROM captions WHERE id = ?', (image_id,))
+                self._collect(conn, row['image_path'])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return True
+
+    def release(self, image_path: str):
+        """Release a reference taken by a save that never got a captions row"""
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('UPDATE images SET ref_count = ref_count - 1 WHERE path = ?', (image_path,))
+                self._collect(conn, image_path)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _collect(conn, image_path: str):
+        """
+        Remove the file at image_path if nothing refers to it any more.
+
+        Runs inside the caller's write transaction, so a concurrent save
+        of the same bytes waits for the commit and then writes the file
+        again rather than finding it about to disappear.
+        """
+        recorded = conn.execute('SELECT ref_count FROM images WHERE path = ?', (image_path,)).fetchone()
+        if recorded is None:
+            # Stored before content addressing: one file per upload
+            Path(image_path).unlink(missing_ok=True)
+        elif recorded['ref_count'] <= 0:
+            conn.execute('DELETE FROM images WHERE path = ?', (image_path,))
+            Path(image_path).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Stored files, and the uploads sharing them"""
+        with db_connection() as conn:
+            row = conn.execute('SELECT COUNT(*) AS files, COALESCE(SUM(ref_count), 0) AS refs FROM images').fetchone()
+        return {
+            'files': row['files'],
+            'references': row['refs'],
+            'deduplicated': max(0, row['refs'] - row['files'])
+        }
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else 'jpg'
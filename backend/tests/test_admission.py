@@ -0,0 +1,108 @@
+import sys
+import threading
+import time
+from pathlib import Path
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.admission import AdmissionController, Overloaded
+
+
+def _hold(admission, seconds: float):
+    """Hold a slot for this long, to give the controller a latency estimate"""
+    with admission.slot():
+        time.sleep(seconds)
+
+
+def test_sheds_when_queue_is_full():
+    """Test that callers beyond the wait queue get Overloaded with a Retry-After"""
+    admission = AdmissionController(max_concurrent=1, max_queued=1, max_wait=10)
+    _hold(admission, 0.2)
+
+    started = admission.acquire()
+    waiter = threading.Thread(target=lambda: admission.release(admission.acquire()))
+    waiter.start()
+    while admission.stats()['queued'] < 1:
+        time.sleep(0.01)
+
+    with pytest.raises(Overloaded) as excinfo:
+        admission.acquire()
+    # One caller running and one queued ahead, ~0.2s each
+    assert excinfo.value.queued == 1
+    assert 0.3 < excinfo.value.estimated_wait < 1
+    assert excinfo.value.retry_after == 1
+
+    admission.release(started)
+    waiter.join(5)
+    stats = admission.stats()
+    assert stats['admitted'] == 3
+    assert stats['rejected'] == 1
+    assert stats['active'] == 0
+
+
+def test_sheds_when_estimated_wait_is_too_long():
+    """Test that a caller is rejected up front if it could not get a slot within max_wait"""
+    admission = AdmissionController(max_concurrent=1, max_queued=10, max_wait=0.1)
+    _hold(admission, 0.2)
+
+    with admission.slot():
+        with pytest.raises(Overloaded) as excinfo:
+            admission.acquire()
+    assert excinfo.value.estimated_wait > 0.1
+
+
+def test_waiters_are_admitted_in_order():
+    """Test that queued callers get slots in arrival order as slots are released"""
+    admission = AdmissionController(max_concurrent=1, max_queued=10, max_wait=10)
+    order = []
+
+    def run(i):
+        with admission.slot():
+            order.append(i)
+
+    started = admission.acquire()
+    threads = []
+    for i in range(4):
+        thread = threading.Thread(target=run, args=(i,))
+        thread.start()
+        threads.append(thread)
+        while admission.stats()['queued'] < i + 1:
+            time.sleep(0.01)
+
+    admission.release(started)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3]
+
+
+def test_background_callers_are_never_shed():
+    """Test that shed=False waits past a full queue and max_wait"""
+    admission = AdmissionController(max_concurrent=1, max_queued=0, max_wait=0.05)
+    started = admission.acquire()
+    done = threading.Event()
+
+    def run():
+        with admission.slot(shed=False):
+            done.set()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert not done.wait(0.2)
+
+    admission.release(started)
+    assert done.wait(5)
+    thread.join(5)
+    assert admission.stats()['timed_out'] == 0
+
+
+def test_background_wait_can_be_bounded():
+    """Test that shed=False with a timeout gives up once it has waited that long"""
+    admission = AdmissionController(max_concurrent=1, max_queued=0, max_wait=10)
+    started = admission.acquire()
+
+    with pytest.raises(Overloaded):
+        admission.acquire(shed=False, timeout=0.05)
+    assert admission.stats()['timed_out'] == 1
+    admission.release(started)
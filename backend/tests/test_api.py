@@ -1,3 +1,4 @@
+import hashlib
 import pytest
 import sys
 from pathlib import Path
@@ -11,8 +12,11 @@ from app import create_app
 import config
 
 @pytest.fixture
-def client():
+def client(monkeypatch):
     """Create test client"""
+    # Loading the real model in the background would hold the model
+    # loader's lock for the rest of the run
+    monkeypatch.setattr(config, 'MODEL_EAGER_LOAD', False)
     app = create_app()
     app.config['TESTING'] = True
     with app.test_client() as client:
@@ -93,6 +97,15 @@ def test_rating_submission(client):
     result = response.get_json()
     assert result['success'] is True
 
+def test_rating_async_write_mode(client, monkeypatch):
+    """Test that a queued rating is reported as accepted, without an id"""
+    monkeypatch.setattr(config, 'DB_WRITE_MODE', 'async')
+    response = client.post('/api/rate', json={'image_id': 'test-id', 'caption': 'test caption', 'rating': 4})
+    assert response.status_code == 202
+    result = response.get_json()
+    assert result['success'] is True
+    assert 'rating_id' not in result
+
 def test_history_endpoint(client):
     """Test history endpoint"""
     response = client.get('/api/history')
@@ -112,3 +125,495 @@ def test_history_invalid_limit(client):
     """Test history endpoint with invalid limit"""
     response = client.get('/api/history?limit=200')
     assert response.status_code == 400
+
+def test_caption_repeat_upload_uses_cache(client):
+    """Test that re-uploading identical bytes returns the cached caption"""
+    img = Image.new('RGB', (64, 64), color='purple')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    payload = buffer.getvalue()
+
+    first = client.post('/api/caption', data={'image': (io.BytesIO(payload), 'repeat.png')},
+                        content_type='multipart/form-data')
+    if first.status_code != 200:
+        pytest.skip("Caption generation unavailable")
+
+    second = client.post('/api/caption', data={'image': (io.BytesIO(payload), 'repeat.png')},
+                         content_type='multipart/form-data')
+    assert second.status_code == 200
+    assert second.get_json()['caption'] == first.get_json()['caption']
+    assert second.get_json()['image_id'] != first.get_json()['image_id']
+
+def test_history_pagination(client):
+    """Test that history returns a cursor and rejects a bad one"""
+    response = client.get('/api/history?limit=1')
+    assert response.status_code == 200
+    assert 'next_cursor' in response.get_json()
+
+    response = client.get('/api/history?cursor=garbage')
+    assert response.status_code == 400
+
+def test_rating_stats_endpoint(client):
+    """Test rating aggregates endpoint"""
+    client.post('/api/rate', json={'image_id': 'stats-id', 'caption': 'test caption', 'rating': 4})
+
+    response = client.get('/api/stats/ratings?image_id=stats-id')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['global']['count'] >= 1
+    assert data['image']['histogram']['4'] >= 1
+
+def _png_upload(color, name):
+    img = Image.new('RGB', (64, 64), color=color)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    buffer.seek(0)
+    return (buffer, name)
+
+def test_batch_caption_no_files(client):
+    """Test batch endpoint without files"""
+    response = client.post('/api/captions/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_batch_caption_per_item_results(client):
+    """Test that the batch endpoint reports a result or error per file"""
+    data = {
+        'images': [
+            _png_upload('orange', 'one.png'),
+            (io.BytesIO(b'not an image'), 'broken.jpg'),
+            _png_upload('teal', 'two.png'),
+            (io.BytesIO(b'text'), 'notes.txt'),
+        ]
+    }
+    response = client.post('/api/captions/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code in [200, 500]
+
+    if response.status_code == 200:
+        result = response.get_json()
+        assert [r['index'] for r in result['results']] == [0, 1, 2, 3]
+        assert [r['success'] for r in result['results']] == [True, False, True, False]
+        assert result['succeeded'] == 2
+        assert 'caption' in result['results'][0]
+        assert 'error' in result['results'][1]
+        assert 'not allowed' in result['results'][3]['error']
+
+def _parse_sse(body):
+    """Split an event-stream body into (event, data) pairs"""
+    import json
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def test_caption_stream_no_file(client):
+    """Test streaming endpoint without file"""
+    response = client.post('/api/caption/stream')
+    assert response.status_code == 400
+
+def test_caption_stream_events(client, monkeypatch):
+    """Test that tokens stream before a final event carrying the image_id"""
+    import routes.caption
+
+    class StreamingGenerator:
+        def stream_caption(self, image, max_length=50, image_hash=None, deadline=None):
+            yield from ['a ', 'streamed ', 'caption']
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', StreamingGenerator())
+
+    data = {'image': _png_upload((12, 34, 56), 'stream.png')}
+    response = client.post('/api/caption/stream', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    events = _parse_sse(response.get_data(as_text=True))
+    name, final = events[-1]
+    assert name == 'done'
+    assert 'image_id' in final
+
+    tokens = [data['text'] for name, data in events if name == 'token']
+    if final['cached']:
+        assert tokens == [final['caption']]
+    else:
+        assert tokens == ['a ', 'streamed ', 'caption']
+        assert final['caption'] == 'a streamed caption'
+
+    # The admission slot is given back once the stream is closed
+    response.close()
+    assert routes.caption.admission.stats()['active'] == 0
+
+def test_caption_candidates(client, monkeypatch):
+    """Test that num_candidates returns alternatives with the caption first"""
+    import routes.caption
+
+    class StubGenerator:
+        def generate_candidates(self, image, num_candidates, max_length=50, image_hash=None, deadline=None):
+            return [f'caption {i}' for i in range(num_candidates)]
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator())
+
+    data = {'image': _png_upload((7, 70, 140), 'candidates.png'), 'num_candidates': '3'}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['candidates'] == ['caption 0', 'caption 1', 'caption 2']
+    assert result['caption'] == 'caption 0'
+
+    data = {'image': _png_upload((7, 70, 140), 'candidates.png'), 'num_candidates': '6'}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_cache_key_follows_max_length(client, monkeypatch):
+    """Test that a cached caption is only reused for the same CAPTION_MAX_LENGTH"""
+    import routes.caption
+
+    class CountingGenerator:
+        calls = []
+
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            self.calls.append(max_length)
+            return f'caption of at most {max_length} tokens', config.MODEL_NAME
+
+    from services.cache_service import CacheService
+
+    # A memory-only cache, so earlier runs' disk entries don't answer
+    monkeypatch.setattr(routes.caption, 'cache', CacheService())
+    monkeypatch.setattr(routes.caption, 'caption_generator', CountingGenerator())
+    monkeypatch.setattr(config, 'USE_GEMINI', False)
+    monkeypatch.setattr(config, 'CAPTION_MAX_LENGTH', 23)
+
+    def post():
+        data = {'image': _png_upload((201, 17, 99), 'length.png')}
+        response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        return response.get_json()['caption']
+
+    assert post() == 'caption of at most 23 tokens'
+    assert post() == 'caption of at most 23 tokens'
+    assert CountingGenerator.calls == [23]
+
+    monkeypatch.setattr(config, 'CAPTION_MAX_LENGTH', 31)
+    assert post() == 'caption of at most 31 tokens'
+    assert CountingGenerator.calls == [23, 31]
+
+def test_failed_caption_not_cached(client, monkeypatch):
+    """Test that the placeholder returned when BLIP fails is never cached"""
+    import routes.caption
+    from models.caption_generator import FAILED_CAPTION
+    from services.cache_service import CacheService
+
+    class FailingGenerator:
+        calls = 0
+
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            FailingGenerator.calls += 1
+            return FAILED_CAPTION, config.MODEL_NAME
+
+    cache = CacheService()
+    monkeypatch.setattr(routes.caption, 'cache', cache)
+    monkeypatch.setattr(routes.caption, 'caption_generator', FailingGenerator())
+
+    for _ in range(2):
+        data = {'image': _png_upload((66, 6, 166), 'failing.png')}
+        response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+        assert response.get_json()['caption'] == FAILED_CAPTION
+    assert FailingGenerator.calls == 2
+    assert cache.stats()['entries'] == 0
+
+def test_hedged_caption_recorded_under_winner(client, monkeypatch):
+    """Test that a fallback caption is recorded and cached under the model that produced it"""
+    import routes.caption
+    from database.models import CaptionHistory
+    from services.cache_service import CacheService
+
+    class FallbackGenerator:
+        calls = 0
+
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            FallbackGenerator.calls += 1
+            return 'answered by blip', config.MODEL_NAME
+
+    monkeypatch.setattr(config, 'USE_GEMINI', True)
+    monkeypatch.setattr(routes.caption, 'cache', CacheService())
+    monkeypatch.setattr(routes.caption, 'caption_generator', FallbackGenerator())
+
+    data = {'image': _png_upload((140, 41, 3), 'hedged.png')}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['model'] == config.MODEL_NAME
+
+    records = {record.id: record for record in CaptionHistory.get_all(limit=50)}
+    assert records[result['image_id']].model_used == config.MODEL_NAME
+
+    # Cached as a BLIP caption, so a Gemini lookup doesn't return it
+    upload_hash = hashlib.sha256(_png_upload((140, 41, 3), 'hedged.png')[0].getvalue()).hexdigest()
+    cache = routes.caption.cache
+    assert cache.get_by_hash(upload_hash, **routes.caption.cache_settings()) is None
+    assert cache.get_by_hash(upload_hash, **routes.caption.cache_settings(config.MODEL_NAME)) == 'answered by blip'
+
+def test_caption_shed_when_overloaded(client, monkeypatch):
+    """Test that a cache miss gets 429 with Retry-After when no slot can be queued for"""
+    import routes.caption
+    from services.admission import AdmissionController
+
+    class StubGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            return 'never generated', config.MODEL_NAME
+
+    admission = AdmissionController(max_concurrent=1, max_queued=0, max_wait=5)
+    monkeypatch.setattr(routes.caption, 'admission', admission)
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator())
+
+    started = admission.acquire()
+    try:
+        data = {'image': _png_upload((3, 141, 59), 'busy.png')}
+        response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    finally:
+        admission.release(started)
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert admission.stats()['rejected'] == 1
+
+def test_caption_deadline_exceeded(client, monkeypatch):
+    """Test that a caption not ready before the deadline gets 504"""
+    import routes.caption
+    from models.deadline import DeadlineExceeded
+
+    class SlowGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            assert deadline is not None and deadline.remaining() <= config.INFERENCE_TIMEOUT
+            raise DeadlineExceeded("Caption request deadline exceeded")
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', SlowGenerator())
+
+    data = {'image': _png_upload((250, 5, 77), 'slow.png')}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 504
+    assert 'timed out' in response.get_json()['error']
+
+def test_deadline_starts_after_warm_up(client, monkeypatch):
+    """Test that waiting for the model to load doesn't use up the request's deadline"""
+    import time
+    import routes.caption
+    from services.cache_service import CacheService
+
+    class SlowWarmUp:
+        def wait(self, timeout=None):
+            time.sleep(0.3)
+            return True
+
+    class CheckingGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            deadline.check()
+            return 'generated after warm-up', config.MODEL_NAME
+
+    monkeypatch.setattr(config, 'INFERENCE_TIMEOUT', 0.2)
+    monkeypatch.setattr(routes.caption, 'warm_up', SlowWarmUp())
+    monkeypatch.setattr(routes.caption, 'cache', CacheService())
+    monkeypatch.setattr(routes.caption, 'caption_generator', CheckingGenerator())
+
+    data = {'image': _png_upload((19, 84, 121), 'warming.png')}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['caption'] == 'generated after warm-up'
+
+def _stored_refs(image_path):
+    """Reference count recorded for a stored upload, or None if it has no row"""
+    from database.db import db_connection
+    with db_connection() as conn:
+        row = conn.execute('SELECT ref_count FROM images WHERE path = ?', (image_path,)).fetchone()
+    return row['ref_count'] if row else None
+
+def test_failed_record_releases_upload(client, monkeypatch):
+    """Test that an upload is removed again when its caption record can't be written"""
+    import routes.caption
+    from services.cache_service import CacheService
+
+    class StubGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            return 'never recorded', config.MODEL_NAME
+
+    saved = []
+
+    class BrokenHistory:
+        @staticmethod
+        def create(image_id, image_path, caption, model_used, candidates=None):
+            saved.append(image_path)
+            assert _stored_refs(image_path) == 1
+            raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(routes.caption, 'cache', CacheService())
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator())
+    monkeypatch.setattr(routes.caption, 'CaptionHistory', BrokenHistory)
+
+    data = {'image': _png_upload((171, 3, 254), 'unrecorded.png')}
+    response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert not Path(saved[0]).exists()
+    assert _stored_refs(saved[0]) is None
+
+def test_raw_hit_reuses_stored_image(client, monkeypatch):
+    """Test that a repeat upload shares the resized file stored for the first one"""
+    import routes.caption
+    from services.cache_service import CacheService
+
+    class StubGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            return 'a large square', config.MODEL_NAME
+
+    monkeypatch.setattr(routes.caption, 'cache', CacheService())
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator())
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (1024, 768), color=(173, 5, 252)).save(buffer, format='PNG')
+    paths, refs = [], []
+    for name in ('large.png', 'large-again.png'):
+        data = {'image': (io.BytesIO(buffer.getvalue()), name)}
+        response = client.post('/api/caption', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        path = routes.caption.storage_service.get_image_path(response.get_json()['image_id'])
+        paths.append(path)
+        refs.append(_stored_refs(str(path)))
+
+    assert paths[0] == paths[1]
+    assert max(Image.open(paths[0]).size) == config.MAX_IMAGE_DIMENSION
+    assert refs[1] == refs[0] + 1
+
+def test_failed_job_releases_upload(client, monkeypatch):
+    """Test that a job that fails before recording its caption releases its upload"""
+    import routes.caption
+    from database.models import CaptionJob
+
+    class FailingGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', FailingGenerator())
+
+    data = {'image': _png_upload((172, 4, 253), 'failing-job.png')}
+    response = client.post('/api/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    response = client.get(f'/api/jobs/{job_id}?wait=10')
+    assert response.get_json()['status'] == 'failed'
+    image_path = CaptionJob.get(job_id).image_path
+    assert not Path(image_path).exists()
+    assert _stored_refs(image_path) is None
+
+def test_job_not_found(client):
+    """Test polling an unknown job"""
+    response = client.get('/api/jobs/missing')
+    assert response.status_code == 404
+
+def test_job_submit_and_long_poll(client, monkeypatch):
+    """Test that a job is accepted immediately and finishes in the background"""
+    import routes.caption
+
+    class StubGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            return 'a queued caption', config.MODEL_NAME
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator())
+
+    data = {'image': _png_upload((90, 12, 200), 'job.png')}
+    response = client.post('/api/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code in [200, 202]
+    job = response.get_json()
+    assert job['job_id']
+
+    response = client.get(f"/api/jobs/{job['job_id']}?wait=10")
+    assert response.status_code == 200
+    job = response.get_json()
+    assert job['status'] == 'done'
+    assert job['caption']
+
+def _requeue(job_id):
+    """Put a job back in the queue, as requeue_stale does"""
+    from database.db import db_connection
+    with db_connection() as conn, conn:
+        conn.execute("UPDATE caption_jobs SET status = 'queued' WHERE id = ?", (job_id,))
+
+def test_requeued_job_keeps_recorded_caption(client, monkeypatch):
+    """Test that running a job again after it was recorded doesn't undo it"""
+    import routes.caption
+    from database.models import CaptionJob
+    from routes.jobs import _process_job
+
+    class StubGenerator:
+        def __init__(self, caption):
+            self.caption = caption
+
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            return self.caption, config.MODEL_NAME
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator('the first run'))
+    data = {'image': _png_upload((174, 6, 251), 'requeued.png')}
+    job_id = client.post('/api/jobs', data=data, content_type='multipart/form-data').get_json()['job_id']
+    assert client.get(f'/api/jobs/{job_id}?wait=10').get_json()['status'] == 'done'
+    image_path = CaptionJob.get(job_id).image_path
+    refs = _stored_refs(image_path)
+
+    monkeypatch.setattr(routes.caption, 'caption_generator', StubGenerator('the second run'))
+    _requeue(job_id)
+    _process_job(job_id)
+
+    job = CaptionJob.get(job_id)
+    assert (job.status, job.caption) == ('done', 'the first run')
+    assert _stored_refs(image_path) == refs
+    assert Path(image_path).exists()
+
+def test_job_failed_after_max_attempts(client, monkeypatch):
+    """Test that a job which keeps being requeued is eventually failed"""
+    import routes.caption
+    from database.models import CaptionJob
+
+    class UnusedGenerator:
+        def generate_caption_with_model(self, image, max_length=50, image_hash=None, deadline=None):
+            raise AssertionError("should not run")
+
+    # Every claim is then one attempt too many
+    monkeypatch.setattr(routes.caption, 'caption_generator', UnusedGenerator())
+    monkeypatch.setattr(config, 'JOB_MAX_ATTEMPTS', 0)
+    data = {'image': _png_upload((175, 7, 250), 'crashing.png')}
+    job_id = client.post('/api/jobs', data=data, content_type='multipart/form-data').get_json()['job_id']
+    assert client.get(f'/api/jobs/{job_id}?wait=10').get_json()['status'] == 'failed'
+
+    job = CaptionJob.get(job_id)
+    assert 'attempts' in job.error
+    assert not Path(job.image_path).exists()
+    assert _stored_refs(job.image_path) is None
+
+def test_ready_endpoint(client):
+    """Test readiness reports warm-up state and model loading state"""
+    response = client.get('/ready')
+    assert response.status_code in [200, 503]
+    data = response.get_json()
+    assert data['ready'] == (response.status_code == 200)
+    assert 'state' in data
+    assert 'load_seconds' in data['model']
+
+def test_decode_pool_created_once(monkeypatch):
+    """Test that concurrent first batch requests share one decode pool"""
+    import threading
+    import routes.caption
+
+    monkeypatch.setattr(routes.caption, 'decode_pool', None)
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def get():
+        barrier.wait()
+        pools.append(routes.caption.get_decode_pool())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(pools) == 8
+    assert all(pool is pools[0] for pool in pools)
+    pools[0].shutdown(wait=False)
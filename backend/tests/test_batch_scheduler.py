@@ -0,0 +1,96 @@
+import pytest
+import sys
+import threading
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.batch_scheduler import BatchScheduler
+
+
+def _submit_concurrently(scheduler, items, key=None):
+    """Submit items from separate threads and collect results by item"""
+    results = {}
+
+    def worker(item):
+        results[item] = scheduler.submit(item, key=key, timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(item,)) for item in items]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_requests_are_merged():
+    """Test that concurrent submissions share one batch_fn call"""
+    calls = []
+
+    def batch_fn(items, key):
+        calls.append(list(items))
+        return [f"caption-{item}" for item in items]
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=8, max_wait_ms=200)
+    results = _submit_concurrently(scheduler, range(4))
+
+    # Each caller gets its own result back
+    assert results == {i: f"caption-{i}" for i in range(4)}
+    assert len(calls) < 4
+
+    stats = scheduler.stats()
+    assert stats['total_requests'] == 4
+    assert stats['total_batches'] == len(calls)
+    assert stats['queue_depth'] == 0
+    scheduler.shutdown()
+
+
+def test_batch_size_is_capped():
+    """Test that batches never exceed max_batch_size"""
+    sizes = []
+
+    def batch_fn(items, key):
+        sizes.append(len(items))
+        return list(items)
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=2, max_wait_ms=50)
+    _submit_concurrently(scheduler, range(5))
+
+    assert max(sizes) <= 2
+    assert sum(sizes) == 5
+    scheduler.shutdown()
+
+
+def test_different_keys_are_not_mixed():
+    """Test that items with different keys run in separate batches"""
+    seen = []
+
+    def batch_fn(items, key):
+        seen.append((key, len(items)))
+        return [key] * len(items)
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=8, max_wait_ms=50)
+    threads = [
+        threading.Thread(target=scheduler.submit, args=(i,), kwargs={'key': i % 2})
+        for i in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(n for _, n in seen) == 4
+    assert {key for key, _ in seen} == {0, 1}
+    scheduler.shutdown()
+
+
+def test_errors_propagate_to_callers():
+    """Test that a failing batch raises in every waiting caller"""
+    def batch_fn(items, key):
+        raise RuntimeError("model failure")
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        scheduler.submit('image', timeout=5)
+    scheduler.shutdown()
@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from services.cache_service import CacheService
+from services.disk_cache import DiskCache
+
+
+def test_cache_roundtrip():
+    """Test that stored captions are returned and counted as hits"""
+    cache = CacheService(max_entries=10, max_bytes=0, ttl=0)
+    assert cache.get(b'image') is None
+
+    cache.set(b'image', 'a red square')
+    assert cache.get(b'image') == 'a red square'
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+def test_cache_keys_include_generation_settings():
+    """Test that model, prompt and max_length are part of the key"""
+    cache = CacheService(max_entries=10, max_bytes=0, ttl=0)
+    cache.set(b'image', 'blip caption', model='blip', max_length=50)
+
+    assert cache.get(b'image', model='blip', max_length=50) == 'blip caption'
+    assert cache.get(b'image', model='gemini', max_length=50) is None
+    assert cache.get(b'image', model='blip', max_length=20) is None
+    assert cache.get(b'image', model='blip', prompt='be witty', max_length=50) is None
+
+
+def test_cache_evicts_least_recently_used():
+    """Test LRU eviction when the entry limit is reached"""
+    cache = CacheService(max_entries=2, max_bytes=0, ttl=0)
+    cache.set(b'a', 'caption a')
+    cache.set(b'b', 'caption b')
+    cache.get(b'a')  # 'b' is now least recently used
+    cache.set(b'c', 'caption c')
+
+    assert cache.get(b'a') == 'caption a'
+    assert cache.get(b'b') is None
+    assert cache.get(b'c') == 'caption c'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_byte_limit():
+    """Test that the byte budget bounds the cache"""
+    cache = CacheService(max_entries=0, max_bytes=1000, ttl=0)
+    for i in range(50):
+        cache.set(str(i).encode(), 'x' * 100)
+
+    stats = cache.stats()
+    assert stats['bytes'] <= 1000
+    assert stats['entries'] < 50
+
+
+def test_cache_ttl_expiry():
+    """Test that entries expire after the TTL"""
+    cache = CacheService(max_entries=10, max_bytes=0, ttl=0.05)
+    cache.set(b'image', 'short lived')
+    assert cache.get(b'image') == 'short lived'
+
+    time.sleep(0.1)
+    assert cache.get(b'image') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """Test that a fresh memory cache is refilled from the disk tier"""
+    path = tmp_path / 'cache.db'
+    first = CacheService(max_entries=10, max_bytes=0, ttl=0, disk_tier=DiskCache(path))
+    first.set(b'image', 'persisted caption')
+
+    # Simulates another worker process or a restart
+    second = CacheService(max_entries=10, max_bytes=0, ttl=0, disk_tier=DiskCache(path))
+    assert second.get(b'image') == 'persisted caption'
+    assert second.stats()['disk_hits'] == 1
+
+    # Promoted into memory, so the next lookup does not touch disk
+    assert second.get(b'image') == 'persisted caption'
+    assert second.stats()['disk_hits'] == 1
+
+
+def test_disk_tier_eviction(tmp_path):
+    """Test that the disk tier is trimmed to its entry limit"""
+    disk = DiskCache(tmp_path / 'cache.db', max_entries=10, max_bytes=0)
+    for i in range(25):
+        disk.set(f'key-{i}', f'caption {i}')
+    disk.evict()
+
+    assert disk.size() == 10
+    # Most recently written rows are kept
+    assert disk.get('key-24') == 'caption 24'
+    assert disk.get('key-0') is None
+
+
+def test_get_many_checks_memory_then_disk(tmp_path):
+    """Test bulk lookups across both tiers"""
+    disk = DiskCache(tmp_path / 'cache.db')
+    CacheService(max_entries=10, max_bytes=0, ttl=0, disk_tier=disk).set(b'on-disk', 'from disk')
+
+    cache = CacheService(max_entries=10, max_bytes=0, ttl=0, disk_tier=disk)
+    cache.set(b'in-memory', 'from memory')
+
+    assert cache.get_many([b'in-memory', b'missing', b'on-disk']) == ['from memory', None, 'from disk']
+    stats = cache.stats()
+    assert (stats['hits'], stats['disk_hits'], stats['misses']) == (2, 1, 1)
+
+
+def test_disk_tier_opened_on_first_use(tmp_path):
+    """Test that importing services (as spawned preprocessing workers do) doesn't open the disk cache"""
+    path = tmp_path / 'cache.db'
+    env = {**os.environ, 'DISK_CACHE_PATH': str(path)}
+    subprocess.run([sys.executable, '-c', 'import services'], cwd=Path(__file__).parent.parent,
+                   env=env, check=True)
+    assert not path.exists()
+
+    disk = DiskCache(path)
+    assert not path.exists()
+    disk.set('key', 'caption')
+    assert DiskCache(path).get('key') == 'caption'
+
+
+def test_default_model_matches_history(monkeypatch):
+    """Test that keys without a model use the name captions are recorded under"""
+    from models.caption_generator import model_name
+
+    cache = CacheService()
+    for use_gemini in (False, True):
+        monkeypatch.setattr(config, 'USE_GEMINI', use_gemini)
+        cache.set(b'image', 'a caption')
+        assert cache.get(b'image', model=model_name(use_gemini)) == 'a caption'
+        cache.clear()
@@ -104,3 +104,43 @@ def test_image_processor_rgb_conversion():
 
     # Check that it's RGB
     assert processed.mode == 'RGB'
+
+def test_image_processor_read_upload_hash():
+    """Test that the upload is hashed while it is read"""
+    import hashlib
+    from werkzeug.datastructures import FileStorage
+
+    data = b'\x89PNG' + bytes(range(256)) * 4096
+    file = FileStorage(stream=io.BytesIO(data), filename='big.png', content_type='image/png')
+
+    image_data, upload_hash = ImageProcessor.read_upload(file)
+
+    assert image_data == data
+    assert upload_hash == hashlib.sha256(data).hexdigest()
+
+def test_image_processor_reduced_resolution_decode():
+    """Test that large JPEGs decode at reduced scale but still match a full decode"""
+    import numpy as np
+
+    # Smooth gradient so a full decode and a DCT-scaled decode should agree
+    x = np.linspace(0, 255, 4000, dtype=np.float32)
+    y = np.linspace(0, 255, 3000, dtype=np.float32)
+    pixels = np.stack([
+        np.broadcast_to(x, (3000, 4000)),
+        np.broadcast_to(y[:, None], (3000, 4000)),
+        np.full((3000, 4000), 128, dtype=np.float32),
+    ], axis=-1).astype(np.uint8)
+
+    for mode in ['RGB', 'L']:
+        img_bytes = io.BytesIO()
+        Image.fromarray(pixels).convert(mode).save(img_bytes, format='JPEG', quality=90)
+        data = img_bytes.getvalue()
+
+        processed = ImageProcessor.decode_image(data)
+        assert processed.mode == 'RGB'
+        assert processed.size == (512, 384)
+
+        full = Image.open(io.BytesIO(data)).convert('RGB')
+        full.thumbnail((512, 512), Image.Resampling.LANCZOS, reducing_gap=None)
+        diff = np.abs(np.asarray(processed, dtype=np.float32) - np.asarray(full, dtype=np.float32))
+        assert diff.mean() < 2
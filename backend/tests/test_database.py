@@ -0,0 +1,251 @@
+import pytest
+import sys
+import threading
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from database.db import init_db, db_connection, rebuild_rating_stats
+from database.models import CaptionHistory, CaptionJob, Rating
+from database.write_behind import get_write_stats, shutdown_write_queue
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Point the database layer at a fresh file"""
+    monkeypatch.setattr(config, 'DATABASE_PATH', tmp_path / 'test.db')
+    init_db()
+    yield config.DATABASE_PATH
+    shutdown_write_queue()
+
+
+def test_connections_use_wal_and_are_reused(temp_db):
+    """Test that pooled connections are configured once and reused"""
+    with db_connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        first = conn
+
+    with db_connection() as conn:
+        assert conn is first
+
+
+def test_readers_not_blocked_by_writer(temp_db):
+    """Test that a reader proceeds while another connection holds a write transaction"""
+    CaptionHistory.create('existing', '/tmp/a.jpg', 'a caption', 'blip')
+
+    writer_ready = threading.Event()
+    release_writer = threading.Event()
+
+    def writer():
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("INSERT INTO captions (id, image_path, caption, model_used) VALUES ('new', '/tmp/b.jpg', 'b', 'blip')")
+            writer_ready.set()
+            release_writer.wait(5)
+            conn.commit()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writer_ready.wait(5)
+
+    # Sees the last committed state without waiting on the writer
+    history = CaptionHistory.get_all(limit=10)
+    assert [record.id for record in history] == ['existing']
+
+    release_writer.set()
+    thread.join()
+    assert len(CaptionHistory.get_all(limit=10)) == 2
+
+
+def test_model_api_roundtrip(temp_db):
+    """Test the model classes against the pooled connections"""
+    CaptionHistory.create('img-1', '/tmp/img-1.jpg', 'a dog', 'blip')
+    rating = Rating.create('img-1', 'a dog', 4)
+    Rating.create('img-1', 'a dog', 2)
+
+    assert rating.id is not None
+    assert len(Rating.get_by_image_id('img-1')) == 2
+    assert Rating.get_average_rating() == 3.0
+
+
+@pytest.mark.parametrize('mode', ['sync', 'group', 'async'])
+def test_reads_see_own_writes(temp_db, monkeypatch, mode):
+    """Test read-your-writes in every durability mode"""
+    monkeypatch.setattr(config, 'DB_WRITE_MODE', mode)
+
+    CaptionHistory.create('img-1', '/tmp/img-1.jpg', 'a cat', 'blip')
+    rating = Rating.create('img-1', 'a cat', 5)
+
+    if mode == 'async':
+        assert rating.id is None
+    else:
+        assert rating.id is not None
+    assert [r.rating for r in Rating.get_by_image_id('img-1')] == [5]
+    assert CaptionHistory.get_all(limit=1)[0].id == 'img-1'
+
+
+def test_group_commit_batches_concurrent_writes(temp_db, monkeypatch):
+    """Test that concurrent group-mode inserts share transactions"""
+    monkeypatch.setattr(config, 'DB_WRITE_MODE', 'group')
+
+    def rate():
+        for _ in range(20):
+            Rating.create('img-2', 'a bird', 3)
+
+    threads = [threading.Thread(target=rate) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = get_write_stats()
+    assert stats['total_writes'] == 160
+    assert stats['total_batches'] <= 160
+    assert len(Rating.get_by_image_id('img-2')) == 160
+
+
+def test_async_caption_insert_failure_raised(temp_db, monkeypatch):
+    """Test that caption inserts report failures even in async mode"""
+    import sqlite3
+    monkeypatch.setattr(config, 'DB_WRITE_MODE', 'async')
+    CaptionHistory.create('img-4', '/tmp/img-4.jpg', 'a dog', 'blip')
+
+    with pytest.raises(sqlite3.IntegrityError):
+        CaptionHistory.create('img-4', '/tmp/img-4.jpg', 'a dog', 'blip')
+    with pytest.raises(sqlite3.IntegrityError):
+        CaptionHistory.create_many([('img-4', '/tmp/img-4.jpg', 'a dog', 'blip')])
+
+
+def test_shutdown_flushes_async_writes(temp_db, monkeypatch):
+    """Test that queued writes are committed on shutdown"""
+    monkeypatch.setattr(config, 'DB_WRITE_MODE', 'async')
+    for _ in range(10):
+        Rating.create('img-3', 'a fish', 1)
+
+    shutdown_write_queue()
+
+    with db_connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM ratings WHERE image_id = 'img-3'").fetchone()[0]
+    assert count == 10
+
+
+def test_history_keyset_pagination(temp_db):
+    """Test that cursors walk every row exactly once, newest first"""
+    for i in range(25):
+        CaptionHistory.create(f'img-{i:02d}', f'/tmp/{i}.jpg', f'caption {i}', 'blip' if i % 2 else 'gemini')
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = CaptionHistory.get_page(limit=10, cursor=cursor)
+        seen.extend(record.id for record in page)
+        if cursor is None:
+            break
+
+    # Rows share a created_at second, so id breaks the tie
+    assert seen == sorted((f'img-{i:02d}' for i in range(25)), reverse=True)
+
+    page, _ = CaptionHistory.get_page(limit=50, model_used='gemini')
+    assert len(page) == 13
+    assert all(record.model_used == 'gemini' for record in page)
+
+
+def test_history_stores_candidates(temp_db):
+    """Test that alternative captions are stored with the caption"""
+    CaptionHistory.create('img-a', '/tmp/a.jpg', 'a dog', 'blip', candidates=['a dog', 'a puppy', 'a pet'])
+    CaptionHistory.create('img-b', '/tmp/b.jpg', 'a cat', 'blip')
+
+    records = {record.id: record for record in CaptionHistory.get_all()}
+    assert records['img-a'].candidates == ['a dog', 'a puppy', 'a pet']
+    assert records['img-b'].candidates is None
+
+
+def test_history_pagination_uses_index(temp_db):
+    """Test that deep pages are served by an index range scan, not a sort"""
+    with db_connection() as conn:
+        plan = ' '.join(row[3] for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT id, image_path, caption, model_used, created_at
+            FROM captions
+            WHERE model_used = ? AND (created_at, id) < (?, ?)
+            ORDER BY created_at DESC, id DESC
+            LIMIT 51
+        ''', ('blip', '2024-01-01 00:00:00', 'x')))
+
+    assert 'idx_captions_model_created_at_id' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_history_invalid_cursor(temp_db):
+    """Test that a malformed cursor is rejected"""
+    with pytest.raises(ValueError):
+        CaptionHistory.get_page(limit=10, cursor='not-a-cursor')
+
+
+def test_rating_stats_rollups(temp_db):
+    """Test that triggers keep global, model, image and day rollups current"""
+    CaptionHistory.create('img-a', '/tmp/a.jpg', 'a tree', 'blip')
+    CaptionHistory.create('img-b', '/tmp/b.jpg', 'a lake', 'gemini')
+    for image_id, value in [('img-a', 5), ('img-a', 3), ('img-b', 1)]:
+        Rating.create(image_id, 'caption', value)
+
+    overall = Rating.get_stats('global')
+    assert overall['count'] == 3
+    assert overall['average'] == 3.0
+    assert overall['histogram'] == {'1': 1, '2': 0, '3': 1, '4': 0, '5': 1}
+
+    assert Rating.get_stats('image', 'img-a')['average'] == 4.0
+    assert set(Rating.get_stats_by_scope('model')) == {'blip', 'gemini'}
+    assert len(Rating.get_stats_by_scope('day')) == 1
+    assert Rating.get_average_rating() == 3.0
+
+
+def test_rebuild_rating_stats(temp_db):
+    """Test that the backfill reproduces the trigger-maintained rollups"""
+    CaptionHistory.create('img-c', '/tmp/c.jpg', 'a road', 'blip')
+    for value in (2, 4, 4):
+        Rating.create('img-c', 'a road', value)
+    before = Rating.get_stats_by_scope('image')
+
+    with db_connection() as conn, conn:
+        conn.execute('DELETE FROM rating_stats')
+    assert Rating.get_stats('global') is None
+
+    rebuild_rating_stats()
+    assert Rating.get_stats_by_scope('image') == before
+    assert Rating.get_stats('model', 'blip')['count'] == 3
+
+
+def test_caption_job_claimed_once(temp_db):
+    """Test that only one worker can claim a queued job"""
+    CaptionJob.create('job-1', 'a.jpg', 'hash', 'image-1', '/tmp/a.jpg')
+
+    assert CaptionJob.claim('job-1')
+    assert not CaptionJob.claim('job-1')
+
+    job = CaptionJob.get('job-1')
+    assert job.status == 'running'
+    assert job.attempts == 1
+
+    CaptionJob.complete('job-1', 'a caption', 'blip')
+    job = CaptionJob.get('job-1')
+    assert job.status == 'done'
+    assert job.caption == 'a caption'
+
+
+def test_stale_caption_jobs_requeued(temp_db):
+    """Test that jobs left running by a dead worker are queued again"""
+    CaptionJob.create('job-1', 'a.jpg', 'hash', 'image-1', '/tmp/a.jpg')
+    CaptionJob.create('job-2', 'b.jpg', 'hash', 'image-2', '/tmp/b.jpg')
+    assert CaptionJob.claim('job-1')
+
+    # Recently updated jobs are left alone
+    assert CaptionJob.requeue_stale(300) == 0
+
+    with db_connection() as conn, conn:
+        conn.execute("UPDATE caption_jobs SET updated_at = datetime('now', '-1 hour') WHERE id = 'job-1'")
+
+    assert CaptionJob.requeue_stale(300) == 1
+    assert set(CaptionJob.get_queued_ids(10)) == {'job-1', 'job-2'}
@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+import torch
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.embedding_cache import EmbeddingCache
+
+# 4KB per entry
+ENTRY_BYTES = 4 * 1024
+
+
+def _embeds(value: float) -> torch.Tensor:
+    return torch.full((16, 64), float(value))
+
+
+def test_lru_eviction_by_bytes():
+    """Test that the least recently used entries are evicted past max_bytes"""
+    cache = EmbeddingCache(max_bytes=3 * ENTRY_BYTES)
+    for i in range(3):
+        cache.put(f'hash{i}', _embeds(i))
+
+    # Touch hash0 so hash1 is the oldest
+    assert torch.equal(cache.get('hash0'), _embeds(0))
+    cache.put('hash3', _embeds(3))
+
+    assert cache.get('hash1') is None
+    assert cache.get('hash0') is not None
+    assert cache.get('hash3') is not None
+
+    stats = cache.stats()
+    assert stats['entries'] == 3
+    assert stats['bytes'] == 3 * ENTRY_BYTES
+    assert stats['evictions'] == 1
+    assert stats['misses'] == 1
+
+
+def test_evicted_entries_spill_to_disk(tmp_path):
+    """Test that evicted entries are read back from the spill directory"""
+    cache = EmbeddingCache(max_bytes=ENTRY_BYTES, spill_dir=tmp_path, spill_max_bytes=1024 * 1024)
+    cache.put('aa11', _embeds(1))
+    cache.put('bb22', _embeds(2))
+    assert (tmp_path / 'aa' / 'aa11.npy').exists()
+
+    assert torch.equal(cache.get('aa11'), _embeds(1))
+    assert cache.stats()['spill_hits'] == 1
+
+    # A new instance (e.g. after a restart) finds the spilled entries too
+    restarted = EmbeddingCache(max_bytes=ENTRY_BYTES, spill_dir=tmp_path, spill_max_bytes=1024 * 1024)
+    assert torch.equal(restarted.get('bb22'), _embeds(2))
+
+
+def test_spill_directory_is_bounded(tmp_path):
+    """Test that the spill directory is pruned back under its limit"""
+    spill_max_bytes = 4 * ENTRY_BYTES
+    cache = EmbeddingCache(max_bytes=ENTRY_BYTES, spill_dir=tmp_path, spill_max_bytes=spill_max_bytes)
+    for i in range(20):
+        cache.put(f'{i:04x}', _embeds(i))
+
+    spilled = sum(path.stat().st_size for path in tmp_path.glob('*/*.npy'))
+    assert 0 < spilled <= spill_max_bytes
+    assert cache.stats()['spill_bytes'] == spilled
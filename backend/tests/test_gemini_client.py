@@ -0,0 +1,223 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import pytest
+from PIL import Image
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from models.deadline import Deadline, DeadlineExceeded
+from models.gemini_client import GeminiClient, GeminiError, GeminiUnavailable, TokenBucket
+
+
+def _payload(text: str) -> dict:
+    return {'candidates': [{'content': {'parts': [{'text': text}]}, 'finishReason': 'STOP'}]}
+
+
+class StubGemini:
+    """Local stand-in for the Gemini REST API, replaying scripted responses"""
+
+    def __init__(self):
+        self.responses = deque()  # (status, payload, headers); default is a 200 caption
+        self.requests = []  # (path, api key, client port)
+        self.delay = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                assert body['contents'][0]['parts'][1]['inline_data']['mime_type'] == 'image/jpeg'
+                with lock:
+                    stub.requests.append((self.path, self.headers['x-goog-api-key'], self.client_address[1]))
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    status, payload, headers = stub.responses.popleft() if stub.responses else (200, None, {})
+                time.sleep(stub.delay)
+
+                if payload is None:
+                    payload = _payload('a stub caption')
+                if 'alt=sse' in self.path and status == 200:
+                    chunks = [_payload(text) for text in ['a ', 'streamed ', 'caption']]
+                    data = ''.join(f'data: {json.dumps(chunk)}\r\n\r\n' for chunk in chunks).encode()
+                else:
+                    data = json.dumps(payload).encode()
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with lock:
+                    stub.in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubGemini()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def image():
+    return Image.new('RGB', (32, 32), color='green')
+
+
+def _client(stub, **kwargs):
+    options = dict(api_key='test-key', model='stub-model', base_url=stub.url, timeout=5,
+                   max_concurrency=4, requests_per_minute=0, max_retries=2,
+                   retry_base_delay=0.01, circuit_failures=2, circuit_reset=0.2)
+    options.update(kwargs)
+    return GeminiClient(**options)
+
+
+def test_generate_reuses_connections(stub, image):
+    """Test that sequential calls share one keep-alive connection"""
+    client = _client(stub)
+    for _ in range(3):
+        assert client.generate('prompt', image) == 'a stub caption'
+
+    assert [path for path, _, _ in stub.requests] == ['/v1beta/models/stub-model:generateContent'] * 3
+    assert {key for _, key, _ in stub.requests} == {'test-key'}
+    assert len({port for _, _, port in stub.requests}) == 1
+    assert client.stats()['connections_opened'] == 1
+
+
+def test_retries_transient_errors(stub, image):
+    """Test that 5xx and 429 are retried, honouring Retry-After"""
+    stub.responses.extend([(503, {'error': 'busy'}, {}), (429, {'error': 'slow down'}, {'Retry-After': '0'})])
+    client = _client(stub)
+    assert client.generate('prompt', image) == 'a stub caption'
+    assert len(stub.requests) == 3
+    assert client.stats()['retries'] == 2
+    assert client.breaker.state == 'closed'
+
+
+def test_client_errors_are_not_retried(stub, image):
+    """Test that a 400 fails at once and doesn't count against the service"""
+    stub.responses.append((400, {'error': 'bad request'}, {}))
+    client = _client(stub, circuit_failures=1)
+    with pytest.raises(GeminiError, match='HTTP 400'):
+        client.generate('prompt', image)
+    assert len(stub.requests) == 1
+    assert client.breaker.state == 'closed'
+
+
+def test_circuit_opens_and_recovers(stub, image):
+    """Test that repeated failures open the circuit, and a half-open probe closes it"""
+    client = _client(stub, max_retries=0)
+    stub.responses.extend([(500, {}, {})] * 2)
+    for _ in range(2):
+        with pytest.raises(GeminiError):
+            client.generate('prompt', image)
+    assert client.breaker.state == 'open'
+
+    # Refused without calling the server
+    with pytest.raises(GeminiUnavailable) as excinfo:
+        client.generate('prompt', image)
+    assert 0 < excinfo.value.retry_after <= 0.2
+    assert len(stub.requests) == 2
+
+    time.sleep(0.25)
+    assert client.generate('prompt', image) == 'a stub caption'
+    assert client.breaker.state == 'closed'
+
+
+def test_failed_probe_reopens_circuit(stub, image):
+    """Test that a failing half-open probe opens the circuit again"""
+    client = _client(stub, max_retries=0, circuit_failures=1)
+    stub.responses.extend([(502, {}, {}), (502, {}, {})])
+    with pytest.raises(GeminiError):
+        client.generate('prompt', image)
+    time.sleep(0.25)
+    with pytest.raises(GeminiError):
+        client.generate('prompt', image)
+    assert client.breaker.state == 'open'
+
+
+def test_calls_run_concurrently(stub, image):
+    """Test that generate_many keeps up to max_concurrency requests in flight"""
+    stub.delay = 0.2
+    client = _client(stub, max_concurrency=4)
+    started = time.monotonic()
+    captions = client.generate_many('prompt', [image] * 8)
+    elapsed = time.monotonic() - started
+
+    assert captions == ['a stub caption'] * 8
+    assert stub.max_in_flight == 4
+    assert elapsed < 1.2
+
+
+def test_stream_yields_chunks(stub, image):
+    """Test that the SSE stream is split into text pieces"""
+    client = _client(stub)
+    assert list(client.stream('prompt', image)) == ['a ', 'streamed ', 'caption']
+    assert stub.requests[0][0] == '/v1beta/models/stub-model:streamGenerateContent?alt=sse'
+    # Fully read, so the connection went back to the pool
+    assert client.stats()['idle_connections'] == 1
+
+
+def test_deadline_aborts_slow_call(stub, image):
+    """Test that a call is abandoned at its deadline and not retried past it"""
+    stub.delay = 2
+    client = _client(stub)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.generate('prompt', image, deadline=Deadline(0.3))
+    assert time.monotonic() - started < 1
+    assert len(stub.requests) == 1
+
+
+def test_token_bucket_limits_rate():
+    """Test that the bucket allows a burst and then spaces out callers"""
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == pytest.approx(0.1, abs=0.02)
+    assert bucket.reserve(max_wait=1) == pytest.approx(0.2, abs=0.02)
+    # Too long a wait takes no token
+    assert bucket.reserve(max_wait=0.05) is None
+    assert bucket.wait_time() == pytest.approx(0.3, abs=0.02)
+
+
+def test_gemini_errors_do_not_switch_to_blip(stub, image, monkeypatch):
+    """Test that a failed Gemini call leaves the generator on Gemini"""
+    from models import CaptionGenerator
+
+    monkeypatch.setattr(config, 'USE_GEMINI', True)
+    monkeypatch.setattr(config, 'GEMINI_API_BASE', stub.url)
+    monkeypatch.setattr(config, 'GEMINI_MAX_RETRIES', 0)
+    generator = CaptionGenerator()
+
+    stub.responses.append((500, {}, {}))
+    with pytest.raises(GeminiError):
+        generator.generate_caption(image)
+    assert generator.use_gemini
+
+    assert generator.generate_caption(image) == 'a stub caption'
+    stub.responses.append((200, _payload('["one", "two", "three"]'), {}))
+    assert generator.generate_candidates(image, 3) == ['one', 'two', 'three']
@@ -0,0 +1,126 @@
+import sys
+import threading
+import time
+from pathlib import Path
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.deadline import Deadline, DeadlineExceeded
+from models.hedging import Hedger, LatencyTracker, MIN_SAMPLES
+
+
+def _answer(result, seconds: float, calls: list):
+    """Backend stand-in: answers after seconds unless its deadline is cancelled first"""
+    def call(deadline):
+        calls.append(deadline)
+        cancelled = threading.Event()
+        deadline.add_callback(cancelled.set)
+        if cancelled.wait(seconds):
+            raise DeadlineExceeded("cancelled")
+        return result
+    return call
+
+
+def _failing(calls: list):
+    def call(deadline):
+        calls.append(deadline)
+        raise RuntimeError("backend down")
+    return call
+
+
+def test_child_deadlines_follow_their_parent():
+    """Test that a child expires no later than its parent and is cancelled with it"""
+    parent = Deadline(0.5)
+    child = parent.child(10)
+    assert child.expires_at == parent.expires_at
+    assert not Deadline().expired and Deadline().remaining() is None
+
+    cancelled = []
+    child.add_callback(lambda: cancelled.append(True))
+    parent.cancel()
+    assert child.expired and child.remaining() == 0
+    assert cancelled == [True]
+    with pytest.raises(DeadlineExceeded):
+        child.check()
+
+
+def test_fast_primary_is_not_hedged():
+    """Test that the fallback never starts when the primary answers within the delay"""
+    hedger = Hedger(percentile=95, min_delay=0.2, default_delay=0.2)
+    primary_calls, fallback_calls = [], []
+
+    result = hedger.call(_answer('primary', 0.01, primary_calls), _answer('fallback', 0, fallback_calls), Deadline(5))
+    assert result == ('primary', 'primary')
+    assert fallback_calls == []
+    assert hedger.stats()['hedged'] == 0
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """Test that a slow primary loses to the fallback and has its deadline cancelled"""
+    hedger = Hedger(percentile=95, min_delay=0.1, default_delay=0.1)
+    primary_calls, fallback_calls = [], []
+
+    started = time.monotonic()
+    result = hedger.call(_answer('primary', 5, primary_calls), _answer('fallback', 0.05, fallback_calls), Deadline(5))
+    assert result == ('fallback', 'fallback')
+    assert 0.1 <= time.monotonic() - started < 1
+    assert primary_calls[0].cancelled
+
+    stats = hedger.stats()
+    assert stats['hedged'] == 1
+    assert stats['fallback_wins'] == 1
+
+
+def test_failed_primary_falls_back_at_once():
+    """Test that a failing primary starts the fallback without waiting for the delay"""
+    hedger = Hedger(percentile=95, min_delay=5, default_delay=5)
+    started = time.monotonic()
+    result = hedger.call(_failing([]), _answer('fallback', 0, []), Deadline(10))
+    assert result == ('fallback', 'fallback')
+    assert time.monotonic() - started < 1
+
+
+def test_deadline_cancels_both_sides():
+    """Test that DeadlineExceeded is raised, and both calls cancelled, when neither answers"""
+    hedger = Hedger(percentile=95, min_delay=0.05, default_delay=0.05)
+    primary_calls, fallback_calls = [], []
+    with pytest.raises(DeadlineExceeded):
+        hedger.call(_answer('primary', 5, primary_calls), _answer('fallback', 5, fallback_calls), Deadline(0.3))
+    assert primary_calls[0].cancelled and fallback_calls[0].cancelled
+
+
+def test_hedge_delay_follows_primary_percentile():
+    """Test that the delay is the default until enough samples, then the p95"""
+    hedger = Hedger(percentile=95, min_delay=0.01, default_delay=3)
+    assert hedger.delay() == 3
+    for i in range(1, MIN_SAMPLES * 5 + 1):
+        hedger.latency.record(i / 100)
+    assert hedger.delay() == pytest.approx(0.95)
+
+    tracker = LatencyTracker()
+    for _ in range(MIN_SAMPLES):
+        tracker.record(0.001)
+    assert Hedger(95, min_delay=0.5, default_delay=3).delay() == 3
+
+
+def test_generator_reports_hedge_winner(monkeypatch):
+    """Test that a hedged caption is attributed to the backend that answered"""
+    import config
+    from models.caption_generator import CaptionGenerator
+
+    generator = CaptionGenerator.__new__(CaptionGenerator)
+    generator.use_gemini = True
+    generator.hedger = Hedger(percentile=95, min_delay=5, default_delay=5)
+
+    def gemini_down(image, deadline):
+        raise RuntimeError("gemini down")
+
+    monkeypatch.setattr(generator, '_generate_with_gemini', gemini_down)
+    monkeypatch.setattr(generator, '_blip_caption', lambda image, max_length, image_hash, deadline: 'from blip')
+    assert generator.generate_caption_with_model(None, deadline=Deadline(5)) == ('from blip', config.MODEL_NAME)
+
+    monkeypatch.setattr(generator, '_generate_with_gemini', lambda image, deadline: 'from gemini')
+    assert generator.generate_caption_with_model(None, deadline=Deadline(5)) == ('from gemini', 'gemini')
+    assert generator.generate_caption(None, deadline=Deadline(5)) == 'from gemini'
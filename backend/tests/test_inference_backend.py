@@ -0,0 +1,144 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+import torch
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from transformers import BlipConfig, BlipForConditionalGeneration
+import config
+from models import inference_backend
+import numpy as np
+from models.inference_backend import TorchBackend, create_backend, _sample_top_p
+
+
+def _tiny_blip():
+    """Randomly initialized BLIP small enough to build offline"""
+    torch.manual_seed(0)
+    blip_config = BlipConfig(
+        text_config={'hidden_size': 32, 'intermediate_size': 37, 'num_hidden_layers': 2,
+                     'num_attention_heads': 2, 'vocab_size': 99, 'encoder_hidden_size': 32,
+                     'bos_token_id': 1, 'sep_token_id': 2, 'eos_token_id': 2, 'pad_token_id': 0},
+        vision_config={'hidden_size': 32, 'intermediate_size': 37, 'num_hidden_layers': 2,
+                       'num_attention_heads': 2, 'image_size': 64, 'patch_size': 16},
+    )
+    model = BlipForConditionalGeneration(blip_config).eval()
+    # With the default init the image barely affects the text, so every
+    # image would get the same caption
+    image_path = [model.vision_model] + [layer.crossattention for layer in model.text_decoder.bert.encoder.layer]
+    with torch.no_grad():
+        for module in image_path:
+            for parameter in module.parameters():
+                parameter.normal_(0, 0.5)
+    return model
+
+
+def test_onnx_backend_matches_torch(monkeypatch, tmp_path):
+    """Test that the exported graphs decode the same tokens as PyTorch"""
+    pytest.importorskip('onnxruntime')
+    monkeypatch.setattr(config, 'MODEL_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(config, 'ONNX_THREADS', 1)
+
+    model = _tiny_blip()
+    loader = SimpleNamespace(model=model)
+    torch_backend = TorchBackend(loader)
+    pixel_values = torch.randn(3, 3, 64, 64)
+
+    expected = torch_backend.generate(pixel_values, max_length=12)
+    # Some captions end early and get padded, others run to max_length
+    assert (expected == 0).any() and (expected[:, -1] != 0).any()
+
+    onnx_backend = inference_backend.OnnxBlipBackend(loader)
+    assert onnx_backend.export_dir.parent == tmp_path
+
+    assert torch.allclose(onnx_backend.encode(pixel_values), torch_backend.encode(pixel_values), atol=1e-4)
+    assert onnx_backend.generate(pixel_values, max_length=12).tolist() == expected.tolist()
+
+    # Samples for each image follow each other, all starting with BOS
+    image_embeds = onnx_backend.encode(pixel_values)
+    for backend in [torch_backend, onnx_backend]:
+        samples = backend.sample(image_embeds, max_length=12, num_samples=4)
+        assert samples.shape[0] == 12
+        assert (samples[:, 0] == 1).all()
+
+
+def test_top_p_sampling_keeps_only_the_nucleus():
+    """Test that tokens outside the top_p nucleus are never sampled"""
+    rng = np.random.default_rng(0)
+    # Probabilities 0.6, 0.3, 0.1 in every row
+    logits = np.log(np.tile([[0.1, 0.6, 0.3]], (1000, 1)))
+
+    assert set(_sample_top_p(logits, 0.5, 1.0, rng)) == {1}
+    tokens = _sample_top_p(logits, 0.8, 1.0, rng)
+    assert set(tokens) == {1, 2}
+    assert 0.55 < (tokens == 1).mean() < 0.78
+
+
+def test_create_backend_falls_back_to_torch(monkeypatch):
+    """Test that a failing ONNX backend falls back to PyTorch"""
+    def unavailable(model_loader):
+        raise ImportError("No module named 'onnxruntime'")
+
+    monkeypatch.setattr(inference_backend, 'OnnxBlipBackend', unavailable)
+    backend = create_backend(SimpleNamespace(model=_tiny_blip()), 'onnx')
+    assert backend.name == 'torch'
+
+    with pytest.raises(ValueError):
+        create_backend(SimpleNamespace(model=_tiny_blip()), 'tensorrt')
+
+
+class _StepDeadline:
+    """Deadline stand-in that expires after a fixed number of checks"""
+
+    def __init__(self, checks: int):
+        self.checks = checks
+        self.calls = 0
+
+    @property
+    def expired(self):
+        self.calls += 1
+        return self.calls > self.checks
+
+    def check(self):
+        from models.deadline import DeadlineExceeded
+        if self.expired:
+            raise DeadlineExceeded("expired")
+
+
+def test_deadline_stops_decoding(monkeypatch, tmp_path):
+    """Test that both backends stop between decoder steps once the deadline expires"""
+    from models.deadline import DeadlineExceeded
+
+    monkeypatch.setattr(config, 'MODEL_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(config, 'ONNX_THREADS', 1)
+    loader = SimpleNamespace(model=_tiny_blip())
+    backends = [TorchBackend(loader)]
+    try:
+        import onnxruntime  # noqa: F401
+        backends.append(inference_backend.OnnxBlipBackend(loader))
+    except ImportError:
+        pass
+
+    image_embeds = backends[0].encode(torch.randn(1, 3, 64, 64))
+    for backend in backends:
+        deadline = _StepDeadline(checks=3)
+        with pytest.raises(DeadlineExceeded):
+            backend.decode(image_embeds, max_length=40, deadline=deadline)
+        # Stopped a few steps in, not after 40
+        assert deadline.calls <= 6
+
+
+def test_export_path_tracks_quantization_and_revision(monkeypatch):
+    """Test that an fp32 export is never reused for int8 or another model revision"""
+    model = SimpleNamespace(config=SimpleNamespace(_commit_hash='0123456789abcdef'))
+    monkeypatch.setattr(config, 'MODEL_QUANTIZATION', 'none')
+    fp32 = inference_backend.OnnxBlipBackend.export_path(model)
+    monkeypatch.setattr(config, 'MODEL_QUANTIZATION', 'int8')
+    int8 = inference_backend.OnnxBlipBackend.export_path(model)
+    assert fp32 != int8
+    assert '@0123456789ab-int8-' in int8.name
+
+    other = SimpleNamespace(config=SimpleNamespace(_commit_hash='fedcba9876543210'))
+    assert inference_backend.OnnxBlipBackend.export_path(other) != int8
@@ -0,0 +1,86 @@
+import sys
+import threading
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.job_queue import JobQueue
+
+
+def test_jobs_run_on_worker_threads():
+    """Test that submitted jobs are handled off the calling thread"""
+    handled = []
+    done = threading.Event()
+
+    def handler(job_id):
+        handled.append((job_id, threading.current_thread().name))
+        if len(handled) == 3:
+            done.set()
+
+    jobs = JobQueue(handler, workers=2, max_queued=10, poll_interval=0.05)
+    for job_id in ['a', 'b', 'c']:
+        assert jobs.submit(job_id)
+
+    assert done.wait(5)
+    jobs.shutdown()
+    assert sorted(job_id for job_id, _ in handled) == ['a', 'b', 'c']
+    assert all(name.startswith('caption-job-') for _, name in handled)
+    assert jobs.stats()['completed'] == 3
+
+
+def test_submit_rejects_when_full():
+    """Test that a full queue reports back instead of blocking"""
+    release = threading.Event()
+    jobs = JobQueue(lambda job_id: release.wait(5), workers=1, max_queued=1, poll_interval=0.05)
+
+    assert jobs.submit('running')
+    # Wait for the worker to take the first job off the queue
+    while jobs.stats()['active'] == 0:
+        release.wait(0.01)
+
+    assert jobs.submit('queued')
+    assert jobs.is_full()
+    assert not jobs.submit('rejected')
+    assert jobs.stats()['rejected'] == 1
+
+    release.set()
+    jobs.shutdown()
+
+
+def test_idle_workers_pick_up_backlog():
+    """Test that jobs not submitted in this process are loaded from the backlog"""
+    backlog = ['left-over-1', 'left-over-2']
+    handled = []
+    done = threading.Event()
+
+    def load_backlog(limit):
+        batch, backlog[:] = backlog[:limit], backlog[limit:]
+        return batch
+
+    def handler(job_id):
+        handled.append(job_id)
+        if len(handled) == 2:
+            done.set()
+
+    jobs = JobQueue(handler, backlog_fn=load_backlog, workers=1, max_queued=10, poll_interval=0.05)
+    jobs.start()
+
+    assert done.wait(5)
+    jobs.shutdown()
+    assert handled == ['left-over-1', 'left-over-2']
+
+
+def test_start_in_forked_child_starts_new_workers():
+    """Test that a queue copied into a forked process starts its own workers"""
+    done = threading.Event()
+    jobs = JobQueue(lambda job_id: done.set(), workers=1, max_queued=10, poll_interval=0.05)
+    jobs.start()
+    jobs.shutdown()
+
+    # As seen from a child: marked running, but the threads don't exist there
+    jobs._running = True
+    jobs.pid = -1
+    assert jobs.submit('after-fork')
+    assert done.wait(5)
+    jobs.shutdown()
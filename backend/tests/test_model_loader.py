@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+import torch
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from transformers import BlipConfig, BlipForConditionalGeneration
+import config
+from models.model_loader import ModelLoader
+
+
+def _tiny_blip():
+    """Randomly initialized BLIP small enough to build offline"""
+    blip_config = BlipConfig(
+        text_config={'hidden_size': 32, 'intermediate_size': 37, 'num_hidden_layers': 2,
+                     'num_attention_heads': 2, 'vocab_size': 99, 'encoder_hidden_size': 32,
+                     'bos_token_id': 1, 'sep_token_id': 2, 'eos_token_id': 2, 'pad_token_id': 0},
+        vision_config={'hidden_size': 32, 'intermediate_size': 37, 'num_hidden_layers': 2,
+                       'num_attention_heads': 2, 'image_size': 64, 'patch_size': 16},
+    )
+    return BlipForConditionalGeneration(blip_config).eval()
+
+
+def test_int8_quantizes_vision_and_text_linear_layers():
+    """Test that only Linear layers in the encoder and decoder are quantized"""
+    model = ModelLoader.quantize(_tiny_blip())
+
+    for name in ['vision_model', 'text_decoder']:
+        linear = [m for m in getattr(model, name).modules() if type(m) is torch.nn.Linear]
+        assert linear == []
+
+    pixel_values = torch.randn(1, 3, 64, 64)
+    with torch.no_grad():
+        output = model.generate(pixel_values=pixel_values, max_length=5)
+    assert output.shape[0] == 1
+
+
+def test_quantized_cache_path_is_versioned(monkeypatch, tmp_path):
+    """Test that the int8 cache file is per model and per library version"""
+    monkeypatch.setattr(config, 'MODEL_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(config, 'MODEL_NAME', 'Salesforce/blip-image-captioning-base')
+
+    path = ModelLoader.quantized_cache_path()
+    assert path.parent == tmp_path
+    assert 'Salesforce--blip-image-captioning-base' in path.name
+    assert torch.__version__ in path.name
+
+
+def test_concurrent_first_requests_load_once(monkeypatch):
+    """Test that a burst of callers shares one model load"""
+    import threading
+    import time
+    import models.model_loader
+
+    loads = []
+
+    class SlowBlip:
+        @staticmethod
+        def from_pretrained(name):
+            loads.append(name)
+            time.sleep(0.2)
+            return _tiny_blip()
+
+    monkeypatch.setattr(models.model_loader, 'BlipForConditionalGeneration', SlowBlip)
+    monkeypatch.setattr(models.model_loader, 'BlipProcessor', type('Processor', (), {
+        'from_pretrained': staticmethod(lambda name: object())
+    }))
+    monkeypatch.setattr(config, 'MODEL_QUANTIZATION', 'none')
+    monkeypatch.setattr(ModelLoader, '_model', None)
+    monkeypatch.setattr(ModelLoader, '_processor', None)
+    monkeypatch.setattr(ModelLoader, '_load_seconds', None)
+    monkeypatch.setattr(ModelLoader, '_error', None)
+    # A real load left running by an earlier test may still hold the lock
+    monkeypatch.setattr(ModelLoader, '_load_lock', threading.Lock())
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ModelLoader().load_model()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(loads) == 1
+    assert len(results) == 8
+    assert all(model is results[0][0] for model, _ in results)
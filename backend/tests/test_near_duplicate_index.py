@@ -0,0 +1,73 @@
+import io
+import random
+import sys
+from pathlib import Path
+from PIL import Image
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services import ImageProcessor
+from services.near_duplicate_index import NearDuplicateIndex
+
+
+def _flip_bits(value: int, bits: list[int]) -> int:
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_index_finds_hashes_within_distance():
+    """Test radius lookup at, inside and beyond max_distance"""
+    index = NearDuplicateIndex(max_distance=4, max_entries=0)
+    base = 0x0123456789ABCDEF
+    index.add(base, 'a beach at sunset')
+
+    assert index.find(base) == ('a beach at sunset', 0)
+    assert index.find(_flip_bits(base, [0, 17, 33, 63])) == ('a beach at sunset', 4)
+    assert index.find(_flip_bits(base, [0, 17, 33, 50, 63])) is None
+
+
+def test_index_matches_brute_force():
+    """Test that multi-index lookup agrees with a linear scan"""
+    rng = random.Random(0)
+    index = NearDuplicateIndex(max_distance=6, max_entries=0)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for i, h in enumerate(hashes):
+        index.add(h, str(i))
+
+    for _ in range(200):
+        query = _flip_bits(rng.choice(hashes), rng.sample(range(64), rng.randint(0, 8)))
+        expected = min((h ^ query).bit_count() for h in hashes)
+        match = index.find(query)
+        if expected <= 6:
+            assert match is not None and match[1] == expected
+        else:
+            assert match is None
+
+
+def test_index_scopes_by_context_and_evicts():
+    """Test that contexts are isolated and the oldest entries are dropped"""
+    index = NearDuplicateIndex(max_distance=2, max_entries=2)
+    index.add(1, 'blip caption', context='blip')
+    assert index.find(1, context='gemini') is None
+
+    index.add(2 ** 40, 'second', context='blip')
+    index.add(2 ** 50, 'third', context='blip')
+    assert index.size() == 2
+    assert index.find(2 ** 50, context='blip') == ('third', 0)
+
+
+def test_dhash_is_stable_across_resize_and_recompression():
+    """Test that a re-saved, resized copy hashes within a few bits"""
+    image = Image.new('RGB', (512, 384))
+    for x in range(0, 512, 64):
+        image.paste((x // 2, 255 - x // 2, (x * 3) % 256), (x, 0, x + 64, 384))
+
+    buffer = io.BytesIO()
+    image.resize((300, 225)).save(buffer, format='JPEG', quality=60)
+    copy = Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+
+    original_hash = ImageProcessor.compute_dhash(image)
+    copy_hash = ImageProcessor.compute_dhash(copy)
+    assert (original_hash ^ copy_hash).bit_count() <= 4
@@ -0,0 +1,51 @@
+import pytest
+import sys
+import io
+from pathlib import Path
+from PIL import Image
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.preprocess_pool import PreprocessPool
+
+
+def _jpeg(size, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def pool():
+    """One worker process shared by the tests in this module"""
+    pool = PreprocessPool(workers=1, max_pending=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_matches_inline(pool):
+    """Test that pixels and canonical hash from a worker match inline processing"""
+    data = _jpeg((1200, 800), (20, 140, 220))
+
+    image, canonical_hash = pool.preprocess(data)
+    expected, expected_hash = PreprocessPool(workers=0).preprocess(data)
+
+    assert image.mode == 'RGB'
+    assert image.size == expected.size == (512, 341)
+    assert image.tobytes() == expected.tobytes()
+    assert canonical_hash == expected_hash
+
+
+def test_invalid_image_raises_value_error(pool):
+    """Test that decode errors from a worker surface as ValueError"""
+    with pytest.raises(ValueError):
+        pool.preprocess(b'not an image')
+
+    # The pool keeps working afterwards
+    image, _ = pool.preprocess(_jpeg((64, 64), 'white'))
+    assert image.size == (64, 64)
+
+    stats = pool.stats()
+    assert stats['failed'] >= 1
+    assert stats['pending'] == 0
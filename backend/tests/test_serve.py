@@ -0,0 +1,30 @@
+import os
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+import serve
+
+
+def test_worker_threads_split_cores(monkeypatch):
+    """Test that workers share the cores instead of each using all of them"""
+    monkeypatch.setattr(config, 'SERVE_TORCH_THREADS', 0)
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(8)))
+    assert serve.worker_threads(4) == 2
+    assert serve.worker_threads(16) == 1
+
+    monkeypatch.setattr(config, 'SERVE_TORCH_THREADS', 3)
+    assert serve.worker_threads(4) == 3
+
+
+def test_memory_report_for_this_process():
+    """Test that smaps_rollup is parsed into RSS and PSS totals"""
+    memory = serve.process_memory(os.getpid())
+    assert memory['rss_mb'] > 0
+    assert 0 < memory['pss_mb'] <= memory['rss_mb']
+
+    report = serve.memory_report({'master': os.getpid()})
+    assert 'master' in report and 'total' in report
@@ -0,0 +1,124 @@
+import hashlib
+import io
+import sys
+from pathlib import Path
+import pytest
+from PIL import Image
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from database.db import init_db
+from database.models import CaptionHistory
+from database.write_behind import shutdown_write_queue
+from services.storage_service import StorageService
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """StorageService over a fresh database and upload folder"""
+    monkeypatch.setattr(config, 'DATABASE_PATH', tmp_path / 'test.db')
+    monkeypatch.setattr(config, 'UPLOAD_FOLDER', tmp_path / 'uploads')
+    init_db()
+    yield StorageService()
+    shutdown_write_queue()
+
+
+def _png_bytes(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), color=color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _save(storage, data: bytes, filename: str):
+    """Save an upload the way the routes do: reuse, else decode and store"""
+    upload_hash = hashlib.sha256(data).hexdigest()
+    saved = storage.save_upload(upload_hash)
+    if saved is None:
+        saved = storage.save_image(Image.open(io.BytesIO(data)), filename, upload_hash=upload_hash)
+    return saved
+
+
+def _upload_files(storage):
+    return [path for path in storage.upload_folder.rglob('*') if path.is_file()]
+
+
+def test_duplicates_share_one_sharded_file(storage):
+    """Test that one image is stored once, under a hash-sharded path"""
+    data = _png_bytes('red')
+    upload_hash = hashlib.sha256(data).hexdigest()
+    assert storage.save_upload(upload_hash) is None
+
+    first_id, first_path = storage.save_image(Image.open(io.BytesIO(data)), 'a.png', upload_hash=upload_hash)
+    # A repeat upload reuses the stored file without decoding
+    second_id, second_path = storage.save_upload(upload_hash)
+    # As does the same image decoded again
+    third_id, third_path = storage.save_image(Image.open(io.BytesIO(data)), 'b.PNG')
+
+    assert len({first_id, second_id, third_id}) == 3
+    assert first_path == second_path == third_path
+    relative = Path(first_path).relative_to(storage.upload_folder)
+    name = relative.parts[-1]
+    assert relative.parts[:2] == (name[:2], name[2:4])
+    assert name.endswith('.png') and len(name) == 64 + len('.png')
+    assert _upload_files(storage) == [Path(first_path)]
+    assert storage.stats() == {'files': 1, 'references': 3, 'deduplicated': 2}
+
+
+def test_lookup_uses_recorded_path(storage):
+    """Test that get_image_path returns the path stored with the caption"""
+    image_id, image_path = _save(storage, _png_bytes('green'), 'green.jpg')
+    CaptionHistory.create(image_id, image_path, 'a green square', 'blip')
+
+    assert storage.get_image_path(image_id) == Path(image_path)
+    assert storage.get_image_path('missing') is None
+
+
+def test_file_removed_with_last_reference(storage):
+    """Test that deleting one of two duplicate uploads keeps the shared file"""
+    data = _png_bytes('blue')
+    records = [_save(storage, data, 'blue.png') for _ in range(2)]
+    for image_id, image_path in records:
+        CaptionHistory.create(image_id, image_path, 'a blue square', 'blip')
+    path = Path(records[0][1])
+
+    assert storage.delete_image(records[0][0])
+    assert path.exists()
+    assert storage.get_image_path(records[0][0]) is None
+
+    assert storage.delete_image(records[1][0])
+    assert not path.exists()
+    assert not storage.delete_image(records[1][0])
+    assert storage.stats()['files'] == 0
+
+    # The upload is forgotten with its file, so it is stored afresh
+    assert storage.save_upload(hashlib.sha256(data).hexdigest()) is None
+    image_id, image_path = _save(storage, data, 'blue.png')
+    assert Path(image_path).exists()
+
+
+def test_missing_file_stored_again(storage):
+    """Test that a repeat upload whose file was removed is not reused"""
+    data = _png_bytes('black')
+    image_id, image_path = _save(storage, data, 'black.png')
+    Path(image_path).unlink()
+
+    assert storage.save_upload(hashlib.sha256(data).hexdigest()) is None
+    assert storage.stats()['references'] == 1
+    assert _save(storage, data, 'black.png')[1] == image_path
+    assert Path(image_path).exists()
+
+
+def test_release_without_caption(storage):
+    """Test that a reference never recorded in captions can be released"""
+    image_id, image_path = _save(storage, _png_bytes('white'), 'white.png')
+    storage.release(image_path)
+    assert not Path(image_path).exists()
+    assert _upload_files(storage) == []
+
+
+def test_unknown_extension_rejected(storage):
+    """Test that save_image refuses an extension it can't encode"""
+    with pytest.raises(ValueError):
+        storage.save_image(Image.new('RGB', (4, 4)), 'image.unknown')
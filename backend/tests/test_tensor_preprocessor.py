@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+import numpy as np
+import torch
+from PIL import Image
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from transformers import BlipImageProcessor
+from models.tensor_preprocessor import TensorPreprocessor
+
+# Largest allowed difference from BlipProcessor on normalized values
+TOLERANCE = 1e-5
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    sizes = [(512, 341), (341, 512), (384, 384), (80, 100), (512, 512)]
+    images = [Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8)) for w, h in sizes]
+    images.append(images[0].convert('L'))
+    images.append(images[1].convert('RGBA'))
+    return images
+
+
+def test_matches_blip_image_processor():
+    """Test that pixel values match BlipImageProcessor within tolerance"""
+    image_processor = BlipImageProcessor()
+    images = _images()
+
+    expected = image_processor(images, return_tensors='pt')['pixel_values']
+    actual = TensorPreprocessor.from_processor(image_processor)(images)
+
+    assert actual.shape == expected.shape
+    assert actual.dtype == torch.float32
+    assert torch.max(torch.abs(actual - expected)).item() < TOLERANCE
+
+
+def test_buffers_are_reused():
+    """Test that batches reuse preallocated buffers, including for smaller batches"""
+    preprocessor = TensorPreprocessor()
+    images = _images()
+
+    with preprocessor.batch(images) as first:
+        pointer = first.data_ptr()
+        expected = first.clone()
+
+    with preprocessor.batch(images[:2]) as second:
+        assert second.data_ptr() == pointer
+        assert torch.equal(second, expected[:2])
+
+    # Concurrent batches get separate buffers
+    with preprocessor.batch(images) as outer:
+        with preprocessor.batch(images) as inner:
+            assert inner.data_ptr() != outer.data_ptr()
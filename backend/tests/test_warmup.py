@@ -0,0 +1,63 @@
+import sys
+import threading
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.warmup import ModelWarmUp
+
+
+class SlowGenerator:
+    def __init__(self, release, fail=False):
+        self.release = release
+        self.fail = fail
+        self.warm_ups = 0
+
+    def warm_up(self):
+        self.warm_ups += 1
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("no weights")
+
+
+def test_not_started_counts_as_ready():
+    """Test that lazy loading mode never blocks requests"""
+    warm_up = ModelWarmUp(lambda: SlowGenerator(threading.Event()))
+    assert warm_up.ready
+    assert warm_up.wait(0)
+    assert warm_up.status()['state'] == 'not_started'
+
+
+def test_requests_wait_for_warm_up():
+    """Test that callers block until the single background warm-up finishes"""
+    release = threading.Event()
+    generator = SlowGenerator(release)
+    warm_up = ModelWarmUp(lambda: generator)
+
+    warm_up.start()
+    warm_up.start()
+    assert not warm_up.ready
+    assert not warm_up.wait(0.05)
+    assert warm_up.status()['state'] == 'warming_up'
+
+    release.set()
+    assert warm_up.wait(5)
+    assert warm_up.ready
+    assert generator.warm_ups == 1
+
+    status = warm_up.status()
+    assert status['state'] == 'ready'
+    assert status['warm_up_seconds'] is not None
+
+
+def test_failed_warm_up_not_ready():
+    """Test that a failed warm-up reports the error and releases waiters"""
+    release = threading.Event()
+    release.set()
+    warm_up = ModelWarmUp(lambda: SlowGenerator(release, fail=True))
+
+    warm_up.start()
+    assert warm_up.wait(5)
+    assert not warm_up.ready
+    assert warm_up.status()['error'] == 'no weights'